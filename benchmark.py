@@ -0,0 +1,373 @@
+"""Time the adapters on synthetic HAPI responses, so no server is needed.
+
+Each result is written as one line of JSON, with the versions and git revision
+of the run, so that runs can be compared later:
+
+python benchmark.py --output before.jsonl
+python benchmark.py --output after.jsonl
+python benchmark.py --compare before.jsonl after.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy
+
+import hapiInstrument
+import hapiSynthetic
+
+
+def _to_CDF(hapidata, tmpdir):
+    import fromHapiToCDF
+    cdfname = os.path.join(tmpdir, 'benchmark.cdf')
+    if os.path.exists(cdfname):
+        os.remove(cdfname)
+    fromHapiToCDF.to_CDF(hapidata, cdfname)
+
+
+def _to_SpaceData(hapidata, tmpdir):
+    import fromHapiToSpaceData
+    fromHapiToSpaceData.to_SpaceData(hapidata)
+
+
+def _hapi_to_time_series(hapidata, tmpdir):
+    import fromHapiToSunPy
+    fromHapiToSunPy.hapi_to_time_series(hapidata)
+
+
+ADAPTERS = {
+    'to_CDF': _to_CDF,
+    'to_SpaceData': _to_SpaceData,
+    'hapi_to_time_series': _hapi_to_time_series,
+}
+
+# kinds where the number of channels makes no difference
+_no_channels = ('scalar', 'vector')
+
+
+def run_info():
+    """return a description of this run: the time, git revision and library versions."""
+    info = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'numpy': numpy.__version__}
+    for module in ('spacepy', 'pandas', 'sunpy', 'hapiclient'):
+        try:
+            info[module] = __import__(module).__version__
+        except Exception:
+            info[module] = None
+    try:
+        info['git'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        info['git'] = None
+    return info
+
+
+def measure(adapter, hapidata, tmpdir, repeat=3, stages=False):
+    """
+    Time one conversion, and measure its peak memory.
+
+    Parameters
+    ----------
+    adapter : str
+        the name of the adapter, from ADAPTERS
+    hapidata : tuple
+        the data and metadata to convert
+    tmpdir : str
+        a directory for output files
+    repeat : int
+        the number of times to run, keeping the fastest
+    stages : bool
+        if True, run once more with hapiInstrument.Timings to time each stage
+
+    Return
+    ------
+    dict
+        'seconds', the fastest time, and 'peak_bytes', the most memory allocated at once,
+        and with stages, 'stages', the seconds of each stage.
+    """
+    run = ADAPTERS[adapter]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        run(hapidata, tmpdir)  # the first run imports modules and compiles the plan
+        seconds = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            run(hapidata, tmpdir)
+            seconds.append(time.perf_counter() - t0)
+        tracemalloc.start()
+        try:
+            run(hapidata, tmpdir)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        result = {'seconds': min(seconds), 'peak_bytes': peak}
+        if stages:
+            with hapiInstrument.Timings() as timings:
+                run(hapidata, tmpdir)
+            result['stages'] = {t.stage: t.seconds for t in timings.totals().values()}
+    return result
+
+
+def benchmark(adapters, kinds, records, channels, repeat=3, output=None, stages=False):
+    """
+    Run each adapter on each kind of synthetic response with each number of records and channels.
+
+    Parameters
+    ----------
+    adapters : list of str
+        names from ADAPTERS
+    kinds : list of str
+        names from hapiSynthetic.KINDS
+    records : list of int
+        the numbers of records
+    channels : list of int
+        the numbers of channels of spectrograms
+    repeat : int
+        the number of times each conversion is timed
+    output : file
+        if not None, each result is written to this file as a line of JSON
+    stages : bool
+        if True, also time each stage of the conversions
+
+    Return
+    ------
+    list of dict
+        the results
+    """
+    info = run_info()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for kind in kinds:
+            for nchan in (channels[:1] if kind in _no_channels else channels):
+                for nrec in records:
+                    hapidata = hapiSynthetic.synthetic_hapidata(kind, nrec, nchan)
+                    for adapter in adapters:
+                        result = {'adapter': adapter, 'kind': kind, 'records': nrec, 'channels': nchan}
+                        result.update(measure(adapter, hapidata, tmpdir, repeat, stages))
+                        result['run'] = info
+                        results.append(result)
+                        print('%-20s %-22s %9d %5d %10.4fs %8.1fMB' % (
+                            adapter, kind, nrec, nchan, result['seconds'], result['peak_bytes'] / 1e6))
+                        if stages:
+                            print('    ' + ' '.join('%s=%.4fs' % item for item in result['stages'].items()))
+                        if output is not None:
+                            output.write(json.dumps(result) + '\n')
+                            output.flush()
+    return results
+
+
+# the layouts of the CDF compared by cdf_layouts, as options of to_CDF, where 'float'
+# stores the spectrum as CDF_FLOAT rather than CDF_DOUBLE
+CDF_LAYOUTS = {
+    'plain': {},
+    'blocking': {'blocking_factor': 4096},
+    'rle': {'compression': 'rle'},
+    'gzip1': {'compression': 'gzip', 'compression_level': 1},
+    'gzip6': {'compression': 'gzip', 'compression_level': 6},
+    'gzip6+float': {'compression': 'gzip', 'compression_level': 6, 'float': True},
+}
+
+
+def cdf_layouts(records, channels, repeat=3, sparse=0.9, output=None):
+    """
+    Write and read a spectrogram with each of the CDF_LAYOUTS, reporting the size of the file
+    and the time to write it and to read it back.  Each is done both with the synthetic
+    spectrogram, and with one where the fraction sparse of the values are zero, like a
+    spectrogram of counts.
+
+    Parameters
+    ----------
+    records : int
+        the number of records
+    channels : int
+        the number of channels
+    repeat : int
+        the number of times each is timed
+    sparse : float
+        the fraction of values which are zero in the sparse spectrogram
+    output : file
+        if not None, each result is written to this file as a line of JSON
+
+    Return
+    ------
+    list of dict
+        the results
+    """
+    import spacepy.pycdf
+    import fromHapiToCDF
+
+    data, meta = hapiSynthetic.synthetic_hapidata('spectrogram', records, channels)
+    sparse_data = data.copy()
+    rng = numpy.random.default_rng(0)
+    sparse_data['spectrum'][rng.random(sparse_data['spectrum'].shape) < sparse] = 0.
+
+    info = run_info()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cdfname = os.path.join(tmpdir, 'layout.cdf')
+        for kind, d in (('spectrogram', data), ('sparse', sparse_data)):
+            for layout, opts in CDF_LAYOUTS.items():
+                opts = dict(opts)
+                if opts.pop('float', False):
+                    opts['types'] = {'spectrum': spacepy.pycdf.const.CDF_FLOAT}
+                write = read = float('inf')
+                for i in range(repeat):
+                    if os.path.exists(cdfname):
+                        os.remove(cdfname)
+                    t0 = time.perf_counter()
+                    fromHapiToCDF.to_CDF((d, meta), cdfname, **opts)
+                    t1 = time.perf_counter()
+                    with spacepy.pycdf.CDF(cdfname) as cdf:
+                        cdf['spectrum'][...]
+                    t2 = time.perf_counter()
+                    write, read = min(write, t1 - t0), min(read, t2 - t1)
+                result = {'layout': layout, 'kind': kind, 'records': records, 'channels': channels,
+                          'bytes': os.path.getsize(cdfname), 'write_seconds': write, 'read_seconds': read,
+                          'run': info}
+                results.append(result)
+                print('%-12s %-12s %9d %5d %9.1fMB %9.4fs %9.4fs' % (
+                    layout, kind, records, channels, result['bytes'] / 1e6, write, read))
+                if output is not None:
+                    output.write(json.dumps(result) + '\n')
+                    output.flush()
+    return results
+
+
+# the seconds an adapter module may take to import in a new process, most of it numpy
+IMPORT_BUDGET = 0.5
+
+# the modules timed by import_times
+IMPORT_MODULES = ('hapiAdapters', 'fromHapiToCDF', 'fromHapiToSpaceData', 'fromHapiToSunPy', 'hapiParallel',
+                  'hapiBatch', 'hapiCache', 'hapiAsync')
+
+# the libraries which the modules import only when they are used
+HEAVY_MODULES = ('pandas', 'sunpy', 'astropy', 'spacepy.pycdf', 'hapiclient', 'aiohttp')
+
+_import_script = """
+import sys, time, json
+t = time.perf_counter()
+import %s
+print(json.dumps({'seconds': time.perf_counter() - t, 'heavy': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def import_times(modules=IMPORT_MODULES, repeat=3, output=None):
+    """
+    Time the import of each module in a new Python process, as a worker process would.
+
+    Parameters
+    ----------
+    modules : list of str
+        the modules to import
+    repeat : int
+        the number of processes for each module, of which the fastest is reported
+    output : file
+        if not None, each result is written to this file as a line of JSON
+
+    Return
+    ------
+    list of dict
+        for each module, its 'seconds', whether it is 'over_budget' of IMPORT_BUDGET, and
+        which of HEAVY_MODULES it loaded, 'heavy'.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    info = run_info()
+    results = []
+    for module in modules:
+        best = None
+        for i in range(repeat):
+            out = subprocess.run([sys.executable, '-c', _import_script % (module, HEAVY_MODULES)], cwd=cwd,
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.strip().split('\n')[-1])
+            if best is None or r['seconds'] < best['seconds']:
+                best = r
+        result = {'module': module, 'seconds': best['seconds'], 'heavy': best['heavy'],
+                  'over_budget': best['seconds'] > IMPORT_BUDGET, 'run': info}
+        results.append(result)
+        print('%-22s %8.3fs %-12s %s' % (module, result['seconds'], 'OVER BUDGET' if result['over_budget'] else '',
+                                         ' '.join(result['heavy'])))
+        if output is not None:
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    return results
+
+
+def read_results(filename):
+    """return the results in the file, keyed by (adapter, kind, records, channels)."""
+    results = {}
+    with open(filename) as f:
+        for line in f:
+            r = json.loads(line)
+            if 'adapter' not in r:
+                continue
+            results[(r['adapter'], r['kind'], r['records'], r['channels'])] = r
+    return results
+
+
+def compare(before, after):
+    """
+    Print the time and memory of each result in the file after relative to the file before.
+
+    Parameters
+    ----------
+    before : str
+        the name of the earlier results file
+    after : str
+        the name of the later results file
+    """
+    old = read_results(before)
+    new = read_results(after)
+    print('%-20s %-22s %9s %5s %10s %10s %7s %7s' % (
+        'adapter', 'kind', 'records', 'chan', 'before', 'after', 'time', 'memory'))
+    for key in new:
+        if key not in old:
+            continue
+        a, b = old[key], new[key]
+        print('%-20s %-22s %9d %5d %9.4fs %9.4fs %6.2fx %6.2fx' % (
+            key + (a['seconds'], b['seconds'], b['seconds'] / a['seconds'], b['peak_bytes'] / a['peak_bytes'])))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Time the HAPI adapters on synthetic responses.')
+    parser.add_argument('--adapters', nargs='+', default=list(ADAPTERS), choices=list(ADAPTERS))
+    parser.add_argument('--kinds', nargs='+', default=list(hapiSynthetic.KINDS), choices=hapiSynthetic.KINDS)
+    parser.add_argument('--records', nargs='+', type=int, default=[1000, 100000])
+    parser.add_argument('--channels', nargs='+', type=int, default=[16, 512])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', action='store_true', help='also time each stage of the conversions')
+    parser.add_argument('--cdf-layouts', action='store_true',
+                        help='compare the size, write and read time of CDF compression and layouts')
+    parser.add_argument('--imports', action='store_true',
+                        help='time the import of each adapter module in a new process, and fail if any is over IMPORT_BUDGET')
+    parser.add_argument('--output', default='bench_output.txt', help='file to append results to')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two results files')
+    opts = parser.parse_args(args)
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    with open(opts.output, 'a') as output:
+        if opts.imports:
+            over = [r['module'] for r in import_times(repeat=opts.repeat, output=output) if r['over_budget']]
+            if len(over) > 0:
+                sys.exit('over the import budget of %gs: %s' % (IMPORT_BUDGET, ' '.join(over)))
+            return
+        if opts.cdf_layouts:
+            for nrec in opts.records:
+                for nchan in opts.channels:
+                    cdf_layouts(nrec, nchan, opts.repeat, output=output)
+            return
+        benchmark(opts.adapters, opts.kinds, opts.records, opts.channels, opts.repeat, output, opts.stages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import json
+
+import numpy
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hapiPlan import compile_plan
+from hapiTimes import isotime_to_nanoseconds
+
+# the ways write_parquet can split the records into directories, with the numpy
+# datetime unit of each
+PARTITIONS = {'year': 'Y', 'month': 'M', 'day': 'D'}
+
+
+def _column(data, p):
+    """
+    return the Arrow array of a parameter.  The values of a parameter are interleaved with the other
+    parameters in the hapiclient records, so they are copied once into a contiguous array, which
+    Arrow then uses without copying.  Each dimension of the size becomes a fixed-size list.
+    """
+    d = data[p.name]
+    if d.dtype.kind == 'U':
+        values = pa.array(d.reshape(-1).tolist(), type=pa.string())
+    elif d.dtype.kind == 'S':
+        values = pa.array(d.reshape(-1).tolist(), type=pa.binary(d.dtype.itemsize))
+    else:
+        values = pa.array(numpy.ascontiguousarray(d).reshape(-1))
+    for n in reversed(p.size):
+        values = pa.FixedSizeListArray.from_arrays(values, n)
+    return values
+
+
+def _field_metadata(p):
+    """return the Arrow field metadata of a parameter: its units, fill, description and bins."""
+    metadata = {'units': p.units}
+    if p.fill is not None:
+        metadata['fill'] = p.fill
+    if p.description is not None:
+        metadata['description'] = p.description
+    if len(p.bins) > 0:
+        metadata['bins'] = json.dumps(p.bins)
+    return metadata
+
+
+def to_Table(hapidata):
+    """Reformat the response from the Python hapiclient to an Arrow Table.
+
+    The time is a timestamp column, in nanoseconds and UTC.  Vectors and spectrograms
+    are fixed-size list columns, nested for each dimension.  The units, fill, description
+    and bins of each parameter are in the metadata of its field, and the whole HAPI info
+    response is in the schema metadata, under "hapi".
+
+    hapidata = hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
+    table = to_Table(hapidata)
+
+    Parameters
+    ----------
+    hapidata : tuple
+        this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
+
+    Return
+    ------
+    pyarrow.Table
+        a column for each parameter
+    """
+    data, meta = hapidata
+    plan = compile_plan(meta)
+
+    ns = isotime_to_nanoseconds(data[plan.time_name])
+    columns = [pa.array(ns.view('M8[ns]'), type=pa.timestamp('ns', tz='UTC'))]
+    fields = [pa.field(plan.time_name, columns[0].type, metadata={'units': plan.time.units})]
+
+    for p in plan.parameters:
+        column = _column(data, p)
+        columns.append(column)
+        fields.append(pa.field(p.name, column.type, metadata=_field_metadata(p)))
+
+    info = {k: v for k, v in meta.items() if not k.startswith('x_')}
+    schema = pa.schema(fields, metadata={'hapi': json.dumps(info, default=str)})
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def hapi_meta(table):
+    """
+    Return the HAPI info response kept in the schema of a table from to_Table.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        the table, from to_Table or read_parquet
+
+    Return
+    ------
+    dict
+        the info response
+    """
+    return json.loads(table.schema.metadata[b'hapi'])
+
+
+def write_parquet(hapidata, root_path, partition='day', **kwargs):
+    """Write the response from the Python hapiclient to a Parquet dataset, in a directory
+    for each day, month or year, like root_path/date=2016-01-01/.
+
+    hapidata = hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
+    write_parquet(hapidata, '/data/parquet/AC_H0_MFI')
+
+    Parameters
+    ----------
+    hapidata : tuple
+        this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
+    root_path : str
+        the directory of the dataset
+    partition : str
+        'day', 'month' or 'year', the time in each directory, or None for no directories
+    kwargs
+        passed to pyarrow.parquet.write_to_dataset, like compression='zstd'
+    """
+    table = to_Table(hapidata)
+    if partition is None:
+        pq.write_to_dataset(table, root_path, **kwargs)
+        return
+    if partition not in PARTITIONS:
+        raise ValueError('partition must be one of %s or None, not %s' % (list(PARTITIONS), partition))
+
+    times = table.column(0).to_numpy().astype('M8[%s]' % PARTITIONS[partition])
+    dates = numpy.datetime_as_string(times)
+    table = table.append_column('date', pa.array(dates).dictionary_encode())
+    pq.write_to_dataset(table, root_path, partition_cols=['date'], **kwargs)
+
+
+def read_parquet(path, columns=None, filters=None):
+    """
+    Read a Parquet file or dataset written by write_parquet, memory-mapping the files.
+
+    table = read_parquet('/data/parquet/AC_H0_MFI', filters=[('date', '>=', '2016-01-02')])
+
+    Parameters
+    ----------
+    path : str
+        the file or the directory of the dataset
+    columns : list of str
+        the columns to read, or None for all
+    filters : list
+        filters on the partition or other columns, as for pyarrow.parquet.read_table
+
+    Return
+    ------
+    pyarrow.Table
+        the records, in time order
+    """
+    table = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+    if 'date' in table.column_names:
+        table = table.drop_columns(['date'])
+    if table.num_rows > 1 and pa.types.is_timestamp(table.schema.types[0]):
+        time_name = table.schema.names[0]
+        times = table.column(0).to_numpy()
+        if numpy.any(times[1:] < times[:-1]):
+            table = table.sort_by(time_name)
+    return table
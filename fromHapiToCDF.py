@@ -1,9 +1,34 @@
 import os.path
+import ctypes
 import datetime
-import re
+import json
 
-import spacepy.pycdf
-from hapiclient.hapitime import hapitime2datetime
+import numpy
+
+from hapiInstrument import stage
+from hapiPlan import compile_plan
+from hapiRecords import parse_csv
+from hapiTimes import isotime_to_tt2000
+
+# The number of bytes read at once by stream_to_CDF.
+BLOCKSIZE = 16 * 1024 * 1024
+
+# The CDF type of each HAPI type, named in spacepy.pycdf.const, which is imported only when
+# a CDF is written.  Strings and isotimes have as many elements as their length.
+CDF_TYPES = {
+    'double': 'CDF_DOUBLE',
+    'integer': 'CDF_INT4',
+    'string': 'CDF_CHAR',
+    'isotime': 'CDF_CHAR',
+}
+
+# The CDF compression for each name accepted by CDFWriter and to_CDF, named in spacepy.pycdf.const.
+COMPRESSIONS = {
+    'gzip': 'GZIP_COMPRESSION',
+    'rle': 'RLE_COMPRESSION',
+    'huff': 'HUFF_COMPRESSION',
+    'ahuff': 'AHUFF_COMPRESSION',
+}
 
 
 def handle_bins(cdf, name, bins):
@@ -16,35 +41,352 @@ def handle_bins(cdf, name, bins):
         the cdf to add the variable
     name : str
         the name of the variable
-    bins : str
-        the "bins" node of the HAPI response
+    bins : BinsPlan
+        the "bins" node of the HAPI response, from the ConversionPlan
     """
-    if 'centers' in bins:
-        centers = [float(v) for v in bins['centers']]
-    else:
-        ranges = bins['ranges']
+    import spacepy.pycdf
+    if bins.centers is None:
+        return
 
-    if 'centers' not in locals():
-        centers = [a[0] + (a[1] - a[0]) / 2 for a in ranges]
-
-    cdf[name] = centers
-    cdf[name].attrs['UNITS'] = bins['units']
+    double = spacepy.pycdf.const.CDF_DOUBLE
+    cdf.new(name, data=bins.centers, type=double, recVary=False)
+    cdf[name].attrs['UNITS'] = bins.units
     cdf[name].attrs['VAR_TYPE'] = 'support_data'
 
-    if 'ranges' in locals():
-        import numpy
-        delta_plus_var = numpy.zeros(len(centers))
-        for i in range(len(centers)):
-            delta_plus_var[i] = ranges[i][1] - centers[i]
-        delta_minus_var = numpy.zeros(len(centers))
-        for i in range(len(centers)):
-            delta_minus_var[i] = centers[i] - ranges[i][0]
-        cdf[name + 'DeltaMinus'] = delta_minus_var
-        cdf[name + 'DeltaPlus'] = delta_plus_var
+    if bins.delta_minus is not None:
+        cdf.new(name + 'DeltaMinus', data=bins.delta_minus, type=double, recVary=False)
+        cdf.new(name + 'DeltaPlus', data=bins.delta_plus, type=double, recVary=False)
         cdf[name].attrs['DELTA_PLUS_VAR'] = name + 'DeltaPlus'
         cdf[name].attrs['DELTA_MINUS_VAR'] = name + 'DeltaMinus'
 
-def to_CDF(hapidata, cdfname):
+
+def cdf_type(p, types=None):
+    """
+    Return the CDF type and number of elements used to store a HAPI parameter.
+
+    Parameters
+    ----------
+    p : ParameterPlan
+        the parameter, from the ConversionPlan
+    types : dict
+        the CDF type to use for some parameters, by name, instead of the type in CDF_TYPES,
+        like {'flux': spacepy.pycdf.const.CDF_FLOAT}.
+
+    Return
+    ------
+    tuple
+        the spacepy.pycdf.const type and the number of elements
+    """
+    import spacepy.pycdf
+    if types is not None and p.name in types:
+        ctype = types[p.name]
+    elif p.type in CDF_TYPES:
+        ctype = getattr(spacepy.pycdf.const, CDF_TYPES[p.type])
+    else:
+        raise ValueError('unsupported HAPI type for %s: %s' % (p.name, p.type))
+    if ctype.value == spacepy.pycdf.const.CDF_CHAR.value:
+        return ctype, p.length
+    return ctype, 1
+
+
+def _put_variable(v, item, value):
+    """
+    Set an item of a CDF variable which spacepy.pycdf.Var has no method for, like its
+    blocking factor.  This uses the private Var._call, as of spacepy 0.7.0.
+
+    Parameters
+    ----------
+    v : spacepy.pycdf.Var
+        the variable
+    item : spacepy.pycdf.const
+        the item, like zVAR_BLOCKINGFACTOR_
+    value : int
+        the value of the item
+    """
+    import spacepy.pycdf
+    v._call(spacepy.pycdf.const.PUT_, item, ctypes.c_long(value))
+
+
+class CDFWriter:
+    """Write HAPI records to a CDF in batches, so that responses larger than memory
+    can be converted.  The variables and their attributes are created from the
+    metadata when the writer is made, and then each batch of records is appended.
+
+    with CDFWriter(meta, '/tmp/mydata.cdf') as writer:
+        for data in batches:
+            writer.write(data)
+
+    With append=True, a CDF written earlier is opened instead, after checking that
+    its variables match the metadata, and only records after its last time are
+    added.  The records and bins already in the CDF are not changed.
+
+    The layout of the parameters may be chosen when the CDF is created.  GZIP compression
+    of the parameters typically makes spectrograms with many zero or fill values several
+    times smaller, and RLE compresses runs of zeros only.  See benchmark.py --cdf-layouts.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response, as returned by the Python hapiclient.
+    cdfname : str
+        the name of the CDF file to write
+    append : bool
+        if True and the CDF exists, add the records after its last time to it.
+    compression : str
+        the compression of the record-varying variables: 'gzip', 'rle', 'huff', 'ahuff', or None.
+    compression_level : int
+        the GZIP level, from 1 to 9
+    blocking_factor : int
+        the number of records the CDF library allocates at once for each variable, or None
+        for the library's default.  Larger values make fewer, larger blocks in the file.
+    types : dict
+        the CDF type to use for some parameters, by name, as for cdf_type.
+    """
+
+    def __init__(self, meta, cdfname, append=False, compression=None, compression_level=5, blocking_factor=None,
+                 types=None):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('compression must be one of %s or None, not %s' % (list(COMPRESSIONS), compression))
+        self.compression = compression
+        self.compression_level = compression_level
+        self.blocking_factor = blocking_factor
+        self.types = types
+        self.meta = meta
+        with stage('to_CDF', 'metadata'):
+            self.plan = compile_plan(meta)
+        self.nrec = 0
+        self._pending = b''
+        self._pending_format = None
+        self.append = append and os.path.exists(cdfname)
+        self.last_tt2000 = None
+
+        if self.append:
+            with stage('to_CDF', 'open'):
+                self.cdf = self._open(cdfname)
+        else:
+            with stage('to_CDF', 'create'):
+                self.cdf = self._create(cdfname)
+
+    def _layout(self, v):
+        """set the compression and blocking factor of a new variable."""
+        import spacepy.pycdf
+        const = spacepy.pycdf.const
+        if self.compression is not None:
+            compression = getattr(const, COMPRESSIONS[self.compression])
+            if self.compression == 'gzip':
+                v.compress(compression, ctypes.c_long(self.compression_level))
+            else:
+                v.compress(compression)
+        if self.blocking_factor is not None:
+            _put_variable(v, const.zVAR_BLOCKINGFACTOR_, self.blocking_factor)
+
+    def _open(self, cdfname):
+        """open the CDF to append to, checking that it has the variables which would be created."""
+        import spacepy.pycdf
+        cdf = spacepy.pycdf.CDF(cdfname, readonly=False)
+        try:
+            self._check(cdf, cdfname)
+        except Exception:
+            cdf.close()
+            raise
+        tt2000 = cdf.raw_var(self.plan.time_name)
+        if len(tt2000) > 0:
+            self.last_tt2000 = tt2000[-1]
+        return cdf
+
+    def _check(self, cdf, cdfname):
+        """raise ValueError if the variables and attributes of the CDF do not match the plan."""
+        import spacepy.pycdf
+        const = spacepy.pycdf.const
+        plan = self.plan
+
+        def mismatch(name, what):
+            raise ValueError('cannot append to %s: the %s of %s differs from the metadata' % (cdfname, what, name))
+
+        def missing(name):
+            raise ValueError('cannot append to %s: it has no variable %s' % (cdfname, name))
+
+        if plan.time_name not in cdf:
+            missing(plan.time_name)
+        if cdf[plan.time_name].type() != const.CDF_TIME_TT2000.value:
+            mismatch(plan.time_name, 'type')
+
+        for p in plan.parameters:
+            if p.name not in cdf:
+                missing(p.name)
+            v = cdf[p.name]
+            ctype, n_elements = cdf_type(p, self.types)
+            if v.type() != ctype.value:
+                mismatch(p.name, 'type')
+            if list(v.shape[1:]) != p.size:
+                mismatch(p.name, 'size')
+            if n_elements > 1 and v.nelems() != n_elements:
+                mismatch(p.name, 'length')
+            attrs = {'UNITS': p.units, 'DEPEND_0': plan.time_name}
+            for idep, name in enumerate(p.depends, 1):
+                attrs['DEPEND_%d' % idep] = name
+            for attr, value in attrs.items():
+                if v.attrs.get(attr) != value:
+                    mismatch(p.name, attr)
+
+        for name, bins in plan.bins.items():
+            if bins.centers is None:
+                continue
+            if name not in cdf:
+                missing(name)
+            if not numpy.array_equal(cdf[name][...], bins.centers):
+                mismatch(name, 'values')
+            if cdf[name].attrs.get('UNITS') != bins.units:
+                mismatch(name, 'UNITS')
+            for delta, values in ((name + 'DeltaMinus', bins.delta_minus), (name + 'DeltaPlus', bins.delta_plus)):
+                if values is None:
+                    if delta in cdf:
+                        mismatch(name, 'ranges')
+                elif delta not in cdf:
+                    missing(delta)
+                elif not numpy.array_equal(cdf[delta][...], values):
+                    mismatch(delta, 'values')
+
+    def _create(self, cdfname):
+        """create the CDF with the time variable, a variable for each parameter, and the bins."""
+        import spacepy.pycdf
+        cdf = spacepy.pycdf.CDF(cdfname, create=True)
+
+        plan = self.plan
+        t = cdf.new(plan.time_name, type=spacepy.pycdf.const.CDF_TIME_TT2000)
+        self._layout(t)
+        cdf[plan.time_name].attrs['VAR_TYPE'] = 'support_data'
+        if plan.time.description is not None:
+            cdf[plan.time_name].attrs['CATDESC'] = plan.time.description
+
+        for p in plan.parameters:
+            ctype, n_elements = cdf_type(p, self.types)
+            v = cdf.new(p.name, type=ctype, dims=p.size, n_elements=n_elements)
+            self._layout(v)
+            for idep, name in enumerate(p.depends, 1):
+                # bins shared by several parameters are written once
+                if name not in cdf:
+                    with stage('to_CDF', 'bins'):
+                        handle_bins(cdf, name, plan.bins[name])
+                v.attrs['DEPEND_%d' % idep] = name
+            v.attrs['UNITS'] = p.units
+            v.attrs['DEPEND_0'] = plan.time_name
+            v.attrs['VAR_TYPE'] = 'data'
+            if p.description is not None:
+                v.attrs['CATDESC'] = p.description
+        return cdf
+
+    def write(self, data):
+        """
+        Append records to the CDF.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            structured array of records, like that returned by the Python hapiclient,
+            or a slice of one.
+        """
+        if len(data) == 0:
+            return
+        cdf = self.cdf
+        with stage('to_CDF', 'times', len(data)):
+            tt2000 = isotime_to_tt2000(data[self.plan.time_name])
+        if self.append:
+            if self.last_tt2000 is not None:
+                newer = tt2000 > self.last_tt2000
+                if not numpy.all(newer):
+                    data = data[newer]
+                    tt2000 = tt2000[newer]
+            if len(data) == 0:
+                return
+            self.last_tt2000 = tt2000.max()
+        with stage('to_CDF', 'write', len(data), data.nbytes):
+            cdf.raw_var(self.plan.time_name).extend(tt2000)
+            for p in self.plan.parameters:
+                if data[p.name].dtype.kind == 'S':
+                    cdf.raw_var(p.name).extend(data[p.name])
+                else:
+                    cdf[p.name].extend(data[p.name])
+        self.nrec = self.nrec + len(data)
+
+    def allocate(self, nrec):
+        """
+        Allocate space for nrec records in each record-varying variable, so that the
+        CDF library need not grow the variables as records are written.  Records of
+        compressed variables cannot be allocated, so nothing is done for them.
+
+        Parameters
+        ----------
+        nrec : int
+            the number of records which will be written.  The CDF library refuses to
+            allocate no records, so nothing is done when this is 0.
+        """
+        import spacepy.pycdf
+        if self.compression is not None or nrec <= 0:
+            return
+        for name in self.plan.names:
+            _put_variable(self.cdf[name], spacepy.pycdf.const.zVAR_ALLOCATERECS_, nrec)
+
+    def write_binary(self, chunk):
+        """
+        Append records from a chunk of a HAPI binary response.  The chunk need not end
+        on a record boundary; a partial record is kept until the next chunk.
+
+        Parameters
+        ----------
+        chunk : bytes
+            the next bytes of the response
+        """
+        buf = self._pending + chunk
+        dtype = self.plan.binary_dtype
+        n = len(buf) - len(buf) % dtype.itemsize
+        self._pending = buf[n:]
+        self._pending_format = 'binary'
+        # strings are left as bytes, which are written to the CDF as they are
+        self.write(numpy.frombuffer(buf, dtype=dtype, count=n // dtype.itemsize))
+
+    def write_csv(self, chunk):
+        """
+        Append records from a chunk of a HAPI CSV response.  The chunk need not end
+        on a line boundary; a partial line is kept until the next chunk.
+
+        Parameters
+        ----------
+        chunk : bytes
+            the next bytes of the response
+        """
+        buf = self._pending + chunk
+        n = buf.rfind(b'\n') + 1
+        self._pending = buf[n:]
+        self._pending_format = 'csv'
+        self.write(parse_csv(buf[:n], self.meta, self.plan.dtype))
+
+    def close(self):
+        """Write the last CSV line if it had no newline, write the global attributes, and close the CDF."""
+        pending = self._pending
+        self._pending = b''
+        try:
+            if len(pending.strip()) > 0:
+                if self._pending_format == 'csv':
+                    self.write(parse_csv(pending, self.meta, self.plan.dtype))
+                else:
+                    raise ValueError('incomplete record of %d bytes at the end of the response' % len(pending))
+        finally:
+            with stage('to_CDF', 'close', self.nrec):
+                if not self.append:
+                    self.cdf.attrs['Author'] = 'fromHapiToCDF'
+                    self.cdf.attrs['CreateDate'] = datetime.datetime.now()
+                self.cdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def to_CDF(hapidata, cdfname, append=False, compression=None, compression_level=5, blocking_factor=None, types=None,
+           reduce=None):
     """Reformat the response from the Python hapiclient to the CDF.
 
     This is typically called using the result of the Python hapiclient.
@@ -60,45 +402,123 @@ def to_CDF(hapidata, cdfname):
         this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
     cdfname : str
         the name of the CDF file to write
+    append : bool
+        if True and the CDF exists, only the records after the last time in it are
+        added to it.  The CDF must have been written by to_CDF with the same metadata.
+    compression, compression_level, blocking_factor, types
+        the layout of a new CDF, as for CDFWriter, like compression='gzip'.  The records
+        are allocated before they are written.
+    reduce : hapiReduce.Reduction
+        if given, the records are first reduced to statistics in buckets of time.
 
     """
+    if reduce is not None:
+        hapidata = reduce(hapidata)
 
     data, meta = hapidata
 
-    names = [m['name'] for m in meta['parameters']]
+    with CDFWriter(meta, cdfname, append, compression, compression_level, blocking_factor, types) as writer:
+        if not writer.append:
+            writer.allocate(len(data))
+        writer.write(data)
 
-    cdf = spacepy.pycdf.CDF(cdfname, create=True)
 
-    for i in range(len(names)):
-        name = names[i]
-        m = meta['parameters'][i]
-        if i == 0:
-            cdf[name] = hapitime2datetime(data[m['name']])
-            cdf[name].attrs['VAR_TYPE'] = 'support_data'
-        else:
-            cdf[name] = data[name]
-            v = cdf[name]
-            if 'bins' in m:
-                bins = m['bins']
-                idep = 1
-                if isinstance(bins, dict):
-                    refstr = bins.get('$ref')
-                    ref = re.match('\#\/definitions\/(.+)', refstr).group(1)
-                    bins = meta['definitions'][ref]
-
-                for b in bins:
-                    handle_bins(cdf, b['name'], b)
-                    v.attrs['DEPEND_%d' % idep] = b['name']
-                    idep = idep + 1
-            v.attrs['UNITS'] = ' ' if m['units'] is None else m['units']
-            v.attrs['DEPEND_0'] = meta['parameters'][0]['name']
-            v.attrs['VAR_TYPE'] = 'data'
+def _read_header(f):
+    """
+    Read the JSON header of a response made with include=header, which is on lines starting with '#'.
+
+    Return
+    ------
+    tuple
+        the header as a dict, or None when there is none, and the bytes read after it.
+    """
+    lines = []
+    first = f.read(1)
+    while first == b'#':
+        lines.append(f.readline())
+        first = f.read(1)
+    header = json.loads(b''.join(lines).decode('utf-8')) if lines else None
+    return header, first
+
+
+def _read_binary(f, writer, rest, blocksize):
+    """write the records of the binary response in f, read into one buffer reused for each block."""
+    dtype = writer.plan.binary_dtype
+    reclen = dtype.itemsize
+    buf = bytearray(max(1, blocksize // reclen) * reclen)
+    view = memoryview(buf)
+    filled = len(rest)
+    view[:filled] = rest
+    while True:
+        while filled < len(buf):
+            n = f.readinto(view[filled:])
+            if not n:
+                break
+            filled = filled + n
+        nrec = filled // reclen
+        writer.write(numpy.frombuffer(buf, dtype=dtype, count=nrec))
+        if filled < len(buf):
+            writer.write_binary(bytes(view[nrec * reclen:filled]))  # any partial record is reported on close
+            return
+        filled = 0
+
 
-        if 'description' in m:
-            cdf[name].attrs['CATDESC'] = m['description']
+def stream_to_CDF(source, meta, cdfname, format='binary', blocksize=BLOCKSIZE):
+    """Write a HAPI binary or CSV response straight to a CDF, without hapiclient.
 
-    cdf.attrs['Author'] = 'fromHapiToCDF'
-    cdf.attrs['CreateDate'] = datetime.datetime.now()
+    The response is read in blocks, and each block is decoded and appended to
+    the CDF, so only one block is held in memory.  Binary records are decoded in
+    place, and when the size of a file is known, the CDF variables are allocated first.
+
+    response = urllib.request.urlopen(server + '/data?id=...&format=binary')
+    stream_to_CDF(response, meta, '/tmp/mydata.cdf')
+    stream_to_CDF('/tmp/mydata.bin', meta, '/tmp/mydata.cdf')
+
+    Parameters
+    ----------
+    source : str or file
+        the name of a file holding the response, or a binary file object, like an HTTP response.
+    meta : dict or str
+        the HAPI info response, or its JSON.  This may be None when the response
+        was requested with include=header.
+    cdfname : str
+        the name of the CDF file to write
+    format : str
+        'binary' or 'csv', the format of the response
+    blocksize : int
+        the number of bytes read at once
+    """
+    if format not in ('binary', 'csv'):
+        raise ValueError('format must be binary or csv, not %s' % format)
+    if isinstance(meta, (str, bytes)):
+        meta = json.loads(meta)
+
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, 'rb')
+        size = os.path.getsize(source)
+    else:
+        f = source
+        size = None
 
-    cdf.close()
+    try:
+        header, rest = _read_header(f)
+        if meta is None:
+            if header is None:
+                raise ValueError('meta must be given when the response has no header')
+            meta = header
 
+        with CDFWriter(meta, cdfname) as writer:
+            if format == 'binary':
+                if size is not None and header is None:
+                    writer.allocate(size // writer.plan.binary_dtype.itemsize)
+                _read_binary(f, writer, rest, blocksize)
+            else:
+                writer.write_csv(rest)
+                while True:
+                    chunk = f.read(blocksize)
+                    if not chunk:
+                        break
+                    writer.write_csv(chunk)
+    finally:
+        if f is not source:
+            f.close()
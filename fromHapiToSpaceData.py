@@ -1,8 +1,14 @@
+import collections
 import datetime
-import re
+import functools
 
+import numpy
 import spacepy.datamodel as datamodel
-from hapiclient.hapitime import hapitime2datetime
+
+from hapiInstrument import stage
+from hapiPlan import compile_plan, fill_value
+from hapiIndex import TimeIndex
+from hapiTimes import calculate_format_str, isotime_to_datetime, isotime_to_nanoseconds, nanoseconds_to_datetime
 
 
 # frompyfunc
@@ -13,79 +19,6 @@ from hapiclient.hapitime import hapitime2datetime
 # { x(i) : for i in iis } dictionary comprehension
 # https://github.com/spacepy/spacepy/issues/523
 
-def calculate_format_str(isotime):
-    """
-    Given an example time, return the format string which used with datetime.datetime.strptime
-    will parse the isotime strings to datetimes.
-
-    Parameters
-    ----------
-    isotime : str
-        a HAPI isotime
-
-    Return
-    ------
-    str
-        a format string for datetime.datetime.strptime
-
-    This will be deprecated because the Python HAPI client has its own method for handling times.
-    """
-    if isotime[-1] == 'Z':
-        isotime = isotime[0:-1]
-        zstr = 'Z'
-    else:
-        zstr = ''
-
-    datelen = isotime.find('T')
-    if datelen == -1:
-        datelen = len(isotime)
-
-    if datelen == 4:
-        form = '%Y'
-    elif datelen == 6:
-        form = '%Y%m'
-    elif datelen == 7:
-        if isotime[4] == '-':
-            form = '%Y-%m'
-        else:
-            form = '%Y%j'
-    elif datelen == 8:
-        if isotime[4] == '-':
-            form = '%Y-%j'
-        else:
-            form = '%Y%m%d'
-    elif datelen == 10:
-        form = '%Y-%m-%d'
-    else:
-        raise ValueError('date cannot have %d characters: %s' % (datelen, isotime))
-
-    formForLength = {
-        2: "%H",
-        4: '%H%M',
-        5: '%H:%M',
-        6: '%H%M%S',
-        8: '%H:%M:%S'
-        # note case for 10 and up below
-    }
-
-    timelen = len(isotime) - datelen - 1
-
-    if timelen > 9:
-        timeform = "%H:%M:%S.%f"
-    elif timelen < 1:
-        timeform = ""
-    else:
-        try:
-            timeform = formForLength[timelen]
-        except KeyError:
-            raise ValueError("time cannot have {:d} characters: {:s}".format(datelen, isotime))
-
-    if len(timeform) == 0:
-        return "{}{}".format(form, zstr)
-    else:
-        return "{}T{}{}".format(form, timeform, zstr)
-
-
 def convert_times(isotime_array):
     """
     Convert the times in the array of isotimes into datetime objects.
@@ -97,15 +30,27 @@ def convert_times(isotime_array):
 
     Return
     ------
-    array of str
+    array of datetime
         a datetime object for each element
     """
-    if len(isotime_array) == 0:
-        print('isotime_array has len 0')
-        return isotime_array  # raise ValueError('isotime array is empty')
-    form = calculate_format_str(isotime_array[0].decode('ascii'))
-    return [datetime.datetime.strptime(isotime.decode('ascii'), form) for isotime in isotime_array]
-import hapiclient.hapitime
+    return isotime_to_datetime(isotime_array)
+
+
+def _bins_variables(name, bins):
+    """return the (name, array, attrs) of the centers and any deltas of the bins."""
+    if bins.centers is None:
+        return []
+
+    # the plan's arrays are shared, so each output gets its own copy
+    attrs = {'UNITS': bins.units, 'VAR_TYPE': 'support_data'}
+    variables = [(name, numpy.array(bins.centers), attrs)]
+    if bins.delta_minus is not None:
+        attrs['DELTA_PLUS_VAR'] = name + 'DeltaPlus'
+        attrs['DELTA_MINUS_VAR'] = name + 'DeltaMinus'
+        variables.append((name + 'DeltaMinus', numpy.array(bins.delta_minus), {}))
+        variables.append((name + 'DeltaPlus', numpy.array(bins.delta_plus), {}))
+    return variables
+
 
 def handle_bins(data, name, bins):
     """
@@ -120,40 +65,69 @@ def handle_bins(data, name, bins):
         the data to add the variable
     name : str
         the name of the variable
-    bins : str
-        the "bins" node of the HAPI response
+    bins : BinsPlan
+        the "bins" node of the HAPI response, from the ConversionPlan
     """
-    if 'centers' in bins:
-        o = bins['centers']
-        if type(o) != str:  # string is just a reference to another variable
-            centers = [float(v) for v in bins['centers']]
-        else:
-            return
-    else:  # if 'ranges' in bins:
-        ranges = bins['ranges']
-
-    if 'centers' not in locals():
-        centers = [a[0] + (a[1] - a[0]) / 2 for a in ranges]
-
-    data[name] = datamodel.dmarray(input_array=centers)
-    data[name].attrs['UNITS'] = bins['units']
-    data[name].attrs['VAR_TYPE'] = 'support_data'
-
-    if 'ranges' in locals():
-        import numpy
-        delta_plus_var = numpy.zeros(len(centers))
-        for i in range(len(centers)):
-            delta_plus_var[i] = ranges[i][1] - centers[i]
-        delta_minus_var = numpy.zeros(len(centers))
-        for i in range(len(centers)):
-            delta_minus_var[i] = centers[i] - ranges[i][0]
-        data[name + 'DeltaMinus'] = delta_minus_var
-        data[name + 'DeltaPlus'] = delta_plus_var
-        data[name].attrs['DELTA_PLUS_VAR'] = name + 'DeltaPlus'
-        data[name].attrs['DELTA_MINUS_VAR'] = name + 'DeltaMinus'
-
-
-def to_SpaceData(hapidata):
+    for vname, d, attrs in _bins_variables(name, bins):
+        data[vname] = datamodel.dmarray(d, attrs=dict(attrs))
+
+
+def _parameter_array(name, data, copy):
+    """return the dmarray of a parameter, a view onto data unless copy is True."""
+    if copy:
+        return datamodel.dmarray(numpy.array(data[name], order='C'))
+    else:
+        # a view never copies, unlike dmarray(d) which may depending on the layout.
+        v = data[name].view(datamodel.dmarray)
+        v.attrs = {}
+        return v
+
+
+def spacedata_variables(plan):
+    """
+    Return the variables to_SpaceData makes for a HAPI response, without making them.
+
+    Parameters
+    ----------
+    plan : hapiPlan.ConversionPlan
+        the plan of the HAPI info response
+
+    Return
+    ------
+    collections.OrderedDict
+        for each variable, its attributes and a function of (data, copy) which makes its
+        dmarray, where data is the array returned by the Python hapiclient.
+    """
+    variables = collections.OrderedDict()
+
+    attrs = {'VAR_TYPE': 'support_data'}
+    if plan.time.description is not None:
+        attrs['CATDESC'] = plan.time.description
+    variables[plan.time_name] = (attrs,
+                                 lambda data, copy: datamodel.dmarray(isotime_to_datetime(data[plan.time_name])))
+
+    for p in plan.parameters:
+        attrs = {}
+        variables[p.name] = (attrs, functools.partial(_parameter_array, p.name))
+        for idep, name in enumerate(p.depends, 1):
+            # bins shared by several parameters are added once
+            if name not in variables:
+                for vname, d, battrs in _bins_variables(name, plan.bins[name]):
+                    variables[vname] = (battrs, lambda data, copy, d=d: datamodel.dmarray(d))
+            attrs['DEPEND_%d' % idep] = name
+        attrs['UNITS'] = p.units
+        attrs['DEPEND_0'] = plan.time_name
+        attrs['VAR_TYPE'] = 'data'
+        fill = fill_value(p, plan.dtype[p.name].base)
+        if fill is not None:
+            attrs['FILLVAL'] = fill
+        if p.description is not None:
+            attrs['CATDESC'] = p.description
+
+    return variables
+
+
+def to_SpaceData(hapidata, copy=False, reduce=None):
     """Reformat the response from the Python hapiclient to an object similar to a cdf.  The cdf
      will be similar to the object returned by reading a data.
 
@@ -164,50 +138,158 @@ def to_SpaceData(hapidata):
     hapidata = hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
     data = to_Pydata( hapidata )
 
+    The nanoseconds of the times are kept as the time_index of the SpaceData, so that
+    hapiIndex.select finds windows of it with a binary search.
+
     Parameters
     ----------
     hapidata : tuple
         this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
+    copy : bool
+        if False (the default), each parameter is a dmarray view onto the hapiclient array, so no
+        data is copied, and the views keep the whole response in memory.  If True, each parameter
+        is copied into its own contiguous array.  Times are always converted, and so are new arrays.
+    reduce : hapiReduce.Reduction
+        if given, the records are first reduced to statistics in buckets of time, like
+        Reduction(bucket=numpy.timedelta64(1, 'h')).
 
     """
+    if reduce is not None:
+        hapidata = reduce(hapidata)
 
     data, meta = hapidata
 
-    names = [m['name'] for m in meta['parameters']]
+    with stage('to_SpaceData', 'metadata'):
+        plan = compile_plan(meta)
+        variables = spacedata_variables(plan)
 
     result = datamodel.SpaceData()
 
-    for i in range(len(names)):
-        name = names[i]
-        m = meta['parameters'][i]
-        if i == 0:
-            d = hapitime2datetime(data[m['name']])
-            result[name] = datamodel.dmarray(d)
-            result[name].attrs['VAR_TYPE'] = 'support_data'
+    for name, (attrs, make) in variables.items():
+        if name == plan.time_name:
+            kind = 'times'
+        elif 'DEPEND_0' in attrs:
+            kind = 'arrays'
         else:
-            d = data[name]
-            result[name] = datamodel.dmarray(d)
-            v = result[name]
-            if 'bins' in m:
-                bins = m['bins']
-                idep = 1
-                if isinstance(bins, dict):
-                    refstr = bins.get('$ref')
-                    ref = re.match('\#\/definitions\/(.+)', refstr).group(1)
-                    bins = meta['definitions'][ref]
-
-                for b in bins:
-                    # TODO: figure out why this works when multiple variables use the same bins.
-                    handle_bins(result, b['name'], b)
-                    v.attrs['DEPEND_%d' % idep] = b['name']
-                    idep = idep + 1
-            v.attrs['UNITS'] = ' ' if m['units'] is None else m['units']
-            v.attrs['DEPEND_0'] = meta['parameters'][0]['name']
-            v.attrs['VAR_TYPE'] = 'data'
-
-        if 'description' in m:
-            result[name].attrs['CATDESC'] = m['description']
+            kind = 'bins'
+        with stage('to_SpaceData', kind, None if kind == 'bins' else len(data)):
+            if kind == 'times':
+                # the nanoseconds are kept as the time index, for hapiIndex.select
+                ns = isotime_to_nanoseconds(data[name])
+                result.time_index = TimeIndex(ns, name)
+                v = datamodel.dmarray(nanoseconds_to_datetime(ns))
+            else:
+                v = make(data, copy)
+            v.attrs = dict(attrs)
+        result[name] = v
 
     result.attrs = {'CreateDate': datetime.datetime.now()}
 
     return result
+
+
+class LazySpaceData(datamodel.SpaceData):
+    """A SpaceData whose variables are converted from the HAPI response when they are
+    first read, and then kept.  All the names are there from the start, and
+    variable_attrs gives the attributes of a variable without converting it.
+
+    spacedata = LazySpaceData(hapiclient.hapi(server, dataset, '', start, stop))
+    spacedata['B_GSE']   # only the B_GSE variable is converted
+
+    Parameters
+    ----------
+    hapidata : tuple
+        this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
+    copy : bool
+        as for to_SpaceData
+    """
+
+    def __init__(self, hapidata, copy=False):
+        super().__init__()
+        data, meta = hapidata
+        self._data = data
+        self._copy = copy
+        # the variables not read yet are kept apart, so the dict itself only ever holds dmarrays
+        self._pending = dict(spacedata_variables(compile_plan(meta)))
+        self._names = list(self._pending)
+        self.attrs = {'CreateDate': datetime.datetime.now()}
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            attrs, make = self._pending[key]
+            d = make(self._data, self._copy)
+            d.attrs = dict(attrs)
+            dict.__setitem__(self, key, d)
+            del self._pending[key]
+            return d
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if key in self._pending:
+            del self._pending[key]
+        else:
+            super().__delitem__(key)
+
+    def __contains__(self, key):
+        return key in self._pending or dict.__contains__(self, key)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._pending)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        names = [key for key in self._names if key in self]
+        return names + [key for key in dict.keys(self) if key not in self._names]
+
+    def is_materialized(self, key):
+        """
+        Return True if the variable has been converted.
+
+        Parameters
+        ----------
+        key : str
+            the name of the variable
+        """
+        if key not in self:
+            raise KeyError(key)
+        return key not in self._pending
+
+    def variable_attrs(self, key):
+        """
+        Return the attributes of a variable, like DEPEND_0, UNITS, and CATDESC, without converting it.
+
+        Parameters
+        ----------
+        key : str
+            the name of the variable
+        """
+        if key in self._pending:
+            return self._pending[key][0]
+        return dict.__getitem__(self, key).attrs
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def pop(self, key, *default):
+        if key in self:
+            v = self[key]
+            del self[key]
+            return v
+        return dict.pop(self, key, *default)
+
+    def materialize(self):
+        """Convert every variable which has not been read yet."""
+        for key in self:
+            self[key]
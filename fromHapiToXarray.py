@@ -0,0 +1,275 @@
+import numpy
+import xarray
+
+from hapiPlan import compile_plan, fill_value
+from hapiTimes import isotime_to_nanoseconds
+
+# The bytes in each chunk of a NetCDF variable, when the number of records in a chunk
+# is not given.  Each chunk holds all the channels of some records, so a time window is
+# read from a few chunks.
+CHUNK_BYTES = 1024 * 1024
+
+_time_units = 'nanoseconds since 1970-01-01T00:00:00Z'
+
+
+def _centers_dims(plan):
+    """return the bins name of each parameter which is the centers of time-varying bins."""
+    dims = {}
+    for p in plan.parameters:
+        for b, name in zip(p.bins, p.depends):
+            if isinstance(b.get('centers'), str):
+                dims[b['centers']] = name
+    return dims
+
+
+def _dims(p, plan, centers_dims):
+    """
+    return the dimension names of a parameter: the time, and then for each dimension its bins
+    name, or a name like "spectrum_dim1" when there are no bins.
+    """
+    dims = [plan.time_name]
+    for i in range(len(p.size)):
+        if i < len(p.depends):
+            dims.append(p.depends[i])
+        elif p.name in centers_dims and len(p.size) == 1:
+            dims.append(centers_dims[p.name])
+        else:
+            dims.append('%s_dim%d' % (p.name, i + 1))
+    return dims
+
+
+def _attrs(p):
+    """return the attributes of a parameter's variable."""
+    attrs = {'units': p.units}
+    if p.description is not None:
+        attrs['long_name'] = p.description
+    if p.fill is not None:
+        attrs['FILLVAL'] = p.fill
+    return attrs
+
+
+def _bins_coords(plan):
+    """return the (name, dims, values, attrs) of each bins coordinate and its deltas."""
+    coords = []
+    for name, bins in plan.bins.items():
+        if bins.centers is None:
+            continue
+        coords.append((name, (name,), bins.centers, {'units': bins.units}))
+        if bins.delta_minus is not None:
+            coords.append((name + 'DeltaMinus', (name,), bins.delta_minus, {'units': bins.units}))
+            coords.append((name + 'DeltaPlus', (name,), bins.delta_plus, {'units': bins.units}))
+    return coords
+
+
+def to_xarray(hapidata, chunks=None):
+    """Reformat the response from the Python hapiclient to an xarray Dataset.
+
+    Each parameter is a variable whose first dimension is the time, and whose other dimensions
+    are named for their bins, which are coordinates with their units.  When only the ranges of
+    the bins are given, the centers are the coordinate and the ranges become the coordinates
+    DeltaMinus and DeltaPlus, like energyDeltaMinus.  The HAPI fill of a parameter is kept as
+    the FILLVAL attribute and as its encoding['_FillValue'], so the fill values are masked when
+    the Dataset is written with to_netcdf and read back.
+
+    hapidata = hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
+    ds = to_xarray(hapidata)
+    ds['spectrum'].sel(Time=slice('2016-01-01T01:00', '2016-01-01T02:00'))
+
+    Parameters
+    ----------
+    hapidata : tuple
+        this is a two-element tuple containing the data and metadata returned by the HAPI server via the Python hapiclient.
+    chunks : int or dict
+        if given, the variables are dask arrays with these chunks, as for xarray.Dataset.chunk.
+        The parameters are views onto the hapiclient array, so no data is copied when chunks is None.
+
+    Return
+    ------
+    xarray.Dataset
+        a variable for each parameter
+    """
+    data, meta = hapidata
+    plan = compile_plan(meta)
+    centers_dims = _centers_dims(plan)
+
+    ns = isotime_to_nanoseconds(data[plan.time_name])
+    coords = {plan.time_name: (plan.time_name, ns.view('M8[ns]'))}
+    for name, dims, values, attrs in _bins_coords(plan):
+        coords[name] = (dims, numpy.array(values), attrs)
+
+    variables = {}
+    for p in plan.parameters:
+        encoding = {}
+        fill = fill_value(p, plan.dtype[p.name].base)
+        if fill is not None:
+            encoding['_FillValue'] = fill
+        variables[p.name] = (_dims(p, plan, centers_dims), data[p.name], _attrs(p), encoding)
+
+    ds = xarray.Dataset(variables, coords=coords)
+    ds.attrs['HAPI'] = meta.get('HAPI', '')
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    return ds
+
+
+def chunk_records(p, chunk_bytes=CHUNK_BYTES):
+    """
+    Return the number of records in each chunk of a parameter's variable in a NetCDF file,
+    so that each chunk is about chunk_bytes.
+
+    Parameters
+    ----------
+    p : ParameterPlan
+        the parameter, from the ConversionPlan
+    chunk_bytes : int
+        the bytes in each chunk
+    """
+    itemsize = 8 if p.type in ('double', 'string', 'isotime') else 4
+    return max(1, chunk_bytes // (itemsize * int(numpy.prod(p.size, dtype=int))))
+
+
+class NetCDFWriter:
+    """Write HAPI records to a NetCDF4 file in batches, using h5netcdf, so that responses
+    larger than memory can be converted.  The time dimension is unlimited, and grows as
+    each batch of records is appended.  The file is read by xarray like the Dataset
+    from to_xarray, and open_netcdf reads it lazily with dask.
+
+    with NetCDFWriter(meta, '/tmp/mydata.nc') as writer:
+        for data in batches:
+            writer.write(data)
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response, as returned by the Python hapiclient.
+    filename : str
+        the name of the NetCDF file to write
+    compression : str
+        'gzip', 'lzf', or None for no compression
+    compression_opts : int
+        the gzip level, from 1 to 9
+    shuffle : bool
+        if True, the bytes are shuffled before compression, which helps with floating point data.
+    chunk_bytes : int
+        the bytes in each chunk of the parameters, each holding all the channels of some records.
+    """
+
+    def __init__(self, meta, filename, compression='gzip', compression_opts=4, shuffle=True,
+                 chunk_bytes=CHUNK_BYTES):
+        import h5netcdf
+        import h5py
+        self.meta = meta
+        self.plan = compile_plan(meta)
+        self.nrec = 0
+        plan = self.plan
+        centers_dims = _centers_dims(plan)
+
+        if compression is None:
+            compress = {}
+        elif compression == 'gzip':
+            compress = {'compression': 'gzip', 'compression_opts': compression_opts, 'shuffle': shuffle}
+        else:
+            compress = {'compression': compression, 'shuffle': shuffle}
+
+        f = h5netcdf.File(filename, 'w')
+        self.file = f
+        f.attrs['HAPI'] = meta.get('HAPI', '')
+        f.dimensions[plan.time_name] = None
+        t = f.create_variable(plan.time_name, (plan.time_name,), numpy.int64, chunks=(max(1, chunk_bytes // 8),), **compress)
+        t.attrs['units'] = _time_units
+        t.attrs['calendar'] = 'proleptic_gregorian'
+
+        for name, dims, values, attrs in _bins_coords(plan):
+            if name not in f.dimensions and dims[0] == name:
+                f.dimensions[name] = len(values)
+            v = f.create_variable(name, dims, numpy.float64, data=values)
+            v.attrs.update(attrs)
+
+        for p in plan.parameters:
+            dims = _dims(p, plan, centers_dims)
+            for dim, n in zip(dims[1:], p.size):
+                if dim not in f.dimensions:
+                    f.dimensions[dim] = n
+            chunks = (chunk_records(p, chunk_bytes),) + tuple(p.size)
+            if p.type == 'string':
+                v = f.create_variable(p.name, dims, h5py.string_dtype(), chunks=chunks)
+            else:
+                # the fill is the _FillValue which xarray and other CF readers mask
+                v = f.create_variable(p.name, dims, plan.dtype[p.name].base, chunks=chunks,
+                                      fillvalue=fill_value(p, plan.dtype[p.name].base), **compress)
+            v.attrs.update(_attrs(p))
+            # the deltas of the bins are coordinates which are not dimensions, so they are listed
+            deltas = [name + suffix for name in p.depends if plan.bins[name].delta_minus is not None
+                      for suffix in ('DeltaMinus', 'DeltaPlus')]
+            if len(deltas) > 0:
+                v.attrs['coordinates'] = ' '.join(deltas)
+
+    def write(self, data):
+        """
+        Append records to the file.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            structured array of records, like that returned by the Python hapiclient,
+            or a slice of one.
+        """
+        if len(data) == 0:
+            return
+        f = self.file
+        i0, i1 = self.nrec, self.nrec + len(data)
+        f.resize_dimension(self.plan.time_name, i1)
+        f.variables[self.plan.time_name][i0:i1] = isotime_to_nanoseconds(data[self.plan.time_name])
+        for p in self.plan.parameters:
+            d = data[p.name]
+            if d.dtype.kind == 'U':
+                d = d.astype(object)
+            f.variables[p.name][i0:i1] = d
+        self.nrec = i1
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def to_netcdf(hapidata, filename, compression='gzip', compression_opts=4, shuffle=True, chunk_bytes=CHUNK_BYTES):
+    """Reformat the response from the Python hapiclient to a compressed NetCDF4 file.
+
+    The variables are chunked in time, so a window of time is read from a few chunks.
+    See NetCDFWriter for the parameters.
+
+    hapidata = hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
+    to_netcdf(hapidata, '/tmp/mydata.nc')
+    """
+    data, meta = hapidata
+    with NetCDFWriter(meta, filename, compression, compression_opts, shuffle, chunk_bytes) as writer:
+        writer.write(data)
+
+
+def open_netcdf(filename, chunks=None):
+    """
+    Open a file written by to_netcdf or NetCDFWriter, reading the variables lazily with dask,
+    so that a window of time can be selected from files larger than memory.
+
+    ds = open_netcdf('/tmp/mydata.nc')
+    window = ds['spectrum'].sel(Time=slice('2016-01-01T01:00', '2016-01-01T02:00')).load()
+
+    Parameters
+    ----------
+    filename : str
+        the name of the NetCDF file
+    chunks : dict or str
+        the dask chunks, by default the chunks of the file.
+
+    Return
+    ------
+    xarray.Dataset
+        the variables, as dask arrays
+    """
+    return xarray.open_dataset(filename, engine='h5netcdf', chunks={} if chunks is None else chunks)
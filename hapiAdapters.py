@@ -0,0 +1,58 @@
+"""All of the adapters from one module, each loaded when it is first used.
+
+import hapiAdapters
+spacedata = hapiAdapters.to_SpaceData(hapidata)
+hapiAdapters.to_CDF(hapidata, '/tmp/mydata.cdf')
+
+Importing this module imports none of the adapters, nor pandas, sunpy, astropy,
+spacepy or hapiclient, so short-lived processes pay only for what they use.  The
+adapter modules are also found here by name, like hapiAdapters.fromHapiToCDF.
+"""
+import importlib
+
+# the module of each name found here
+_exports = {
+    'to_CDF': 'fromHapiToCDF',
+    'stream_to_CDF': 'fromHapiToCDF',
+    'CDFWriter': 'fromHapiToCDF',
+    'to_SpaceData': 'fromHapiToSpaceData',
+    'LazySpaceData': 'fromHapiToSpaceData',
+    'hapi_to_time_series': 'fromHapiToSunPy',
+    'to_Table': 'fromHapiToArrow',
+    'write_parquet': 'fromHapiToArrow',
+    'read_parquet': 'fromHapiToArrow',
+    'to_xarray': 'fromHapiToXarray',
+    'to_netcdf': 'fromHapiToXarray',
+    'open_netcdf': 'fromHapiToXarray',
+    'to_SpaceData_parallel': 'hapiParallel',
+    'hapi_to_time_series_parallel': 'hapiParallel',
+    'to_CDF_parallel': 'hapiParallel',
+    'to_SpaceData_async': 'hapiAsync',
+    'hapi_to_time_series_async': 'hapiAsync',
+    'to_CDF_async': 'hapiAsync',
+    'HapiSession': 'hapiAsync',
+    'ConvertedCache': 'hapiCache',
+    'merge': 'hapiMerge',
+    'Reduction': 'hapiReduce',
+    'select': 'hapiIndex',
+}
+
+_modules = sorted(set(_exports.values()) | {'hapiBatch', 'hapiErrors', 'hapiInstrument', 'hapiPlan', 'hapiRecords',
+                                            'hapiServer', 'hapiSynthetic', 'hapiTimes', 'hapiUnits'})
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name]), name)
+    elif name in _modules:
+        value = importlib.import_module(name)
+    else:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | set(_modules))
@@ -0,0 +1,200 @@
+"""Asynchronous versions of the adapters, for services running on asyncio.
+
+The responses are read with a pooled aiohttp session, so many requests can be in
+flight at once, and the parsing and conversion, which take most of the CPU time,
+are run on an executor, so the event loop is not blocked while they run.
+
+async with HapiSession() as session:
+    results = await asyncio.gather(*[session.to_SpaceData(server, dataset, '', start, stop)
+                                     for dataset in datasets])
+
+or for a single request:
+
+spacedata = await to_SpaceData_async(server, dataset, parameters, start, stop)
+
+aiohttp is needed: pip install aiohttp
+"""
+import asyncio
+import functools
+import json
+
+from hapiErrors import HapiError
+from hapiRecords import parse_binary, parse_csv
+
+
+class HapiSession:
+    """A pool of connections to HAPI servers, and the executor on which responses are converted.
+
+    The info and capabilities of each server are read once and kept.
+
+    Parameters
+    ----------
+    limit : int
+        the most connections open at once, to all servers
+    limit_per_host : int
+        the most connections open at once to each server
+    timeout : float
+        the seconds allowed for each request
+    executor : concurrent.futures.Executor
+        where the responses are parsed and converted, by default the event loop's thread pool.
+        A ProcessPoolExecutor keeps the conversions from holding the GIL of the event loop.
+    """
+
+    def __init__(self, limit=100, limit_per_host=10, timeout=300., executor=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.executor = executor
+        self._session = None
+        self._infos = {}
+        self._formats = {}
+
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _get(self, server, endpoint, params):
+        """return the body of a request, raising HapiError with the status from the server when it fails."""
+        url = server.rstrip('/') + '/' + endpoint
+        async with self._get_session().get(url, params=params) as response:
+            body = await response.read()
+            if response.status != 200:
+                try:
+                    status = json.loads(body)['status']
+                    raise HapiError(response.status, status['code'], status['message'])
+                except (ValueError, KeyError, TypeError):
+                    raise HapiError(response.status, None, '%s returned HTTP %d' % (url, response.status))
+            return body
+
+    async def _run(self, function, *args):
+        """run the function on the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def formats(self, server):
+        """return the output formats of the server, from its capabilities."""
+        if server not in self._formats:
+            capabilities = json.loads(await self._get(server, 'capabilities', {}))
+            self._formats[server] = capabilities.get('outputFormats', ['csv'])
+        return self._formats[server]
+
+    async def info(self, server, dataset, parameters=''):
+        """
+        Return the HAPI info response for the parameters of the dataset.
+
+        Parameters
+        ----------
+        server, dataset, parameters : str
+            as for hapiclient.hapi
+        """
+        key = (server, dataset, parameters)
+        if key not in self._infos:
+            params = {'id': dataset}
+            if parameters != '':
+                params['parameters'] = parameters
+            self._infos[key] = json.loads(await self._get(server, 'info', params))
+        return self._infos[key]
+
+    async def hapi(self, server, dataset, parameters, start, stop):
+        """
+        Read the records of a request, like hapiclient.hapi.  The binary format is used when
+        the server has it, and CSV otherwise.
+
+        Parameters
+        ----------
+        server, dataset, parameters, start, stop : str
+            the HAPI request, as for hapiclient.hapi
+
+        Return
+        ------
+        tuple
+            the data and metadata, like those returned by hapiclient.hapi
+        """
+        info = await self.info(server, dataset, parameters)
+        fmt = 'binary' if 'binary' in await self.formats(server) else 'csv'
+        params = {'id': dataset, 'time.min': start, 'time.max': stop, 'format': fmt}
+        if parameters != '':
+            params['parameters'] = parameters
+        body = await self._get(server, 'data', params)
+
+        meta = dict(info)
+        meta.update({'x_server': server, 'x_dataset': dataset, 'x_parameters': parameters,
+                     'x_time.min': start, 'x_time.max': stop})
+        data = await self._run(parse_binary if fmt == 'binary' else parse_csv, body, meta)
+        return data, meta
+
+    async def convert(self, convert, server, dataset, parameters, start, stop, *args):
+        """read the request and return convert((data, meta), *args), run on the executor."""
+        hapidata = await self.hapi(server, dataset, parameters, start, stop)
+        return await self._run(convert, hapidata, *args)
+
+    async def to_SpaceData(self, server, dataset, parameters, start, stop):
+        """read the request and convert it with fromHapiToSpaceData.to_SpaceData."""
+        import fromHapiToSpaceData
+        return await self.convert(fromHapiToSpaceData.to_SpaceData, server, dataset, parameters, start, stop)
+
+    async def hapi_to_time_series(self, server, dataset, parameters, start, stop):
+        """read the request and convert it with fromHapiToSunPy.hapi_to_time_series."""
+        import fromHapiToSunPy
+        return await self.convert(fromHapiToSunPy.hapi_to_time_series, server, dataset, parameters, start, stop)
+
+    async def to_CDF(self, server, dataset, parameters, start, stop, cdfname):
+        """read the request and write it to the CDF with fromHapiToCDF.to_CDF."""
+        import fromHapiToCDF
+        await self.convert(fromHapiToCDF.to_CDF, server, dataset, parameters, start, stop, cdfname)
+        return cdfname
+
+    async def close(self):
+        """Close the connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+async def _with_session(session, method, *args):
+    """call the method of the session, or of a new session closed afterwards when session is None."""
+    if session is not None:
+        return await getattr(session, method)(*args)
+    async with HapiSession() as session:
+        return await getattr(session, method)(*args)
+
+
+async def hapi_async(server, dataset, parameters, start, stop, session=None):
+    """read the request, like hapiclient.hapi.  See HapiSession.hapi."""
+    return await _with_session(session, 'hapi', server, dataset, parameters, start, stop)
+
+
+async def to_SpaceData_async(server, dataset, parameters, start, stop, session=None):
+    """Read the request and convert it to SpaceData without blocking the event loop.
+
+    spacedata = await to_SpaceData_async(server, dataset, parameters, start, stop)
+
+    Parameters
+    ----------
+    server, dataset, parameters, start, stop : str
+        the HAPI request, as for hapiclient.hapi
+    session : HapiSession
+        the session to use, so its connections are shared with other requests.  When None,
+        a session is opened for this request alone.
+    """
+    return await _with_session(session, 'to_SpaceData', server, dataset, parameters, start, stop)
+
+
+async def hapi_to_time_series_async(server, dataset, parameters, start, stop, session=None):
+    """Read the request and convert it to a SunPy TimeSeries.  See to_SpaceData_async."""
+    return await _with_session(session, 'hapi_to_time_series', server, dataset, parameters, start, stop)
+
+
+async def to_CDF_async(server, dataset, parameters, start, stop, cdfname, session=None):
+    """Read the request and write it to the CDF.  See to_SpaceData_async."""
+    return await _with_session(session, 'to_CDF', server, dataset, parameters, start, stop, cdfname)
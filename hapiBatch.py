@@ -0,0 +1,323 @@
+"""Convert many HAPI requests to files with a pool of worker processes.
+
+Each request is split into one output per day (or per --chunk-hours), and each
+finished output is added to a manifest with the checksums of its input and output,
+and the size and modification time of the output.  When the run is interrupted and
+started again, the outputs already in the manifest are skipped, and only those whose
+size or time changed are read to compare their checksums.  With --recheck, every
+request is read again, and outputs whose input and checksum have not changed are
+kept as they are.
+
+python hapiBatch.py jobs.jsonl --outdir /data/cdfs --workers 8
+
+where each line of jobs.jsonl is a request like:
+
+{"server": "https://cdaweb.gsfc.nasa.gov/hapi", "dataset": "PO_H0_HYD", "parameters": "", "start": "2008-03-20Z", "stop": "2008-03-31Z"}
+"""
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy
+
+from hapiParallel import partition
+from hapiPlan import plan_key
+
+# the file extension of each output format
+FORMATS = {'cdf': '.cdf', 'json': '.txt', 'hdf5': '.h5'}
+
+
+def output_name(dataset, start, fmt='cdf'):
+    """
+    Return the file name for the output of one chunk, like "PO_H0_HYD_20080320.cdf".
+
+    Parameters
+    ----------
+    dataset : str
+        the dataset id
+    start : str
+        the isotime of the start of the chunk
+    fmt : str
+        the output format, one of FORMATS
+    """
+    t = numpy.datetime_as_string(numpy.datetime64(start.rstrip('Z'), 's'))
+    stamp = t[:10].replace('-', '')
+    if not t.endswith('T00:00:00'):
+        stamp = stamp + 'T' + t[11:].replace(':', '')
+    return '%s_%s%s' % (dataset.replace('/', '_'), stamp, FORMATS[fmt])
+
+
+def expand_jobs(requests, outdir, fmt='cdf', chunk=numpy.timedelta64(1, 'D')):
+    """
+    Split each request into a job for each chunk of time.
+
+    Parameters
+    ----------
+    requests : list of dict
+        each with 'server', 'dataset', 'start' and 'stop', and optionally 'parameters'
+    outdir : str
+        the directory for the outputs
+    fmt : str
+        the output format, one of FORMATS
+    chunk : numpy.timedelta64
+        the time covered by each output, one day by default.
+
+    Return
+    ------
+    list of dict
+        the jobs, each a request with 'output', the name of its file.
+    """
+    jobs = []
+    for r in requests:
+        for t0, t1 in partition(r['start'], r['stop'], chunk):
+            job = {'server': r['server'], 'dataset': r['dataset'], 'parameters': r.get('parameters', ''),
+                   'start': t0, 'stop': t1}
+            job['output'] = os.path.join(outdir, output_name(r['dataset'], t0, fmt))
+            jobs.append(job)
+    return jobs
+
+
+def job_key(job):
+    """return the key of a job in the manifest."""
+    s = json.dumps(job, sort_keys=True)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def file_sha256(filename):
+    """return the SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def input_sha256(hapidata):
+    """return the SHA-256 hex digest of a HAPI response, its records and info."""
+    data, meta = hapidata
+    h = hashlib.sha256(plan_key(meta).encode('utf-8'))
+    h.update(numpy.ascontiguousarray(data).tobytes())
+    return h.hexdigest()
+
+
+def read_manifest(filename):
+    """
+    Return the entries of a manifest, keyed by job_key.  A later entry for a job replaces
+    an earlier one, and a last line left incomplete by an interrupted run is ignored.
+
+    Parameters
+    ----------
+    filename : str
+        the manifest, which need not exist yet
+    """
+    entries = {}
+    if not os.path.exists(filename):
+        return entries
+    with open(filename) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['key']] = entry
+    return entries
+
+
+def is_done(entry, recheck=False):
+    """
+    Return True if the output of a manifest entry is still there and unchanged.  When its
+    size and modification time are those in the manifest it is taken to be unchanged, and
+    only otherwise is its checksum computed.
+
+    Parameters
+    ----------
+    entry : dict
+        the manifest entry
+    recheck : bool
+        if True, the checksum is always computed.
+    """
+    output = entry['job']['output']
+    try:
+        st = os.stat(output)
+    except FileNotFoundError:
+        return False
+    if not recheck and (st.st_size, st.st_mtime_ns) == (entry.get('output_size'), entry.get('output_mtime_ns')):
+        return True
+    return file_sha256(output) == entry['output_sha256']
+
+
+def write_output(hapidata, filename, fmt='cdf'):
+    """
+    Write the response to the file, in the format given.
+
+    Parameters
+    ----------
+    hapidata : tuple
+        the data and metadata, as returned by hapiclient.hapi
+    filename : str
+        the name of the file
+    fmt : str
+        'cdf' for to_CDF, or 'json' or 'hdf5' for to_SpaceData written with
+        spacepy.datamodel.toJSONheadedASCII or toHDF5.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('fmt must be one of %s, not %s' % (list(FORMATS), fmt))
+    if fmt == 'cdf':
+        import fromHapiToCDF
+        fromHapiToCDF.to_CDF(hapidata, filename)
+    else:
+        import spacepy.datamodel as datamodel
+        import fromHapiToSpaceData
+        spacedata = fromHapiToSpaceData.to_SpaceData(hapidata)
+        if fmt == 'json':
+            datamodel.toJSONheadedASCII(filename, spacedata)
+        else:
+            datamodel.toHDF5(filename, spacedata)
+
+
+def convert_job(job, fmt='cdf', previous=None, opts=None):
+    """
+    Read one job from its server and write its output.  The output is written to a
+    temporary file which replaces the output when complete, so an interrupted job
+    leaves no partial output.
+
+    Parameters
+    ----------
+    job : dict
+        the job, from expand_jobs
+    fmt : str
+        the output format, one of FORMATS
+    previous : dict
+        the manifest entry from an earlier run.  When the input is the same and the
+        output is unchanged, the output is not written again.
+    opts : dict
+        options passed to hapiclient.hapi
+
+    Return
+    ------
+    dict
+        the manifest entry, whose 'status' is 'converted' or 'unchanged'
+    """
+    import hapiclient
+    t0 = time.perf_counter()
+    opts = {'logging': False} if opts is None else opts
+    hapidata = hapiclient.hapi(job['server'], job['dataset'], job['parameters'], job['start'], job['stop'], **opts)
+    digest = input_sha256(hapidata)
+
+    if previous is not None and previous['input_sha256'] == digest and is_done(previous, recheck=True):
+        return dict(previous, status='unchanged')
+
+    output = job['output']
+    outdir, name = os.path.split(output)
+    if outdir != '' and not os.path.exists(outdir):
+        os.makedirs(outdir, exist_ok=True)
+    partial = os.path.join(outdir, '.part.' + name)
+    if os.path.exists(partial):
+        os.remove(partial)
+    write_output(hapidata, partial, fmt)
+    os.replace(partial, output)
+    st = os.stat(output)
+
+    return {'key': job_key(job), 'job': job, 'format': fmt, 'records': len(hapidata[0]),
+            'input_sha256': digest, 'output_sha256': file_sha256(output),
+            'output_size': st.st_size, 'output_mtime_ns': st.st_mtime_ns,
+            'seconds': time.perf_counter() - t0, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'status': 'converted'}
+
+
+def run(jobs, manifest, fmt='cdf', workers=None, recheck=False, opts=None, log=sys.stderr):
+    """
+    Convert the jobs with a pool of processes, adding each finished output to the manifest.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        the jobs, from expand_jobs
+    manifest : str
+        the manifest file, which is read to find the finished jobs, and appended to.
+    fmt : str
+        the output format, one of FORMATS
+    workers : int
+        the number of processes, None for one per CPU, or 0 to convert in this process.
+    recheck : bool
+        if True, jobs in the manifest are read again, and written only if their input changed.
+    opts : dict
+        options passed to hapiclient.hapi
+    log : file
+        where progress and failures are reported, or None
+
+    Return
+    ------
+    dict
+        the number of jobs 'skipped', 'converted', 'unchanged' and 'failed'
+    """
+    done = read_manifest(manifest)
+    counts = {'skipped': 0, 'converted': 0, 'unchanged': 0, 'failed': 0}
+
+    todo = []
+    for job in jobs:
+        previous = done.get(job_key(job))
+        if previous is not None and previous['format'] == fmt and is_done(previous):
+            if not recheck:
+                counts['skipped'] += 1
+                continue
+        else:
+            previous = None
+        todo.append((job, previous))
+
+    if workers == 0:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    if os.path.dirname(manifest) != '':
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    with executor, open(manifest, 'a') as out:
+        futures = {executor.submit(convert_job, job, fmt, previous, opts): job for job, previous in todo}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                if log is not None:
+                    log.write('failed %s %s %s: %s\n' % (job['dataset'], job['start'], job['stop'], e))
+                continue
+            counts[entry['status']] += 1
+            if entry['status'] == 'converted':
+                out.write(json.dumps(entry) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+            if log is not None:
+                log.write('%s %s\n' % (entry['status'], job['output']))
+    return counts
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Convert many HAPI requests to files in parallel.')
+    parser.add_argument('jobs', help='file with one JSON request on each line')
+    parser.add_argument('--outdir', default='.', help='directory for the outputs')
+    parser.add_argument('--format', default='cdf', choices=list(FORMATS))
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, by default one per CPU')
+    parser.add_argument('--manifest', default=None, help='manifest file, by default manifest.jsonl in the outdir')
+    parser.add_argument('--chunk-hours', type=int, default=24, help='hours of data in each output')
+    parser.add_argument('--recheck', action='store_true', help='read finished jobs again, and write any which changed')
+    opts = parser.parse_args(args)
+
+    with open(opts.jobs) as f:
+        requests = [json.loads(line) for line in f if line.strip() != '']
+    jobs = expand_jobs(requests, opts.outdir, opts.format, numpy.timedelta64(opts.chunk_hours, 'h'))
+    manifest = opts.manifest if opts.manifest is not None else os.path.join(opts.outdir, 'manifest.jsonl')
+
+    counts = run(jobs, manifest, opts.format, opts.workers, opts.recheck)
+    print(' '.join('%s=%d' % item for item in counts.items()))
+    return 1 if counts['failed'] > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""A cache of converted results, so that a request overlapping earlier requests
+converts only the parts not already converted.
+
+Each converted piece is kept in a file, with the interval of time it covers.
+A request is answered from the cached pieces within it, and only the gaps
+between them are read from the server and converted.  When the files take
+more than max_bytes, the least recently used are removed.
+
+cache = ConvertedCache('/tmp/hapiCache')
+spacedata = cache.to_SpaceData(server, dataset, parameters, '2016-01-01Z', '2016-01-03Z')
+spacedata = cache.to_SpaceData(server, dataset, parameters, '2016-01-02Z', '2016-01-04Z')  # reads only 01-03
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+import numpy
+
+from hapiParallel import stitch_SpaceData, stitch_time_series
+from hapiTimes import isotime_to_nanoseconds, nanoseconds_to_tt2000
+
+
+class _PickleStore:
+    """pieces which are pickled SpaceData or TimeSeries."""
+
+    extension = '.pkl'
+
+    def __init__(self, convert, times, stitch):
+        self.convert = convert
+        self.times = times
+        self.stitch = stitch
+
+    def write(self, hapidata, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump(self.convert(hapidata), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def bound(self, ns):
+        return ns
+
+    def close(self, piece):
+        pass
+
+
+class _CDFStore:
+    """pieces which are CDF files, joined by copying their records to a new CDF."""
+
+    extension = '.cdf'
+
+    def write(self, hapidata, filename):
+        import fromHapiToCDF
+        fromHapiToCDF.to_CDF(hapidata, filename)
+
+    def read(self, filename):
+        import spacepy.pycdf
+        return spacepy.pycdf.CDF(filename)
+
+    def times(self, cdf, time_name):
+        return cdf.raw_var(time_name)[...]
+
+    def bound(self, ns):
+        return nanoseconds_to_tt2000(ns)
+
+    def stitch(self, pieces, masks, time_name, cdfname):
+        import spacepy.pycdf
+        first = pieces[0]
+        with spacepy.pycdf.CDF(cdfname, create=True) as out:
+            out.attrs.clone(first.attrs)
+            for name in first:
+                v = first[name]
+                if name == time_name or 'DEPEND_0' in v.attrs:
+                    out.clone(v, data=False)
+                    for piece, mask in zip(pieces, masks):
+                        if numpy.any(mask):
+                            out.raw_var(name).extend(piece.raw_var(name)[...][mask])
+                else:
+                    out.clone(v)
+        return cdfname
+
+    def close(self, piece):
+        piece.close()
+
+
+def _spacedata_times(spacedata, time_name):
+    return numpy.array(spacedata[time_name], dtype='M8[ns]').view(numpy.int64)
+
+
+def _time_series_times(ts, time_name):
+    return ts.to_dataframe().index.values.astype('M8[ns]').view(numpy.int64)
+
+
+def _stores():
+    import fromHapiToSpaceData
+    import fromHapiToSunPy
+    return {
+        'SpaceData': _PickleStore(fromHapiToSpaceData.to_SpaceData, _spacedata_times,
+                                  lambda pieces, masks, time_name, output: stitch_SpaceData(pieces, masks, time_name)),
+        'TimeSeries': _PickleStore(fromHapiToSunPy.hapi_to_time_series, _time_series_times,
+                                   lambda pieces, masks, time_name, output: stitch_time_series(pieces, masks)),
+        'CDF': _CDFStore(),
+    }
+
+
+def _isotime(ns):
+    """return the HAPI isotime of nanoseconds since 1970, to the millisecond when that is exact."""
+    unit = 'ms' if ns % 1000000 == 0 else 'ns'
+    return numpy.datetime_as_string(numpy.int64(ns).view('M8[ns]'), unit=unit) + 'Z'
+
+
+def gaps(intervals, start, stop):
+    """
+    Return the parts of the interval from start to stop not covered by the intervals.
+
+    Parameters
+    ----------
+    intervals : list of tuple
+        (start, stop) of each interval covered
+    start, stop : int
+        the interval requested
+
+    Return
+    ------
+    list of tuple
+        (start, stop) of each gap, in order
+    """
+    result = []
+    cursor = start
+    for t0, t1 in sorted(intervals):
+        if t1 <= cursor or t0 >= stop:
+            continue
+        if t0 > cursor:
+            result.append((cursor, t0))
+        cursor = max(cursor, t1)
+        if cursor >= stop:
+            break
+    if cursor < stop:
+        result.append((cursor, stop))
+    return result
+
+
+class ConvertedCache:
+    """A cache of converted results in a directory, for to_SpaceData, hapi_to_time_series and to_CDF.
+
+    Parameters
+    ----------
+    directory : str
+        the directory holding the cached pieces and their index
+    max_bytes : int
+        the most bytes of cached pieces kept, after which the least recently used are removed.
+    fetch : callable
+        the function reading from the server, hapiclient.hapi by default.
+    opts : dict
+        options passed to fetch
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30, fetch=None, opts=None):
+        if fetch is None:
+            import hapiclient
+            fetch = hapiclient.hapi
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetch = fetch
+        self.opts = {'logging': False} if opts is None else opts
+        self._lock = threading.Lock()
+        self._stores = _stores()
+        os.makedirs(directory, exist_ok=True)
+        self._index_file = os.path.join(directory, 'index.json')
+        if os.path.exists(self._index_file):
+            with open(self._index_file) as f:
+                self._entries = json.load(f)
+        else:
+            self._entries = []
+
+    def _save_index(self):
+        partial = self._index_file + '.part'
+        with open(partial, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(partial, self._index_file)
+
+    @property
+    def size(self):
+        """the bytes of all the cached pieces"""
+        return sum(e['bytes'] for e in self._entries)
+
+    def coverage(self, server, dataset, parameters, adapter='SpaceData'):
+        """
+        Return the intervals of time cached for the request, merged where they touch.
+
+        Return
+        ------
+        list of tuple
+            (start, stop) isotimes of each interval
+        """
+        key = [server, dataset, parameters, adapter]
+        with self._lock:
+            intervals = sorted((e['start'], e['stop']) for e in self._entries if e['key'] == key)
+        merged = []
+        for t0, t1 in intervals:
+            if merged and t0 <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], t1)
+            else:
+                merged.append([t0, t1])
+        return [(_isotime(t0), _isotime(t1)) for t0, t1 in merged]
+
+    def _add(self, key, adapter, t0, t1):
+        """read and convert the interval from t0 to t1, and add it to the cache."""
+        server, dataset, parameters = key[:3]
+        hapidata = self.fetch(server, dataset, parameters, _isotime(t0), _isotime(t1), **self.opts)
+        store = self._stores[adapter]
+        name = hashlib.sha1(json.dumps([key, t0, t1]).encode('utf-8')).hexdigest() + store.extension
+        filename = os.path.join(self.directory, name)
+        store.write(hapidata, filename)
+        return {'key': key, 'start': int(t0), 'stop': int(t1), 'file': name, 'bytes': os.path.getsize(filename),
+                'used': time.time(), 'time_name': hapidata[1]['parameters'][0]['name']}
+
+    def _evict(self, keep):
+        """remove the least recently used pieces, other than those in keep, until the cache fits."""
+        entries = sorted(self._entries, key=lambda e: e['used'])
+        total = sum(e['bytes'] for e in entries)
+        for e in entries:
+            if total <= self.max_bytes:
+                break
+            if e['file'] in keep:
+                continue
+            os.remove(os.path.join(self.directory, e['file']))
+            self._entries.remove(e)
+            total = total - e['bytes']
+
+    def get(self, server, dataset, parameters, start, stop, adapter='SpaceData', output=None):
+        """
+        Return the converted result for the request, converting only the parts not cached.
+
+        Parameters
+        ----------
+        server, dataset, parameters, start, stop : str
+            the HAPI request, as for hapiclient.hapi
+        adapter : str
+            'SpaceData', 'TimeSeries' or 'CDF'
+        output : str
+            the CDF file to write, for the CDF adapter
+
+        Return
+        ------
+        SpaceData, GenericTimeSeries, or the name of the CDF
+        """
+        if adapter not in self._stores:
+            raise ValueError('adapter must be one of %s, not %s' % (list(self._stores), adapter))
+        if adapter == 'CDF' and output is None:
+            raise ValueError('output must be given for the CDF adapter')
+        store = self._stores[adapter]
+        key = [server, dataset, parameters, adapter]
+        t0, t1 = (int(t) for t in isotime_to_nanoseconds([start, stop]))
+        if t1 <= t0:
+            raise ValueError('the interval from %s to %s is empty' % (start, stop))
+
+        with self._lock:
+            cached = [e for e in self._entries if e['key'] == key and e['stop'] > t0 and e['start'] < t1]
+        added = []
+        for g0, g1 in gaps([(e['start'], e['stop']) for e in cached], t0, t1):
+            # each piece goes into the index as it is written, so a later failure leaves no stray files
+            entry = self._add(key, adapter, g0, g1)
+            with self._lock:
+                self._entries.append(entry)
+                self._save_index()
+            added.append(entry)
+        entries = sorted(cached + added, key=lambda e: e['start'])
+
+        with self._lock:
+            now = time.time()
+            for e in entries:
+                e['used'] = now
+            self._save_index()
+
+        time_name = entries[0]['time_name']
+        pieces = [store.read(os.path.join(self.directory, e['file'])) for e in entries]
+        try:
+            lo, hi = store.bound(numpy.array([t0, t1]))
+            masks = []
+            last = None
+            for piece in pieces:
+                t = store.times(piece, time_name)
+                mask = (t >= lo) & (t < hi)
+                if last is not None:
+                    mask &= t > last
+                if numpy.any(mask):
+                    last = t[mask].max()
+                masks.append(mask)
+            result = store.stitch(pieces, masks, time_name, output)
+        finally:
+            for piece in pieces:
+                store.close(piece)
+
+        with self._lock:
+            self._evict(set(e['file'] for e in entries))
+            self._save_index()
+        return result
+
+    def to_SpaceData(self, server, dataset, parameters, start, stop):
+        """return the request converted with fromHapiToSpaceData.to_SpaceData, using the cache."""
+        return self.get(server, dataset, parameters, start, stop, 'SpaceData')
+
+    def hapi_to_time_series(self, server, dataset, parameters, start, stop):
+        """return the request converted with fromHapiToSunPy.hapi_to_time_series, using the cache."""
+        return self.get(server, dataset, parameters, start, stop, 'TimeSeries')
+
+    def to_CDF(self, server, dataset, parameters, start, stop, cdfname):
+        """write the request to the CDF, as fromHapiToCDF.to_CDF does, using the cache."""
+        return self.get(server, dataset, parameters, start, stop, 'CDF', cdfname)
+
+    def clear(self):
+        """Remove every cached piece."""
+        with self._lock:
+            for e in self._entries:
+                os.remove(os.path.join(self.directory, e['file']))
+            self._entries = []
+            self._save_index()
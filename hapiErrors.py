@@ -0,0 +1,17 @@
+class HapiError(Exception):
+    """An error with a HAPI status, sent to a client by hapiServer or received from a server by hapiAsync.
+
+    Parameters
+    ----------
+    http_code : int
+        the HTTP status
+    hapi_code : int or None
+        the HAPI status code, like 1406, or None when the server sent no HAPI status
+    message : str
+        the HAPI status message
+    """
+
+    def __init__(self, http_code, hapi_code, message):
+        super().__init__(message)
+        self.http_code = http_code
+        self.hapi_code = hapi_code
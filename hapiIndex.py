@@ -0,0 +1,138 @@
+"""The sorted time index carried by the SpaceData and TimeSeries outputs, for selecting
+windows of time without scanning the records.
+
+spacedata = to_SpaceData(hapidata)
+window = select(spacedata, '2016-01-01T01:00Z', '2016-01-01T02:00Z')
+
+The window is found with a binary search of the int64 nanoseconds of the records, and
+each record-varying variable of the window is a view onto the variable of the whole.
+Variables which are not record-varying, like bins, are the same objects in both.
+"""
+import datetime
+
+import numpy
+
+from hapiTimes import isotime_to_nanoseconds
+
+
+class TimeIndex:
+    """The times of the records as int64 nanoseconds since 1970, with the name of the time variable.
+
+    Parameters
+    ----------
+    ns : numpy.ndarray
+        int64 nanoseconds of the records
+    name : str
+        the name of the time variable, like "Time"
+    """
+
+    def __init__(self, ns, name):
+        self.ns = numpy.asarray(ns, dtype=numpy.int64)
+        self.name = name
+        # HAPI records are in time order, so the sort is only for responses which are not
+        self.monotonic = len(self.ns) < 2 or not numpy.any(self.ns[1:] < self.ns[:-1])
+        self._order = None
+
+    def __len__(self):
+        return len(self.ns)
+
+    def slice(self, start, stop):
+        """
+        Return the records from start up to but not including stop.
+
+        Parameters
+        ----------
+        start, stop : str, datetime, numpy.datetime64 or int
+            the times, as isotimes or nanoseconds since 1970
+
+        Return
+        ------
+        slice or numpy.ndarray
+            a slice of the records, or when the records are not in time order, the
+            indices of the records in time order.
+        """
+        t0, t1 = as_nanoseconds(start), as_nanoseconds(stop)
+        if self.monotonic:
+            i0, i1 = numpy.searchsorted(self.ns, [t0, t1], 'left')
+            return slice(int(i0), int(max(i0, i1)))
+        if self._order is None:
+            self._order = numpy.argsort(self.ns, kind='stable')
+        ns = self.ns[self._order]
+        i0, i1 = numpy.searchsorted(ns, [t0, t1], 'left')
+        return self._order[i0:max(i0, i1)]
+
+
+def as_nanoseconds(t):
+    """return int64 nanoseconds since 1970 of an isotime, datetime, datetime64 or int."""
+    if isinstance(t, (str, bytes)):
+        return int(isotime_to_nanoseconds([t])[0])
+    if isinstance(t, (int, numpy.integer)):
+        return int(t)
+    if isinstance(t, datetime.datetime) and t.tzinfo is not None:
+        t = t.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int(numpy.datetime64(t, 'ns').astype(numpy.int64))
+
+
+def time_index(result):
+    """
+    Return the TimeIndex of a SpaceData or TimeSeries.  The adapters make it with the
+    result; for other results it is made from the time variable, and kept.
+
+    Parameters
+    ----------
+    result : SpaceData or GenericTimeSeries
+        the output of to_SpaceData or hapi_to_time_series
+    """
+    index = getattr(result, 'time_index', None)
+    if index is not None:
+        return index
+    if isinstance(result, dict):
+        names = [v.attrs['DEPEND_0'] for v in result.values() if 'DEPEND_0' in v.attrs]
+        if len(names) == 0:
+            raise ValueError('the SpaceData has no variables with DEPEND_0')
+        ns = numpy.array(result[names[0]], dtype='M8[ns]').view(numpy.int64)
+        index = TimeIndex(ns, names[0])
+    else:
+        df = result.to_dataframe()
+        index = TimeIndex(df.index.asi8, df.index.name)
+    result.time_index = index
+    return index
+
+
+def select(result, start, stop):
+    """
+    Return the records of a SpaceData or TimeSeries from start up to but not including stop.
+
+    Parameters
+    ----------
+    result : SpaceData or GenericTimeSeries
+        the output of to_SpaceData or hapi_to_time_series
+    start, stop : str, datetime, numpy.datetime64 or int
+        the times, as isotimes or nanoseconds since 1970
+
+    Return
+    ------
+    SpaceData or GenericTimeSeries
+        the window, whose record-varying variables are views onto those of result when its
+        records are in time order, and copies otherwise.  It has its own TimeIndex.
+    """
+    index = time_index(result)
+    records = index.slice(start, stop)
+
+    if isinstance(result, dict):
+        import spacepy.datamodel as datamodel
+        window = datamodel.SpaceData()
+        for name, v in result.items():
+            if name == index.name or 'DEPEND_0' in v.attrs:
+                window[name] = v[records]
+            else:
+                window[name] = v
+        window.attrs = result.attrs
+    else:
+        from sunpy.timeseries import GenericTimeSeries
+        df = result.to_dataframe()
+        metas = result.meta.metas
+        window = GenericTimeSeries(data=df.iloc[records], units=result.units,
+                                   meta=dict(metas[0]) if len(metas) > 0 else None)
+    window.time_index = TimeIndex(index.ns[records], index.name)
+    return window
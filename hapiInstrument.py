@@ -0,0 +1,171 @@
+"""Timing of each stage of a conversion, like time decoding, bins, or the CDF write.
+
+Register a hook, which is called with a Timing after each stage of every conversion.
+Timings is a hook which collects them:
+
+with Timings() as timings:
+    fromHapiToCDF.to_CDF(hapidata, '/tmp/mydata.cdf')
+print(timings)
+
+When no hook is registered, each stage costs one check of the hooks.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+Timing = collections.namedtuple('Timing', ['adapter', 'stage', 'seconds', 'records', 'nbytes'])
+Timing.__doc__ = """The time of one stage of a conversion.
+
+Attributes
+----------
+adapter : str
+    the adapter, like 'to_CDF'
+stage : str
+    the stage, one of 'metadata', 'times', 'bins', 'arrays', 'units', 'dataframe', or for
+    CDFs 'create' (or 'open' to append), 'write' and 'close'.  The 'bins' of a CDF are
+    timed within its 'create'.
+seconds : float
+    the wall time of the stage
+records : int or None
+    the number of records handled, when known
+nbytes : int or None
+    the number of bytes handled, when known
+"""
+
+_hooks = ()
+_hooks_lock = threading.Lock()
+
+_null_stage = contextlib.nullcontext()
+
+
+def add_hook(hook):
+    """
+    Call hook with a Timing after each stage of every conversion, on the thread which did it.
+
+    Parameters
+    ----------
+    hook : callable
+        function of one Timing
+    """
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook):
+    """
+    Stop calling a hook registered with add_hook.
+
+    Parameters
+    ----------
+    hook : callable
+        the hook
+    """
+    global _hooks
+    with _hooks_lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+class _Stage:
+    """times one stage and reports it to the hooks."""
+
+    __slots__ = ('adapter', 'stage', 'records', 'nbytes', 't0')
+
+    def __init__(self, adapter, stage, records, nbytes):
+        self.adapter = adapter
+        self.stage = stage
+        self.records = records
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        timing = Timing(self.adapter, self.stage, time.perf_counter() - self.t0, self.records, self.nbytes)
+        for hook in _hooks:
+            hook(timing)
+
+
+def stage(adapter, name, records=None, nbytes=None):
+    """
+    Return a context manager which times a stage of a conversion, or does nothing when no hook is registered.
+
+    with stage('to_CDF', 'times', len(data)):
+        tt2000 = isotime_to_tt2000(data['Time'])
+
+    Parameters
+    ----------
+    adapter : str
+        the adapter, like 'to_CDF'
+    name : str
+        the stage
+    records : int
+        the number of records handled, when known
+    nbytes : int
+        the number of bytes handled, when known
+    """
+    if not _hooks:
+        return _null_stage
+    return _Stage(adapter, name, records, nbytes)
+
+
+class Timings:
+    """A hook which keeps every Timing.  Used as a context manager, it is registered
+    on entry and removed on exit.
+
+    Attributes
+    ----------
+    timings : list of Timing
+        each stage timed, in the order they finished
+    """
+
+    def __init__(self):
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        with self._lock:
+            self.timings.append(timing)
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_hook(self)
+
+    def totals(self):
+        """
+        Return the total of each stage of each adapter.
+
+        Return
+        ------
+        dict
+            Timing with the total seconds, records and bytes, keyed by (adapter, stage),
+            in the order each stage was first seen.
+        """
+        totals = collections.OrderedDict()
+        with self._lock:
+            timings = list(self.timings)
+        for t in timings:
+            key = (t.adapter, t.stage)
+            if key not in totals:
+                totals[key] = t
+            else:
+                s = totals[key]
+                totals[key] = Timing(t.adapter, t.stage, s.seconds + t.seconds,
+                                     None if s.records is None or t.records is None else s.records + t.records,
+                                     None if s.nbytes is None or t.nbytes is None else s.nbytes + t.nbytes)
+        return totals
+
+    def __str__(self):
+        lines = ['%-20s %-10s %10s %10s %12s' % ('adapter', 'stage', 'seconds', 'records', 'bytes')]
+        for t in self.totals().values():
+            lines.append('%-20s %-10s %10.4f %10s %12s' % (
+                t.adapter, t.stage, t.seconds, '' if t.records is None else t.records,
+                '' if t.nbytes is None else t.nbytes))
+        return '\n'.join(lines)
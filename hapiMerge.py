@@ -0,0 +1,368 @@
+"""Merge several datasets, at different cadences, onto one set of times.
+
+Each input may be a HAPI response from hapiclient.hapi, a SpaceData from to_SpaceData,
+or a TimeSeries from hapi_to_time_series.  The records of each are found for each time
+with numpy.searchsorted, and the values are taken from the nearest or previous record,
+or interpolated between the records either side.  No DataFrame is made for the inputs,
+and the inputs are not copied; only the merged arrays are new.
+
+omni = hapiclient.hapi(server, 'OMNI_HRO2_1MIN', 'flow_speed', start, stop)
+mfi = hapiclient.hapi(server, 'AC_H0_MFI', 'BGSEc', start, stop)
+kp = hapiclient.hapi(server, 'OMNI2_H0_MRG1HR', 'KP1800', start, stop)
+merged = merge([omni, mfi, kp], method=['nearest', 'linear', 'previous'],
+               tolerance=[None, numpy.timedelta64(32, 's'), numpy.timedelta64(1, 'h')])
+"""
+import numpy
+
+from hapiPlan import compile_plan, fill_value
+from hapiTimes import isotime_to_nanoseconds, nanoseconds_to_datetime
+
+METHODS = ('nearest', 'previous', 'linear')
+
+# the value of integer variables where there is no record, when they have no FILLVAL
+INTEGER_FILL = -2147483648
+
+_never = numpy.iinfo(numpy.int64).max
+
+
+class _Input:
+    """the times, record-varying variables and support variables of one input."""
+
+    def __init__(self, time_name, times, variables, support):
+        self.time_name = time_name
+        self.times = times
+        self.variables = variables
+        self.support = support
+
+
+def _spacedata_input(spacedata):
+    time_name = None
+    variables = []
+    support = []
+    for name, v in spacedata.items():
+        if 'DEPEND_0' in v.attrs:
+            time_name = v.attrs['DEPEND_0']
+            variables.append((name, numpy.asarray(v), dict(v.attrs)))
+    if time_name is None:
+        raise ValueError('the SpaceData has no variables with DEPEND_0')
+    for name, v in spacedata.items():
+        if name != time_name and 'DEPEND_0' not in v.attrs:
+            support.append((name, v))
+    times = numpy.array(spacedata[time_name], dtype='M8[ns]').view(numpy.int64)
+    return _Input(time_name, times, variables, support)
+
+
+def _hapi_input(hapidata):
+    """the variables are those of to_SpaceData, without converting the times to datetimes."""
+    import spacepy.datamodel as datamodel
+    from fromHapiToSpaceData import spacedata_variables
+    data, meta = hapidata
+    plan = compile_plan(meta)
+    variables = []
+    support = []
+    for name, (attrs, make) in spacedata_variables(plan).items():
+        if name == plan.time_name:
+            continue
+        values = make(data, False)
+        if 'DEPEND_0' in attrs:
+            variables.append((name, numpy.asarray(values), dict(attrs)))
+        else:
+            support.append((name, datamodel.dmarray(values, attrs=dict(attrs))))
+    return _Input(plan.time_name, isotime_to_nanoseconds(data[plan.time_name]), variables, support)
+
+
+def _column_parameters(ts):
+    """return the HAPI parameter of each column of a TimeSeries from hapi_to_time_series, by column name."""
+    metas = ts.meta.metas
+    if len(metas) == 0 or 'parameters' not in metas[0]:
+        return {}
+    columns = {}
+    for p in compile_plan(dict(metas[0])).parameters:
+        columns[p.name] = p
+        for index in numpy.ndindex(*p.size):
+            columns[p.name + ''.join('_%d' % i for i in index)] = p
+    return columns
+
+
+def _time_series_input(ts):
+    df = ts.to_dataframe()
+    times = df.index.values.astype('M8[ns]').view(numpy.int64)
+    time_name = df.index.name if df.index.name is not None else 'Time'
+    parameters = _column_parameters(ts)
+    variables = []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        attrs = {'UNITS': ts.units.get(name), 'DEPEND_0': time_name}
+        fill = fill_value(parameters[name], values.dtype) if name in parameters else None
+        if fill is not None:
+            attrs['FILLVAL'] = fill
+        variables.append((str(name), values, attrs))
+    return _Input(time_name, times, variables, [])
+
+
+def _as_input(x):
+    """return the _Input of a HAPI response, SpaceData or TimeSeries."""
+    if isinstance(x, tuple):
+        return _hapi_input(x)
+    elif isinstance(x, dict):
+        return _spacedata_input(x)
+    elif hasattr(x, 'to_dataframe'):
+        return _time_series_input(x)
+    else:
+        raise TypeError('inputs must be HAPI responses, SpaceData or TimeSeries, not %s' % type(x).__name__)
+
+
+def _as_nanoseconds(times):
+    """return int64 nanoseconds since 1970 of an array of isotimes, datetimes or datetime64s."""
+    times = numpy.asarray(times)
+    if times.dtype.kind in 'SU':
+        return isotime_to_nanoseconds(times)
+    return times.astype('M8[ns]').view(numpy.int64)
+
+
+def align(times, base, method='nearest', tolerance=None):
+    """
+    Find the records of sorted times to use for each of the base times.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        int64 nanoseconds of the records, in increasing order
+    base : numpy.ndarray
+        int64 nanoseconds of the times to find values for
+    method : str
+        'nearest' for the nearest record, 'previous' for the last record at or before
+        each time, or 'linear' for the records either side.
+    tolerance : numpy.timedelta64
+        the furthest a record may be from the time, or for 'linear' the longest gap which
+        is interpolated across.  None for no limit.
+
+    Return
+    ------
+    tuple
+        (index, weight, valid), where the value at each base time is the record index, or for
+        'linear' the records index and index+1 weighted by 1-weight and weight.  weight is None
+        except for 'linear', and valid is False where there is no record within the tolerance.
+    """
+    if method not in METHODS:
+        raise ValueError('method must be one of %s, not %s' % (METHODS, method))
+    tol = _never if tolerance is None else numpy.timedelta64(tolerance).astype('m8[ns]').astype(numpy.int64)
+    n = len(times)
+    if n == 0:
+        return numpy.zeros(len(base), dtype=numpy.intp), None, numpy.zeros(len(base), dtype=bool)
+    if method == 'linear' and n < 2:
+        method, tol = 'nearest', 0
+
+    if method == 'previous':
+        index = numpy.searchsorted(times, base, 'right') - 1
+        valid = index >= 0
+        index = numpy.maximum(index, 0)
+        valid &= (base - times[index]) <= tol
+        return index, None, valid
+
+    if method == 'nearest':
+        right = numpy.searchsorted(times, base, 'left')
+        left = numpy.maximum(right - 1, 0)
+        right_ok = right < n
+        right = numpy.minimum(right, n - 1)
+        dleft = numpy.where(base >= times[left], base - times[left], _never)
+        dright = numpy.where(right_ok, times[right] - base, _never)
+        use_right = dright < dleft
+        index = numpy.where(use_right, right, left)
+        valid = numpy.minimum(dleft, dright) <= tol
+        return index, None, valid
+
+    index = numpy.clip(numpy.searchsorted(times, base, 'right') - 1, 0, n - 2)
+    t0 = times[index]
+    t1 = times[index + 1]
+    gap = t1 - t0
+    weight = numpy.divide(base - t0, gap, out=numpy.zeros(len(base)), where=gap > 0)
+    valid = (base >= times[0]) & (base <= times[-1])
+    valid &= (gap <= tol) | (base == t0) | (base == t1)
+    return index, weight, valid
+
+
+def resample(values, index, weight, valid, fill=None):
+    """
+    Return the values at the base times, from the (index, weight, valid) of align.
+
+    Floating point values equal to fill are treated as missing, and the result is NaN where
+    there is no valid record.  Other values are taken from the nearer record when weight is
+    given, and are fill where there is no valid record.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        the records, whose first dimension is time
+    index, weight, valid : numpy.ndarray
+        from align
+    fill : scalar
+        the fill value of the values, or None
+
+    Return
+    ------
+    numpy.ndarray
+        a new array with a record for each base time
+    """
+    floating = values.dtype.kind == 'f'
+    if weight is None or not floating:
+        if weight is not None:
+            index = index + (weight > 0.5)
+        result = values.take(index, axis=0)
+        if floating and fill is not None and not numpy.isnan(fill):
+            result[result == fill] = numpy.nan
+    else:
+        a = values.take(index, axis=0)
+        b = values.take(index + 1, axis=0)
+        if fill is not None and not numpy.isnan(fill):
+            a[a == fill] = numpy.nan
+            b[b == fill] = numpy.nan
+        w = weight.reshape((-1,) + (1,) * (values.ndim - 1))
+        result = a + (b - a) * w
+        # where the weight is 0 or 1 the value of one record is used, even if the other is missing
+        result[weight == 0] = a[weight == 0]
+        result[weight == 1] = b[weight == 1]
+
+    if floating:
+        result[~valid] = numpy.nan
+    elif values.dtype.kind in 'SU':
+        result[~valid] = ''
+    else:
+        result[~valid] = INTEGER_FILL if fill is None else fill
+    return result
+
+
+def _per_input(option, n, name):
+    """return the option as a list with one for each input."""
+    if isinstance(option, (list, tuple)):
+        if len(option) != n:
+            raise ValueError('%s must have one for each input, %d, not %d' % (name, n, len(option)))
+        return list(option)
+    return [option] * n
+
+
+def _renamed_attrs(attrs, rename):
+    attrs = dict(attrs)
+    for k, v in attrs.items():
+        if (k.startswith('DEPEND_') or k.endswith('_VAR')) and isinstance(v, str) and v in rename:
+            attrs[k] = rename[v]
+    return attrs
+
+
+def merge(inputs, times=None, method='nearest', tolerance=None, output='SpaceData'):
+    """
+    Merge several datasets onto one set of times.
+
+    Parameters
+    ----------
+    inputs : list
+        HAPI responses from hapiclient.hapi, SpaceData from to_SpaceData or TimeSeries from
+        hapi_to_time_series, which may be mixed.
+    times : array or numpy.timedelta64
+        the times of the result, as isotimes, datetimes or datetime64s.  A numpy.timedelta64 gives
+        times at that cadence from the first to the last time of the first input, and None uses
+        the times of the first input.
+    method : str or list of str
+        'nearest', 'previous' or 'linear', see align, or a list with one for each input.
+    tolerance : numpy.timedelta64 or list
+        the furthest a record may be from a time, see align, or a list with one for each input.
+    output : str
+        'SpaceData' or 'TimeSeries'
+
+    Return
+    ------
+    SpaceData or GenericTimeSeries
+        the variables of every input, each with a record for each time.  Names used by an
+        earlier input get the number of the input, like "B_1".  Variables which are not
+        record-varying, like bins, are kept as they are.
+    """
+    if output not in ('SpaceData', 'TimeSeries'):
+        raise ValueError('output must be SpaceData or TimeSeries, not %s' % output)
+    parts = [_as_input(x) for x in inputs]
+    if len(parts) == 0:
+        raise ValueError('there must be at least one input')
+    methods = _per_input(method, len(parts), 'method')
+    tolerances = _per_input(tolerance, len(parts), 'tolerance')
+
+    first = parts[0]
+    if times is None:
+        base = first.times
+    elif isinstance(times, numpy.timedelta64):
+        step = times.astype('m8[ns]').astype(numpy.int64)
+        base = numpy.arange(first.times[0], first.times[-1] + 1, step) if len(first.times) > 0 else first.times
+    else:
+        base = _as_nanoseconds(times)
+
+    time_name = first.time_name
+    variables = []
+    support = []
+    used = {time_name}
+    for i, (part, m, tol) in enumerate(zip(parts, methods, tolerances)):
+        t = part.times
+        order = None
+        if len(t) > 1 and numpy.any(t[1:] < t[:-1]):
+            order = numpy.argsort(t, kind='stable')
+            t = t[order]
+        index, weight, valid = align(t, base, m, tol)
+
+        rename = {}
+        for name in [name for name, v in part.support] + [name for name, values, attrs in part.variables]:
+            rename[name] = name if name not in used else '%s_%d' % (name, i)
+            used.add(rename[name])
+        for name, v in part.support:
+            support.append((rename[name], v, _renamed_attrs(v.attrs, rename)))
+        for name, values, attrs in part.variables:
+            if order is not None:
+                values = values[order]
+            fill = attrs.get('FILLVAL')
+            result = resample(values, index, weight, valid, fill)
+            attrs = _renamed_attrs(attrs, rename)
+            attrs['DEPEND_0'] = time_name
+            if result.dtype.kind == 'f':
+                attrs['FILLVAL'] = numpy.nan
+            elif result.dtype.kind in 'iu':
+                attrs['FILLVAL'] = INTEGER_FILL if fill is None else fill
+            variables.append((rename[name], result, attrs))
+
+    if output == 'TimeSeries':
+        return _time_series(time_name, base, variables)
+    return _spacedata(time_name, base, variables, support)
+
+
+def _spacedata(time_name, base, variables, support):
+    import spacepy.datamodel as datamodel
+    result = datamodel.SpaceData()
+    result[time_name] = datamodel.dmarray(nanoseconds_to_datetime(base), attrs={'VAR_TYPE': 'support_data'})
+    for name, values, attrs in variables:
+        if 'UNITS' in attrs and not isinstance(attrs['UNITS'], str) and attrs['UNITS'] is not None:
+            attrs['UNITS'] = attrs['UNITS'].to_string()
+        result[name] = datamodel.dmarray(values, attrs=attrs)
+    for name, v, attrs in support:
+        result[name] = datamodel.dmarray(v, attrs=attrs)
+    return result
+
+
+def _time_series(time_name, base, variables):
+    import pandas as pd
+    from sunpy.timeseries import GenericTimeSeries
+    from hapiUnits import resolve_unit
+    import astropy.units as u
+
+    columns = {}
+    units = {}
+    for name, values, attrs in variables:
+        unit = attrs.get('UNITS')
+        if isinstance(unit, str):
+            unit = resolve_unit(unit)
+        elif unit is None:
+            unit = u.dimensionless_unscaled
+        if values.ndim == 1:
+            names = [name]
+        else:
+            names = [name + ''.join('_%d' % i for i in index) for index in numpy.ndindex(values.shape[1:])]
+        block = values.reshape(len(values), len(names))
+        for icol, column in enumerate(names):
+            columns[column] = block[:, icol]
+            units[column] = unit
+    index = pd.DatetimeIndex(base.view('M8[ns]'), name=time_name)
+    return GenericTimeSeries(data=pd.DataFrame(columns, index=index), units=units)
@@ -0,0 +1,328 @@
+import collections
+import concurrent.futures
+import os
+import time
+
+import numpy
+
+from hapiTimes import isotime_to_nanoseconds
+
+# seconds to wait before the first retry of a failed request, doubled for each retry after
+RETRY_DELAY = 0.5
+
+
+def partition(start, stop, chunk=numpy.timedelta64(1, 'D')):
+    """
+    Split the interval from start to stop into intervals no longer than chunk.
+
+    Parameters
+    ----------
+    start : str
+        HAPI isotime of the start of the interval
+    stop : str
+        HAPI isotime of the end of the interval
+    chunk : numpy.timedelta64 or datetime.timedelta
+        the length of each interval, one day by default.
+
+    Return
+    ------
+    list of tuple
+        (start, stop) isotimes for each interval
+    """
+    t0, t1 = isotime_to_nanoseconds([start, stop])
+    step = numpy.timedelta64(chunk).astype('m8[ns]').astype(numpy.int64)
+    if step <= 0:
+        raise ValueError('chunk must be positive')
+    edges = numpy.append(numpy.arange(t0, t1, step), t1)
+    isotimes = numpy.char.add(numpy.datetime_as_string(edges.view('M8[ns]'), unit='ms'), 'Z')
+    return [(str(t0), str(t1)) for t0, t1 in zip(isotimes[:-1], isotimes[1:])]
+
+
+def _fetch_chunk(server, dataset, parameters, start, stop, retries, opts):
+    """call hapiclient.hapi, trying again up to retries times when it fails, waiting longer each time."""
+    import hapiclient
+    for attempt in range(retries + 1):
+        try:
+            return hapiclient.hapi(server, dataset, parameters, start, stop, **opts)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def fetch(server, dataset, parameters, start, stop, chunk=numpy.timedelta64(1, 'D'),
+          max_workers=4, retries=2, opts=None):
+    """
+    Request each chunk of the interval concurrently on a thread pool.
+
+    Parameters
+    ----------
+    server, dataset, parameters, start, stop : str
+        the HAPI request, as for hapiclient.hapi
+    chunk : numpy.timedelta64 or datetime.timedelta
+        the length of each request, one day by default.
+    max_workers : int
+        the number of requests in flight at once
+    retries : int
+        the number of times a failed request is tried again
+    opts : dict
+        options passed to hapiclient.hapi
+
+    Return
+    ------
+    iterator of concurrent.futures.Future
+        the future hapidata tuple of each chunk, in time order.  At most max_workers
+        chunks are requested ahead of the one last taken, so the caller should use the
+        results in order, and drop each when it is done with it.  They can be converted
+        while the later ones are still being read.
+    """
+    opts = {} if opts is None else opts
+    intervals = partition(start, stop, chunk)
+    if len(intervals) == 0:
+        raise ValueError('the interval from %s to %s is empty' % (start, stop))
+    return _fetch_window(server, dataset, parameters, intervals, max_workers, retries, opts)
+
+
+def _fetch_window(server, dataset, parameters, intervals, max_workers, retries, opts):
+    """yield the future of each interval, keeping max_workers requests submitted ahead."""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    pending = collections.deque()
+    intervals = iter(intervals)
+    try:
+        while True:
+            while len(pending) < max_workers:
+                interval = next(intervals, None)
+                if interval is None:
+                    break
+                pending.append(executor.submit(_fetch_chunk, server, dataset, parameters,
+                                               interval[0], interval[1], retries, opts))
+            if len(pending) == 0:
+                return
+            yield pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def boundary_masks(hapidatas):
+    """
+    Return a mask for each chunk's records which removes records already
+    found in the preceding chunks, as servers may send a record at the
+    boundary in both.
+
+    Parameters
+    ----------
+    hapidatas : list of tuple
+        the hapidata tuple of each chunk, in time order
+
+    Return
+    ------
+    list of numpy.ndarray
+        boolean mask of the records to keep for each chunk
+    """
+    masks = []
+    last = None
+    for data, meta in hapidatas:
+        mask, last = _boundary_mask(data, meta, last)
+        masks.append(mask)
+    return masks
+
+
+def _boundary_mask(data, meta, last):
+    """return the mask of the records after the time last, and the new last time."""
+    t = isotime_to_nanoseconds(data[meta['parameters'][0]['name']])
+    if last is None:
+        mask = numpy.ones(len(t), dtype=bool)
+    else:
+        mask = t > last
+    if numpy.any(mask):
+        last = t[mask].max()
+    return mask, last
+
+
+def stitch_SpaceData(results, masks, time_name):
+    """
+    Join the SpaceData converted from each chunk.  Record-varying variables
+    are concatenated, and other variables, like bins, are taken from the first.
+
+    Parameters
+    ----------
+    results : list of SpaceData
+        the SpaceData for each chunk, in time order
+    masks : list of numpy.ndarray
+        the records to keep of each chunk, from boundary_masks
+    time_name : str
+        the name of the time variable
+
+    Return
+    ------
+    SpaceData
+        the joined SpaceData
+    """
+    import spacepy.datamodel as datamodel
+    first = results[0]
+    result = datamodel.SpaceData()
+    for name in first:
+        v = first[name]
+        if name == time_name or 'DEPEND_0' in v.attrs:
+            d = numpy.concatenate([r[name][mask] for r, mask in zip(results, masks)])
+            result[name] = datamodel.dmarray(d, attrs=dict(v.attrs))
+        else:
+            result[name] = v
+    result.attrs = first.attrs
+    return result
+
+
+def stitch_time_series(results, masks):
+    """
+    Join the TimeSeries converted from each chunk.
+
+    Parameters
+    ----------
+    results : list of GenericTimeSeries
+        the TimeSeries for each chunk, in time order
+    masks : list of numpy.ndarray
+        the records to keep of each chunk, from boundary_masks
+
+    Return
+    ------
+    GenericTimeSeries
+        the joined TimeSeries
+    """
+    import pandas as pd
+    from sunpy.timeseries import GenericTimeSeries
+    first = results[0]
+    df = pd.concat([r.to_dataframe()[mask] for r, mask in zip(results, masks)])
+    return GenericTimeSeries(data=df, units=first.units, meta=first.meta)
+
+
+def _convert(futures, convert, processes):
+    """convert each chunk as it arrives, returning the results and masks of the non-empty chunks,
+    and the metadata of the first.  The records of each chunk are dropped once it is converted."""
+    converted = []
+    masks = []
+    meta = None
+    last = None
+    # converted[:done] are results, and the rest are futures of the chunks still being converted
+    done = 0
+    if processes == 0:
+        executor = None
+    else:
+        if processes is None:
+            processes = os.cpu_count() or 1
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+    try:
+        for future in futures:
+            hapidata = future.result()
+            if meta is None:
+                meta = hapidata[1]
+            if len(hapidata[0]) == 0:
+                continue
+            mask, last = _boundary_mask(hapidata[0], hapidata[1], last)
+            masks.append(mask)
+            if executor is None:
+                converted.append(convert(hapidata))
+            else:
+                converted.append(executor.submit(convert, hapidata))
+                # each chunk waiting to be converted is held in memory, so when the reads get
+                # ahead of the conversions, wait for the oldest before reading more
+                if len(converted) - done > 2 * processes:
+                    converted[done] = converted[done].result()
+                    done += 1
+        if len(masks) == 0:
+            # every chunk was empty, so convert the last to get the variables and attributes
+            masks.append(numpy.zeros(0, dtype=bool))
+            converted.append(convert(hapidata))
+        elif executor is not None:
+            converted[done:] = [c.result() for c in converted[done:]]
+    finally:
+        futures.close()
+        if executor is not None:
+            executor.shutdown()
+    return converted, masks, meta
+
+
+def to_SpaceData_parallel(server, dataset, parameters, start, stop, chunk=numpy.timedelta64(1, 'D'),
+                          max_workers=4, processes=None, retries=2, opts=None):
+    """Read the interval in chunks in parallel and convert it to one SpaceData.
+
+    Each chunk is read on a thread pool, and converted with to_SpaceData on a process pool
+    while the later chunks are being read.
+
+    spacedata = to_SpaceData_parallel(server, dataset, parameters, '2022-01-01Z', '2022-02-01Z')
+
+    Parameters
+    ----------
+    server, dataset, parameters, start, stop : str
+        the HAPI request, as for hapiclient.hapi
+    chunk : numpy.timedelta64 or datetime.timedelta
+        the length of each request, one day by default.
+    max_workers : int
+        the number of requests in flight at once
+    processes : int
+        the number of conversion processes, None for one per CPU, or 0 to convert in this process.
+        No more than twice this many chunks are read and waiting to be converted.
+    retries : int
+        the number of times a failed request is tried again
+    opts : dict
+        options passed to hapiclient.hapi
+    """
+    import fromHapiToSpaceData
+    futures = fetch(server, dataset, parameters, start, stop, chunk, max_workers, retries, opts)
+    results, masks, meta = _convert(futures, fromHapiToSpaceData.to_SpaceData, processes)
+    return stitch_SpaceData(results, masks, meta['parameters'][0]['name'])
+
+
+def hapi_to_time_series_parallel(server, dataset, parameters, start, stop, chunk=numpy.timedelta64(1, 'D'),
+                                 max_workers=4, processes=None, retries=2, opts=None):
+    """Read the interval in chunks in parallel and convert it to one SunPy TimeSeries.
+
+    See to_SpaceData_parallel for the parameters.
+    """
+    import fromHapiToSunPy
+    futures = fetch(server, dataset, parameters, start, stop, chunk, max_workers, retries, opts)
+    results, masks, meta = _convert(futures, fromHapiToSunPy.hapi_to_time_series, processes)
+    return stitch_time_series(results, masks)
+
+
+def to_CDF_parallel(server, dataset, parameters, start, stop, cdfname, chunk=numpy.timedelta64(1, 'D'),
+                    max_workers=4, retries=2, opts=None):
+    """Read the interval in chunks in parallel and write it to one CDF.
+
+    The chunks are read on a thread pool, and each is appended to the CDF
+    with fromHapiToCDF.CDFWriter as soon as it and the chunks before it
+    have arrived.  No more than max_workers chunks are requested ahead of
+    the one being written, so only those are held in memory.
+
+    Parameters
+    ----------
+    server, dataset, parameters, start, stop : str
+        the HAPI request, as for hapiclient.hapi
+    cdfname : str
+        the name of the CDF file to write
+    chunk : numpy.timedelta64 or datetime.timedelta
+        the length of each request, one day by default.
+    max_workers : int
+        the number of requests in flight at once
+    retries : int
+        the number of times a failed request is tried again
+    opts : dict
+        options passed to hapiclient.hapi
+    """
+    import fromHapiToCDF
+    futures = fetch(server, dataset, parameters, start, stop, chunk, max_workers, retries, opts)
+    writer = None
+    last = None
+    try:
+        for future in futures:
+            data, meta = future.result()
+            if writer is None:
+                writer = fromHapiToCDF.CDFWriter(meta, cdfname)
+            mask, last = _boundary_mask(data, meta, last)
+            if numpy.any(mask):
+                writer.write(data[mask])
+    finally:
+        futures.close()
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,236 @@
+import collections
+import hashlib
+import json
+import re
+import threading
+
+import numpy
+
+from hapiRecords import record_dtype
+
+# The number of compiled plans kept.  Each is small, so this may be the number
+# of datasets a service sees regularly.
+PLAN_CACHE_SIZE = 512
+
+_plan_cache = collections.OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+class ParameterPlan:
+    """What the adapters need to know about one HAPI parameter.
+
+    Attributes
+    ----------
+    name : str
+        the parameter name
+    type : str
+        the HAPI type, like 'double' or 'isotime'
+    size : list of int
+        the HAPI size, or [] for scalars
+    length : int or None
+        the length of string and isotime values
+    units : str
+        the units, or ' ' when the server gives none
+    fill : str or None
+        the fill value, as given by the server
+    description : str or None
+        the description, if given
+    bins : list of dict
+        the bins of each dimension, with any $ref resolved, or [] when there are none
+    depends : list of str
+        the names of the DEPEND_1, DEPEND_2, ... variables, which are the bins names unless
+        bins with the same name but another definition were used first
+    """
+
+    def __init__(self, m, meta):
+        self.name = m['name']
+        self.type = m['type']
+        self.size = list(m.get('size', []))
+        self.length = m.get('length')
+        self.units = ' ' if m.get('units') is None else m['units']
+        self.fill = m.get('fill')
+        self.description = m.get('description')
+        self.bins = resolve_bins(m, meta)
+        self.depends = [b['name'] for b in self.bins]
+
+
+class BinsPlan:
+    """The support data for one HAPI bins definition.  The centers are read in, or when only
+    ranges are given, they are the average of each range and the ranges become DELTA_MINUS
+    and DELTA_PLUS.
+
+    Attributes
+    ----------
+    name : str
+        the bins name
+    units : str
+        the bins units
+    centers : numpy.ndarray or None
+        the bin centers, or None when the centers are another parameter (time-varying bins)
+    delta_minus : numpy.ndarray or None
+        the distance from each center to the start of its range, when ranges are used
+    delta_plus : numpy.ndarray or None
+        the distance from each center to the end of its range, when ranges are used
+    """
+
+    def __init__(self, bins):
+        self.name = bins['name']
+        self.units = bins.get('units')
+        self.centers = None
+        self.delta_minus = None
+        self.delta_plus = None
+        if 'centers' in bins:
+            if not isinstance(bins['centers'], str):  # string is just a reference to another variable
+                self.centers = numpy.array(bins['centers'], dtype=float)
+        elif not isinstance(bins['ranges'], str):
+            ranges = numpy.array(bins['ranges'], dtype=float)
+            self.centers = ranges[..., 0] + (ranges[..., 1] - ranges[..., 0]) / 2
+            self.delta_minus = self.centers - ranges[..., 0]
+            self.delta_plus = ranges[..., 1] - self.centers
+
+
+class ConversionPlan:
+    """The parameters of a HAPI info response, compiled once and shared by the adapters.
+
+    Attributes
+    ----------
+    time_name : str
+        the name of the time parameter, which is always first
+    time : ParameterPlan
+        the time parameter
+    parameters : list of ParameterPlan
+        the parameters after the time parameter
+    names : list of str
+        the names of all parameters, including time
+    bins : dict
+        the BinsPlan of each distinct bins definition, by variable name, in the order first used
+    dtype : numpy.dtype
+        the record dtype, as returned by the Python hapiclient
+    binary_dtype : numpy.dtype
+        the record dtype of the HAPI binary format, with strings as fixed-length bytes
+    """
+
+    def __init__(self, meta):
+        plans = [ParameterPlan(m, meta) for m in meta['parameters']]
+        self.time = plans[0]
+        self.time_name = plans[0].name
+        self.parameters = plans[1:]
+        self.names = [p.name for p in plans]
+        self.bins = collections.OrderedDict()
+        variables = {}
+        for p in self.parameters:
+            for i, b in enumerate(p.bins):
+                key = json.dumps(b, sort_keys=True, default=str)
+                if key not in variables:
+                    name = b['name']
+                    if name in self.bins:
+                        # another definition has the same name, so this one is named for the parameter too
+                        name = '%s_%s' % (b['name'], p.name)
+                    variables[key] = name
+                    self.bins[name] = BinsPlan(b)
+                p.depends[i] = variables[key]
+        self.dtype = record_dtype(meta)
+        self.binary_dtype = record_dtype(meta, binary=True)
+
+
+def fill_value(p, dtype):
+    """
+    Return the fill value of a parameter as a value of the dtype, or None when it has none,
+    or it is not a number.
+
+    Parameters
+    ----------
+    p : ParameterPlan
+        the parameter
+    dtype : numpy.dtype
+        the dtype of its values
+    """
+    if p.fill is None or dtype.kind not in 'fiu':
+        return None
+    try:
+        return dtype.type(p.fill)
+    except ValueError:
+        return None
+
+
+def resolve_bins(m, meta):
+    """
+    Return the bins of a parameter, looking up a "$ref" in the definitions of the info response.
+
+    Parameters
+    ----------
+    m : dict
+        the HAPI parameter description, from meta['parameters']
+    meta : dict
+        the HAPI info response
+
+    Return
+    ------
+    list of dict
+        the bins for each dimension, or [] when there are none
+    """
+    if 'bins' not in m:
+        return []
+    bins = m['bins']
+    if isinstance(bins, dict):
+        refstr = bins.get('$ref')
+        ref = re.match(r'#/definitions/(.+)', refstr).group(1)
+        bins = meta['definitions'][ref]
+    return list(bins)
+
+
+def plan_key(meta):
+    """
+    Return the key of a HAPI info response in the plan cache.  Keys starting
+    with 'x_', which hapiclient adds to describe the request, are ignored.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response
+
+    Return
+    ------
+    str
+        the hex digest of the info response
+    """
+    info = {k: meta[k] for k in meta if not k.startswith('x_')}
+    s = json.dumps(info, sort_keys=True, default=str)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def compile_plan(meta):
+    """
+    Return the ConversionPlan for the HAPI info response, which is compiled once
+    and then reused for every response from the same dataset and parameters.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response, as returned by the Python hapiclient.
+
+    Return
+    ------
+    ConversionPlan
+        the plan, which must not be modified.
+    """
+    key = plan_key(meta)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = ConversionPlan(meta)
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def clear_plan_cache():
+    """Remove all compiled plans."""
+    with _plan_cache_lock:
+        _plan_cache.clear()
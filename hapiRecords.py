@@ -0,0 +1,96 @@
+import io
+
+import numpy
+
+
+def record_dtype(meta, binary=False):
+    """
+    Return the numpy dtype of a HAPI record, matching the structured array
+    returned by the Python hapiclient.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response
+    binary : bool
+        if True, string parameters are the fixed-length bytes of the HAPI
+        binary format, rather than the unicode strings hapiclient returns.
+
+    Return
+    ------
+    numpy.dtype
+        the structured dtype with a field for each parameter
+    """
+    dt = []
+    for m in meta['parameters']:
+        size = m.get('size', 1)
+        if isinstance(size, list):
+            size = size[0] if len(size) == 1 else tuple(size)
+
+        ptype = m['type']
+        if ptype == 'double':
+            t = '<f8'
+        elif ptype == 'integer':
+            t = '<i4'
+        elif ptype == 'isotime' or (ptype == 'string' and binary):
+            t = 'S%d' % m['length']
+        elif ptype == 'string':
+            t = 'U%d' % m['length']
+        else:
+            raise ValueError('unsupported HAPI type for %s: %s' % (m['name'], ptype))
+
+        if size == 1:
+            dt.append((m['name'], t))
+        else:
+            dt.append((m['name'], t, size))
+    return numpy.dtype(dt)
+
+
+def parse_binary(buf, meta):
+    """
+    Decode complete records in the HAPI binary format.
+
+    Parameters
+    ----------
+    buf : bytes
+        the bytes of zero or more complete records
+    meta : dict
+        the HAPI info response
+
+    Return
+    ------
+    numpy.ndarray
+        structured array like that returned by the Python hapiclient
+    """
+    dt = record_dtype(meta, binary=True)
+    data = numpy.frombuffer(buf, dtype=dt)
+    if any(m['type'] == 'string' for m in meta['parameters']):
+        data = data.astype(record_dtype(meta))
+    return data
+
+
+def parse_csv(text, meta, dtype=None):
+    """
+    Decode complete lines in the HAPI CSV format.
+
+    Parameters
+    ----------
+    text : str or bytes
+        zero or more complete lines of CSV
+    meta : dict
+        the HAPI info response
+    dtype : numpy.dtype
+        the record dtype of meta, when the caller has it already, like the dtype of
+        the ConversionPlan.  Otherwise it is found from meta.
+
+    Return
+    ------
+    numpy.ndarray
+        structured array like that returned by the Python hapiclient
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    dt = record_dtype(meta) if dtype is None else dtype
+    if len(text.strip()) == 0:
+        return numpy.zeros(0, dtype=dt)
+    return numpy.loadtxt(io.StringIO(text), dtype=dt, delimiter=',', quotechar='"', ndmin=1)
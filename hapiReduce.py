@@ -0,0 +1,252 @@
+"""Reduce a HAPI response to the mean, minimum, maximum and count of its records in
+each bucket of time, before it is converted, for quick-look plots of long intervals.
+
+reduction = Reduction(bucket=numpy.timedelta64(1, 'h'))
+spacedata = fromHapiToSpaceData.to_SpaceData(hapidata, reduce=reduction)
+
+or with about 2000 records, whatever the interval:
+
+ts = fromHapiToSunPy.hapi_to_time_series(hapidata, reduce=Reduction(points=2000))
+
+Each parameter becomes the mean of its records in each bucket, and new parameters like
+"spec_min", "spec_max" and "spec_count" have the other statistics, with the same size
+and bins.  Fill values and NaNs are left out, and the mean of a bucket with no valid
+records is the fill value.  Buckets are aligned to multiples of their width since 1970,
+so the same bucket has the same records in every request, and the time of each is its
+center.  Buckets without records are left out.
+"""
+import copy
+
+import numpy
+
+from hapiInstrument import stage
+from hapiPlan import compile_plan
+from hapiTimes import isotime_to_nanoseconds
+
+# the statistics which may be added to the mean of each parameter
+STATISTICS = ('min', 'max', 'count')
+
+
+def bucket_width(times, bucket=None, points=None):
+    """
+    Return the width of the buckets in nanoseconds.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        int64 nanoseconds of the records, in increasing order
+    bucket : numpy.timedelta64
+        the width of each bucket
+    points : int
+        about the number of buckets, used when bucket is None.  As the buckets are aligned
+        to multiples of their width, there may be one more.
+
+    Return
+    ------
+    int
+        the width in nanoseconds, at least 1
+    """
+    if bucket is not None:
+        width = int(numpy.timedelta64(bucket).astype('m8[ns]').astype(numpy.int64))
+    elif points is not None:
+        span = int(times[-1] - times[0]) + 1 if len(times) > 0 else 1
+        width = -(-span // points)
+    else:
+        raise ValueError('either bucket or points must be given')
+    if width <= 0:
+        raise ValueError('the bucket width must be positive')
+    return width
+
+
+def bucket_starts(times, width):
+    """
+    Return the index of the first record of each bucket, and the start time of each bucket.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        int64 nanoseconds of the records, in increasing order
+    width : int
+        the width of the buckets in nanoseconds
+    """
+    k = times // width
+    starts = numpy.flatnonzero(numpy.concatenate(([True], k[1:] != k[:-1]))) if len(k) > 0 else \
+        numpy.zeros(0, dtype=numpy.intp)
+    return starts, k[starts] * width
+
+
+def _fill(p, dtype):
+    """return the fill value of the parameter for arrays of the dtype, NaN for doubles without one."""
+    if p.fill is not None:
+        try:
+            return dtype.type(p.fill)
+        except ValueError:
+            pass
+    return numpy.nan if dtype.kind == 'f' else None
+
+
+def reduce_values(values, starts, fill=None):
+    """
+    Return the mean, minimum, maximum and count of the valid values in each bucket.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        the records, whose first dimension is time
+    starts : numpy.ndarray
+        the index of the first record of each bucket, from bucket_starts
+    fill : scalar
+        values equal to this are left out, as are NaNs
+
+    Return
+    ------
+    tuple
+        (mean, min, max, count) arrays with a record for each bucket.  The mean is double,
+        min and max have the type of the values, and the count is int32.  Where the count
+        is zero the others are fill, or NaN.
+    """
+    if len(starts) == 0:
+        shape = (0,) + values.shape[1:]
+        return (numpy.zeros(shape), numpy.zeros(shape, values.dtype), numpy.zeros(shape, values.dtype),
+                numpy.zeros(shape, numpy.int32))
+    invalid = None
+    if values.dtype.kind == 'f':
+        invalid = numpy.isnan(values)
+    if fill is not None and not (isinstance(fill, float) and numpy.isnan(fill)):
+        invalid = values == fill if invalid is None else invalid | (values == fill)
+    if invalid is not None and not invalid.any():
+        invalid = None
+
+    if invalid is None:
+        total = numpy.add.reduceat(values, starts, axis=0, dtype=numpy.float64)
+        lo = numpy.minimum.reduceat(values, starts, axis=0)
+        hi = numpy.maximum.reduceat(values, starts, axis=0)
+        count = numpy.diff(numpy.append(starts, len(values))).astype(numpy.int32)
+        count = numpy.broadcast_to(count.reshape((-1,) + (1,) * (values.ndim - 1)), total.shape).copy()
+        return total / count, lo, hi, count
+
+    valid = ~invalid
+    if values.dtype.kind == 'f':
+        big, small = numpy.inf, -numpy.inf
+    else:
+        big, small = numpy.iinfo(values.dtype).max, numpy.iinfo(values.dtype).min
+    total = numpy.add.reduceat(numpy.where(valid, values, 0), starts, axis=0, dtype=numpy.float64)
+    lo = numpy.minimum.reduceat(numpy.where(valid, values, big), starts, axis=0)
+    hi = numpy.maximum.reduceat(numpy.where(valid, values, small), starts, axis=0)
+    count = numpy.add.reduceat(valid, starts, axis=0, dtype=numpy.int32)
+    empty = count == 0
+    mean = numpy.divide(total, count, out=numpy.zeros(total.shape), where=~empty)
+    if empty.any():
+        mean[empty] = numpy.nan if fill is None else fill
+        if fill is not None:
+            lo[empty] = fill
+            hi[empty] = fill
+    return mean, lo, hi, count
+
+
+def reduce_meta(meta, statistics=STATISTICS):
+    """
+    Return the HAPI info response of the reduced records: each numeric parameter is a double
+    mean, followed by a parameter for each of the statistics.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response
+    statistics : tuple of str
+        some of STATISTICS
+    """
+    result = copy.deepcopy(meta)
+    # the centers of the buckets are written to the nanosecond
+    result['parameters'][0]['length'] = 30
+    parameters = [result['parameters'][0]]
+    for m in result['parameters'][1:]:
+        parameters.append(m)
+        if m['type'] not in ('double', 'integer'):
+            continue
+        original = dict(m)
+        m['type'] = 'double'
+        if 'fill' in m and m['fill'] is not None:
+            m['fill'] = str(float(m['fill']))
+        for s in statistics:
+            extra = dict(original, name='%s_%s' % (original['name'], s))
+            if s == 'count':
+                extra.update(type='integer', units=None, fill=None)
+            if 'description' in original:
+                extra['description'] = '%s of %s' % (s, original['description'])
+            parameters.append(extra)
+    result['parameters'] = parameters
+    return result
+
+
+def reduce(hapidata, bucket=None, points=None, statistics=STATISTICS):
+    """
+    Reduce the records of a HAPI response to statistics in each bucket of time.
+
+    Parameters
+    ----------
+    hapidata : tuple
+        the data and metadata returned by the Python hapiclient
+    bucket : numpy.timedelta64
+        the width of each bucket
+    points : int
+        about the number of buckets, when bucket is None
+    statistics : tuple of str
+        the statistics added as parameters, some of STATISTICS
+
+    Return
+    ------
+    tuple
+        the reduced data and metadata, which can be given to any of the adapters
+    """
+    for s in statistics:
+        if s not in STATISTICS:
+            raise ValueError('statistics must be from %s, not %s' % (STATISTICS, s))
+    data, meta = hapidata
+    with stage('reduce', 'metadata'):
+        plan = compile_plan(meta)
+        rmeta = reduce_meta(meta, statistics)
+        rplan = compile_plan(rmeta)
+
+    with stage('reduce', 'times', len(data)):
+        times = isotime_to_nanoseconds(data[plan.time_name])
+        if len(times) > 1 and numpy.any(times[1:] < times[:-1]):
+            order = numpy.argsort(times, kind='stable')
+            data, times = data[order], times[order]
+        width = bucket_width(times, bucket, points)
+        starts, t0 = bucket_starts(times, width)
+        centers = (t0 + width // 2).view('M8[ns]')
+
+    result = numpy.zeros(len(starts), dtype=rplan.dtype)
+    with stage('reduce', 'arrays', len(data)):
+        isotimes = numpy.char.add(numpy.datetime_as_string(centers, unit='ns'), 'Z')
+        result[plan.time_name] = isotimes.astype(result.dtype[plan.time_name])
+        for p in plan.parameters:
+            values = data[p.name]
+            if values.dtype.kind not in 'fiu':
+                result[p.name] = values[starts]
+                continue
+            mean, lo, hi, count = reduce_values(values, starts, _fill(p, values.dtype))
+            result[p.name] = mean
+            for s, v in zip(('min', 'max', 'count'), (lo, hi, count)):
+                if s in statistics:
+                    result['%s_%s' % (p.name, s)] = v
+    return result, rmeta
+
+
+class Reduction:
+    """The reduce option of the adapters: a callable which reduces a HAPI response,
+    see reduce for the parameters.
+
+    hapi_to_time_series(hapidata, reduce=Reduction(points=2000, statistics=('min', 'max')))
+    """
+
+    def __init__(self, bucket=None, points=None, statistics=STATISTICS):
+        if bucket is None and points is None:
+            raise ValueError('either bucket or points must be given')
+        self.bucket = bucket
+        self.points = points
+        self.statistics = tuple(statistics)
+
+    def __call__(self, hapidata):
+        return reduce(hapidata, self.bucket, self.points, self.statistics)
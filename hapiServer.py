@@ -0,0 +1,330 @@
+"""A small HAPI server on localhost, for testing the whole path from hapiclient.hapi
+to each adapter without a network.  It serves synthetic datasets, named like the
+datasets used in test.py, and any recorded (data, meta) responses which are added.
+
+with HapiServer(latency=0.05) as server:
+    hapidata = hapiclient.hapi(server.url, 'specBins.ref', '', '2016-01-01T00:00Z', '2016-01-02T00:00Z')
+
+or from the command line:
+
+python hapiServer.py --port 8000 --latency 0.05
+"""
+import argparse
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy
+
+import hapiSynthetic
+from hapiErrors import HapiError
+from hapiRecords import record_dtype
+from hapiTimes import isotime_to_nanoseconds
+
+# synthetic datasets served by default, with the kind of synthetic response for each
+SYNTHETIC_DATASETS = {
+    'poolTemperature': 'scalar',
+    'AC_H0_MFI': 'vector',
+    'Spectrum': 'spectrogram',
+    'WFR_E_B': 'bins_centers',
+    'specBins': 'bins_ranges',
+    'specBins.ref': 'bins_ref',
+    'SpectrumTimeVaryingChannels': 'time_varying_channels',
+    'SpectrogramRank2': 'ndim3',
+}
+
+_status_ok = {'code': 1200, 'message': 'OK request successful'}
+
+
+class Dataset:
+    """A dataset served by HapiServer, either synthetic or recorded.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response
+    data : numpy.ndarray or None
+        the recorded records, or None to make synthetic records for any time range
+    cadence : numpy.timedelta64
+        the time between synthetic records
+    """
+
+    def __init__(self, meta, data=None, cadence=numpy.timedelta64(1, 's')):
+        self.meta = {k: v for k, v in meta.items() if not k.startswith('x_')}
+        self.data = data
+        self.cadence = cadence
+        if data is not None:
+            self.times = isotime_to_nanoseconds(data[meta['parameters'][0]['name']])
+
+    def records(self, start, stop):
+        """return the records with start <= time < stop, given in nanoseconds since 1970."""
+        if self.data is not None:
+            i0, i1 = numpy.searchsorted(self.times, [start, stop])
+            return self.data[i0:i1]
+        step = numpy.timedelta64(self.cadence, 'ns').astype(numpy.int64)
+        first = -(-start // step) * step
+        nrec = max(0, -(-(stop - first) // step))
+        return hapiSynthetic.synthetic_data(self.meta, int(nrec), numpy.datetime64(int(first), 'ns'),
+                                            self.cadence, index0=int(first // step))
+
+
+def _subset(meta, parameters):
+    """return the info response with only the time and the parameters listed."""
+    if parameters is None or parameters == '':
+        return meta
+    names = parameters.split(',')
+    known = [m['name'] for m in meta['parameters']]
+    for name in names:
+        if name not in known:
+            raise HapiError(400, 1407, 'Bad request - unknown dataset parameter %s' % name)
+    meta = dict(meta)
+    meta['parameters'] = [m for i, m in enumerate(meta['parameters']) if i == 0 or m['name'] in names]
+    return meta
+
+
+def to_csv(data, meta):
+    """
+    Format records as HAPI CSV.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        structured array like that returned by the Python hapiclient
+    meta : dict
+        the HAPI info response for the parameters of data
+
+    Return
+    ------
+    bytes
+        the CSV lines
+    """
+    if len(data) == 0:
+        return b''
+    columns = []
+    for m in meta['parameters']:
+        d = data[m['name']].reshape(len(data), -1)
+        for i in range(d.shape[1]):
+            col = d[:, i]
+            if col.dtype.kind == 'S':
+                col = numpy.char.decode(col, 'ascii')
+            elif col.dtype.kind == 'U':
+                col = numpy.char.add(numpy.char.add('"', col), '"')
+            elif col.dtype.kind == 'f':
+                # 17 significant digits read back as the same double
+                col = numpy.char.mod('%.17g', col)
+            else:
+                col = col.astype(str)
+            columns.append(col)
+    lines = columns[0]
+    for col in columns[1:]:
+        lines = numpy.char.add(numpy.char.add(lines, ','), col)
+    return ('\n'.join(lines.tolist()) + '\n').encode('utf-8')
+
+
+def to_binary(data, meta):
+    """
+    Format records in the HAPI binary format.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        structured array like that returned by the Python hapiclient
+    meta : dict
+        the HAPI info response for the parameters of data
+
+    Return
+    ------
+    bytes
+        the records
+    """
+    return data.astype(record_dtype(meta, binary=True)).tobytes()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """handle one request to the HapiServer in self.server.hapi."""
+
+    def log_message(self, format, *args):
+        if self.server.hapi.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        hapi = self.server.hapi
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        endpoint = url.path.rstrip('/').split('/')[-1]
+        if hapi.latency > 0:
+            time.sleep(hapi.latency)
+        try:
+            if endpoint == 'capabilities':
+                self._send_json({'HAPI': '3.0', 'status': _status_ok, 'outputFormats': ['csv', 'binary']})
+            elif endpoint == 'catalog':
+                self._send_json({'HAPI': '3.0', 'status': _status_ok,
+                                 'catalog': [{'id': name} for name in hapi.datasets]})
+            elif endpoint == 'info':
+                dataset = self._dataset(query)
+                self._send_json(_subset(dataset.meta, query.get('parameters')))
+            elif endpoint == 'data':
+                self._send_data(query)
+            else:
+                raise HapiError(404, 1400, 'Bad request - unknown API parameter name')
+        except HapiError as e:
+            self._send_json({'HAPI': '3.0', 'status': {'code': e.hapi_code, 'message': str(e)}}, e.http_code)
+
+    def _dataset(self, query):
+        name = query.get('id', query.get('dataset'))
+        if name not in self.server.hapi.datasets:
+            raise HapiError(404, 1406, 'Bad request - unknown dataset id')
+        return self.server.hapi.datasets[name]
+
+    def _send_data(self, query):
+        hapi = self.server.hapi
+        dataset = self._dataset(query)
+        meta = _subset(dataset.meta, query.get('parameters'))
+        try:
+            start, stop = isotime_to_nanoseconds([query.get('time.min', query.get('start')),
+                                                  query.get('time.max', query.get('stop'))])
+        except (ValueError, TypeError):
+            raise HapiError(400, 1402, 'Bad request - error in start or stop time')
+        if stop <= start:
+            raise HapiError(400, 1404, 'Bad request - time.min equal to or after time.max')
+
+        data = dataset.records(start, stop)
+        if hapi.max_records is not None and len(data) > hapi.max_records:
+            raise HapiError(400, 1408, 'Bad request - too much time or data requested')
+        data = data[[m['name'] for m in meta['parameters']]]
+
+        if query.get('format', 'csv') == 'binary':
+            body = to_binary(data, meta)
+        else:
+            body = to_csv(data, meta)
+        if query.get('include') == 'header':
+            header = json.dumps(dict(meta, format=query.get('format', 'csv')), indent=1)
+            header = ''.join('#' + line + '\n' for line in header.split('\n')).encode('utf-8')
+            body = header + body
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream' if query.get('format') == 'binary' else 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _send_json(self, o, http_code=200):
+        body = json.dumps(o).encode('utf-8')
+        self.send_response(http_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._write(body)
+
+    def _write(self, body):
+        """write the body, no faster than the bandwidth of the server."""
+        bandwidth = self.server.hapi.bandwidth
+        if bandwidth is None:
+            self.wfile.write(body)
+            return
+        block = max(1, int(bandwidth / 100))
+        for i in range(0, len(body), block):
+            self.wfile.write(body[i:i + block])
+            time.sleep(len(body[i:i + block]) / bandwidth)
+
+
+class HapiServer:
+    """A HAPI server running on a thread in this process, serving /capabilities, /catalog,
+    /info and /data in CSV and binary.
+
+    Parameters
+    ----------
+    datasets : dict
+        Dataset for each id, by default the synthetic datasets in SYNTHETIC_DATASETS
+    host : str
+        the address to listen on
+    port : int
+        the port to listen on, or 0 for any free port
+    latency : float
+        seconds to wait before answering each request
+    bandwidth : float
+        bytes per second for each response, or None for as fast as possible
+    max_records : int
+        the most records sent in one response; larger requests get a HAPI 1408 error
+    verbose : bool
+        if True, log each request
+    """
+
+    def __init__(self, datasets=None, host='127.0.0.1', port=0, latency=0., bandwidth=None, max_records=None,
+                 verbose=False):
+        if datasets is None:
+            datasets = {name: Dataset(hapiSynthetic.synthetic_info(kind))
+                        for name, kind in SYNTHETIC_DATASETS.items()}
+        self.datasets = datasets
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_records = max_records
+        self.verbose = verbose
+        self.httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.hapi = self
+        self.thread = None
+
+    @property
+    def url(self):
+        """the URL of the server, to pass to hapiclient.hapi"""
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d/hapi' % (host, port)
+
+    def add_dataset(self, name, hapidata):
+        """
+        Serve a recorded response, such as one saved from hapiclient.hapi.
+
+        Parameters
+        ----------
+        name : str
+            the dataset id
+        hapidata : tuple
+            the data and metadata, whose records are sent for any request within them.
+        """
+        data, meta = hapidata
+        self.datasets[name] = Dataset(meta, data)
+
+    def start(self):
+        """Start serving requests on a daemon thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve synthetic HAPI datasets on localhost.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0., help='seconds before each response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second of each response')
+    parser.add_argument('--max-records', type=int, default=None, help='most records in one response')
+    opts = parser.parse_args(args)
+    server = HapiServer(host=opts.host, port=opts.port, latency=opts.latency, bandwidth=opts.bandwidth,
+                        max_records=opts.max_records, verbose=True)
+    print('serving ' + server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
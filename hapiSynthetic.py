@@ -0,0 +1,178 @@
+import numpy
+
+from hapiRecords import record_dtype
+
+# The shapes of HAPI responses which the adapters handle.
+KINDS = ('scalar', 'vector', 'spectrogram', 'bins_centers', 'bins_ranges', 'bins_ref',
+         'time_varying_channels', 'ndim3')
+
+
+def synthetic_info(kind, nchan=16, cadence=numpy.timedelta64(1, 's')):
+    """
+    Return a HAPI info response for a synthetic dataset.
+
+    Parameters
+    ----------
+    kind : str
+        one of KINDS:
+        'scalar' a scalar and an integer flag,
+        'vector' a scalar and a 3-element vector,
+        'spectrogram' nchan channels without bins,
+        'bins_centers' nchan channels with bins centers,
+        'bins_ranges' two parameters sharing bins given by ranges,
+        'bins_ref' two parameters sharing bins found with $ref in the definitions,
+        'time_varying_channels' channels whose centers are another parameter,
+        'ndim3' nchan by 4 channels with bins for each dimension.
+    nchan : int
+        the number of channels of spectrogram parameters
+    cadence : numpy.timedelta64
+        the time between records
+
+    Return
+    ------
+    dict
+        the info response, like that returned by the Python hapiclient.
+    """
+    if kind not in KINDS:
+        raise ValueError('kind must be one of %s, not %s' % (KINDS, kind))
+
+    seconds = numpy.timedelta64(cadence, 'ms').astype(numpy.int64) / 1000.
+    meta = {
+        'HAPI': '3.0',
+        'status': {'code': 1200, 'message': 'OK request successful'},
+        'startDate': '2000-01-01T00:00:00.000Z',
+        'stopDate': '2030-01-01T00:00:00.000Z',
+        'cadence': 'PT%gS' % seconds,
+        'parameters': [{'name': 'Time', 'type': 'isotime', 'length': 24, 'units': 'UTC', 'fill': None}],
+    }
+    parameters = meta['parameters']
+
+    energies = numpy.logspace(1, 4, nchan + 1)
+    centers = {'name': 'energy', 'units': 'eV', 'centers': [float(e) for e in numpy.sqrt(energies[:-1] * energies[1:])]}
+    ranges = {'name': 'energy', 'units': 'eV', 'ranges': [[float(a), float(b)] for a, b in zip(energies[:-1], energies[1:])]}
+
+    def spectrogram(name, size, bins=None):
+        p = {'name': name, 'type': 'double', 'units': 'counts', 'fill': '-1e31', 'size': size,
+             'description': 'synthetic %s' % name}
+        if bins is not None:
+            p['bins'] = bins
+        return p
+
+    if kind == 'scalar':
+        parameters.append({'name': 'density', 'type': 'double', 'units': 'n/cc', 'fill': '-1e31',
+                           'description': 'synthetic density'})
+        parameters.append({'name': 'quality', 'type': 'integer', 'units': None, 'fill': '-1'})
+    elif kind == 'vector':
+        parameters.append({'name': 'Magnitude', 'type': 'double', 'units': 'nT', 'fill': '-1e31'})
+        parameters.append({'name': 'BGSM', 'type': 'double', 'units': 'nT GSM', 'fill': '-1e31', 'size': [3]})
+    elif kind == 'spectrogram':
+        parameters.append(spectrogram('spectrum', [nchan]))
+    elif kind == 'bins_centers':
+        parameters.append(spectrogram('spectrum', [nchan], [centers]))
+    elif kind == 'bins_ranges':
+        parameters.append(spectrogram('counts', [nchan], [ranges]))
+        parameters.append(spectrogram('flux', [nchan], [ranges]))
+    elif kind == 'bins_ref':
+        meta['definitions'] = {'energyBins': [ranges]}
+        parameters.append(spectrogram('counts', [nchan], {'$ref': '#/definitions/energyBins'}))
+        parameters.append(spectrogram('flux', [nchan], {'$ref': '#/definitions/energyBins'}))
+    elif kind == 'time_varying_channels':
+        parameters.append({'name': 'frequencies', 'type': 'double', 'units': 'Hz', 'fill': '-1e31', 'size': [nchan]})
+        parameters.append(spectrogram('spectra', [nchan], [{'name': 'frequency', 'units': 'Hz', 'centers': 'frequencies'}]))
+    elif kind == 'ndim3':
+        look = {'name': 'look', 'units': 'deg', 'centers': [22.5, 67.5, 112.5, 157.5]}
+        parameters.append(spectrogram('spectrum', [nchan, 4], [centers, look]))
+    return meta
+
+
+def _noise(index, seed):
+    """return repeatable pseudo-random values in [-1, 1) for each integer index."""
+    return numpy.modf(numpy.sin(index * 12.9898 + seed * 78.233) * 43758.5453)[0]
+
+
+def synthetic_data(meta, nrec, start='2016-01-01T00:00:00.000Z', cadence=numpy.timedelta64(1, 's'), seed=0,
+                   index0=0):
+    """
+    Return records for the HAPI info response, with times every cadence from start.
+    Each value is a function of the record index, so a record is the same in every
+    call which includes it.
+
+    Parameters
+    ----------
+    meta : dict
+        the HAPI info response, such as from synthetic_info
+    nrec : int
+        the number of records
+    start : str or numpy.datetime64
+        the time of the first record
+    cadence : numpy.timedelta64
+        the time between records
+    seed : int
+        the seed for the random values, so that the same call gives the same records
+    index0 : int
+        the index of the first record
+
+    Return
+    ------
+    numpy.ndarray
+        structured array like that returned by the Python hapiclient
+    """
+    data = numpy.zeros(nrec, dtype=record_dtype(meta))
+    t0 = numpy.datetime64(start.rstrip('Z') if isinstance(start, str) else start, 'ms')
+    times = t0 + numpy.arange(nrec) * numpy.timedelta64(cadence, 'ms')
+    index = index0 + numpy.arange(nrec, dtype=numpy.int64)
+
+    for m in meta['parameters']:
+        name = m['name']
+        shape = data[name].shape
+        if m['type'] == 'isotime':
+            isotimes = numpy.char.add(numpy.datetime_as_string(times, unit='ms'), 'Z')
+            data[name] = numpy.char.encode(isotimes, 'ascii')
+        elif m['type'] == 'string':
+            data[name] = 'x'
+        else:
+            nchan = int(numpy.prod(shape[1:]))
+            channel = numpy.arange(nchan)
+            i = index[:, numpy.newaxis] * nchan + channel
+            noise = _noise(i, seed + len(name)).reshape(shape)
+            if m['type'] == 'integer':
+                data[name] = (numpy.abs(noise) * 4).astype(numpy.int32)
+            elif len(shape) == 1:
+                data[name] = 5 + numpy.sin(index / 3600.) + 0.1 * noise
+            else:
+                wave = numpy.sin(index[:, numpy.newaxis] / 600. + channel * numpy.pi / nchan).reshape(shape)
+                data[name] = numpy.exp(3 + wave + 0.5 * noise)
+
+    return data
+
+
+def synthetic_hapidata(kind, nrec, nchan=16, start='2016-01-01T00:00:00.000Z', cadence=numpy.timedelta64(1, 's'),
+                       seed=0):
+    """
+    Return a synthetic (data, meta) tuple, like that returned by hapiclient.hapi.
+
+    hapidata = synthetic_hapidata('bins_ref', 86400, nchan=64)
+    fromHapiToCDF.to_CDF(hapidata, '/tmp/mydata.cdf')
+
+    Parameters
+    ----------
+    kind : str
+        one of KINDS, see synthetic_info
+    nrec : int
+        the number of records
+    nchan : int
+        the number of channels of spectrogram parameters
+    start : str
+        the time of the first record
+    cadence : numpy.timedelta64
+        the time between records
+    seed : int
+        the seed for the random values
+
+    Return
+    ------
+    tuple
+        the data and the metadata
+    """
+    meta = synthetic_info(kind, nchan, cadence)
+    return synthetic_data(meta, nrec, start, cadence, seed), meta
@@ -0,0 +1,382 @@
+import numpy
+
+# Width in characters of each strptime directive which can appear in a format
+# string from calculate_format_str.  %f is the fractional seconds, which have
+# as many digits as the server sends, so its width is found from the isotime.
+_field_widths = {
+    'Y': 4,
+    'm': 2,
+    'd': 2,
+    'j': 3,
+    'H': 2,
+    'M': 2,
+    'S': 2,
+}
+
+_NS_PER_FIELD = {
+    'H': 3600 * 10**9,
+    'M': 60 * 10**9,
+    'S': 10**9,
+}
+
+_NS_PER_DAY = 86400 * 10**9
+
+# the valid values of each field; days are checked against the month or year.  Second 60
+# is a leap second, which becomes the first second of the next minute.
+_field_ranges = {
+    'm': (1, 12),
+    'H': (0, 23),
+    'M': (0, 59),
+    'S': (0, 60),
+}
+
+# TAI-UTC in seconds, and the UTC date it took effect, from 1972 when it became a whole
+# number of seconds.
+_leap_seconds = [
+    ('1972-01-01', 10), ('1972-07-01', 11), ('1973-01-01', 12), ('1974-01-01', 13),
+    ('1975-01-01', 14), ('1976-01-01', 15), ('1977-01-01', 16), ('1978-01-01', 17),
+    ('1979-01-01', 18), ('1980-01-01', 19), ('1981-07-01', 20), ('1982-07-01', 21),
+    ('1983-07-01', 22), ('1985-07-01', 23), ('1988-01-01', 24), ('1990-01-01', 25),
+    ('1991-01-01', 26), ('1992-07-01', 27), ('1993-07-01', 28), ('1994-07-01', 29),
+    ('1996-01-01', 30), ('1997-07-01', 31), ('1999-01-01', 32), ('2006-01-01', 33),
+    ('2009-01-01', 34), ('2012-07-01', 35), ('2015-07-01', 36), ('2017-01-01', 37),
+]
+
+# Before 1972 TAI-UTC drifted: from each date it was offset + (MJD - mjd) * rate seconds.
+# These are the segments of the CDF library's leap second table, which like the library
+# take the MJD at noon of the day, so the offset is the same for the whole day.  Before
+# 1960 TAI-UTC is 0.
+_drifting_leap_seconds = [
+    ('1960-01-01', 1.4178180, 37300, 0.0012960), ('1961-01-01', 1.4228180, 37300, 0.0012960),
+    ('1961-08-01', 1.3728180, 37300, 0.0012960), ('1962-01-01', 1.8458580, 37665, 0.0011232),
+    ('1963-11-01', 1.9458580, 37665, 0.0011232), ('1964-01-01', 3.2401300, 38761, 0.0012960),
+    ('1964-04-01', 3.3401300, 38761, 0.0012960), ('1964-09-01', 3.4401300, 38761, 0.0012960),
+    ('1965-01-01', 3.5401300, 38761, 0.0012960), ('1965-03-01', 3.6401300, 38761, 0.0012960),
+    ('1965-07-01', 3.7401300, 38761, 0.0012960), ('1965-09-01', 3.8401300, 38761, 0.0012960),
+    ('1966-01-01', 4.3131700, 39126, 0.0025920), ('1968-02-01', 4.2131700, 39126, 0.0025920),
+]
+
+_leap_second_ns = numpy.array([d for d, s in _leap_seconds], dtype='M8[ns]').view(numpy.int64)
+
+_drifting_ns = numpy.array([d for d, o, m, r in _drifting_leap_seconds], dtype='M8[ns]').view(numpy.int64)
+_drifting_offset = numpy.array([0.0] + [o for d, o, m, r in _drifting_leap_seconds])
+_drifting_mjd = numpy.array([0.0] + [m for d, o, m, r in _drifting_leap_seconds])
+_drifting_rate = numpy.array([0.0] + [r for d, o, m, r in _drifting_leap_seconds])
+
+# the MJD of 1970-01-01
+_MJD_1970 = 40587
+
+# offset in nanoseconds from 1970-01-01 (ignoring leap seconds) to TT2000, without TAI-UTC,
+# and with TAI-UTC for each entry of the table from 1972.  TT2000 counts from J2000,
+# 2000-01-01T12:00:00 TT, and TT = UTC + (TAI-UTC) + 32.184 seconds.
+_tt2000_epoch_ns = 32184000000 - numpy.datetime64('2000-01-01T12:00:00', 'ns').astype(numpy.int64)
+_tt2000_offset_ns = (numpy.array([0] + [s for d, s in _leap_seconds], dtype=numpy.int64) * 10**9
+                     + _tt2000_epoch_ns)
+
+def calculate_format_str(isotime):
+    """
+    Given an example time, return the format string which used with datetime.datetime.strptime
+    will parse the isotime strings to datetimes.
+
+    Parameters
+    ----------
+    isotime : str
+        a HAPI isotime
+
+    Return
+    ------
+    str
+        a format string for datetime.datetime.strptime
+    """
+    if isotime[-1] == 'Z':
+        isotime = isotime[0:-1]
+        zstr = 'Z'
+    else:
+        zstr = ''
+
+    datelen = isotime.find('T')
+    if datelen == -1:
+        datelen = len(isotime)
+
+    if datelen == 4:
+        form = '%Y'
+    elif datelen == 6:
+        form = '%Y%m'
+    elif datelen == 7:
+        if isotime[4] == '-':
+            form = '%Y-%m'
+        else:
+            form = '%Y%j'
+    elif datelen == 8:
+        if isotime[4] == '-':
+            form = '%Y-%j'
+        else:
+            form = '%Y%m%d'
+    elif datelen == 10:
+        form = '%Y-%m-%d'
+    else:
+        raise ValueError('date cannot have %d characters: %s' % (datelen, isotime))
+
+    formForLength = {
+        2: "%H",
+        4: '%H%M',
+        5: '%H:%M',
+        6: '%H%M%S',
+        8: '%H:%M:%S'
+        # note case for 10 and up below
+    }
+
+    timelen = len(isotime) - datelen - 1
+
+    if timelen > 9:
+        timeform = "%H:%M:%S.%f"
+    elif timelen < 1:
+        timeform = ""
+    else:
+        try:
+            timeform = formForLength[timelen]
+        except KeyError:
+            raise ValueError("time cannot have {:d} characters: {:s}".format(datelen, isotime))
+
+    if len(timeform) == 0:
+        return "{}{}".format(form, zstr)
+    else:
+        return "{}T{}{}".format(form, timeform, zstr)
+
+
+def calculate_layout(isotime):
+    """
+    Given an example time, return the position of each field within the
+    fixed-width isotime.  This is computed once per column, and then every
+    time in the column is decoded with the same layout.
+
+    Parameters
+    ----------
+    isotime : str
+        a HAPI isotime
+
+    Return
+    ------
+    list of tuple
+        (field, start, width) for each field, where field is the strptime
+        directive letter, like 'Y' or 'j'.
+    """
+    form = calculate_format_str(isotime)
+    layout = []
+    pos = 0
+    i = 0
+    while i < len(form):
+        if form[i] == '%':
+            field = form[i + 1]
+            if field == 'f':
+                width = len(isotime) - pos - (1 if form.endswith('Z') else 0)
+            else:
+                width = _field_widths[field]
+            layout.append((field, pos, width))
+            pos = pos + width
+            i = i + 2
+        else:
+            pos = pos + 1
+            i = i + 1
+    return layout
+
+
+def _decode_field(chars, start, width):
+    """return the integer in columns start:start+width of each row of the uint8 array chars."""
+    digits = chars[:, start:start + width].astype(numpy.int64) - 48
+    if digits.size > 0 and (digits.min() < 0 or digits.max() > 9):
+        raise ValueError('isotime field is not all digits at characters %d-%d' % (start, start + width))
+    return digits @ (10 ** numpy.arange(width - 1, -1, -1, dtype=numpy.int64))
+
+
+def _check_range(values, lo, hi, field):
+    """raise ValueError if any of the values of the field are outside lo to hi, inclusive."""
+    bad = (values < lo) | (values > hi)
+    if bad.any():
+        i = numpy.flatnonzero(bad)[0]
+        raise ValueError('isotime field %%%s cannot be %d' % (field, values[i]))
+
+
+def _decode_uniform(chars, layout):
+    """decode rows of the uint8 array chars, which all have the same layout."""
+    n = len(chars)
+    fields = {}
+    fraction = numpy.zeros(n, dtype=numpy.int64)
+    for field, start, width in layout:
+        if field == 'f':
+            # keep at most nanosecond precision
+            digits = min(width, 9)
+            fraction = _decode_field(chars, start, digits) * 10 ** (9 - digits)
+        else:
+            fields[field] = _decode_field(chars, start, width)
+
+    for field, (lo, hi) in _field_ranges.items():
+        if field in fields:
+            _check_range(fields[field], lo, hi, field)
+
+    years = (fields['Y'] - 1970).astype('M8[Y]')
+    if 'j' in fields:
+        year_days = ((years + 1).astype('M8[D]') - years.astype('M8[D]')).astype(numpy.int64)
+        _check_range(fields['j'], 1, year_days, 'j')
+        days = years.astype('M8[D]') + (fields['j'] - 1)
+    else:
+        months = years.astype('M8[M]')
+        if 'm' in fields:
+            months = months + (fields['m'] - 1)
+        days = months.astype('M8[D]')
+        if 'd' in fields:
+            month_days = ((months + 1).astype('M8[D]') - days).astype(numpy.int64)
+            _check_range(fields['d'], 1, month_days, 'd')
+            days = days + (fields['d'] - 1)
+
+    ns = days.astype(numpy.int64) * _NS_PER_DAY + fraction
+    for field in _NS_PER_FIELD:
+        if field in fields:
+            ns = ns + fields[field] * _NS_PER_FIELD[field]
+    return ns
+
+
+def isotime_to_nanoseconds(isotime_array):
+    """
+    Convert the HAPI isotimes to nanoseconds since 1970-01-01T00:00Z, ignoring leap seconds.
+
+    The fixed-width byte array is viewed as a two-dimensional array of characters, and
+    each field is decoded for the whole column at once.  The layout is calculated from the
+    first time, using calculate_format_str.  Columns where the times do not all have
+    the same length are decoded in groups of the same length.
+
+    Parameters
+    ----------
+    isotime_array : array of bytes
+        each element a HAPI isotime, as returned by the Python hapiclient.
+
+    Return
+    ------
+    numpy.ndarray
+        int64 nanoseconds since 1970-01-01T00:00Z for each element
+    """
+    isotimes = numpy.asarray(isotime_array)
+    if isotimes.size == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if isotimes.dtype.kind == 'U':
+        isotimes = numpy.char.encode(isotimes, 'ascii')
+    elif isotimes.dtype.kind != 'S':
+        raise ValueError('isotimes must be strings, not %s' % isotimes.dtype)
+
+    isotimes = numpy.ascontiguousarray(isotimes.ravel())
+    width = isotimes.dtype.itemsize
+    chars = isotimes.view(numpy.uint8).reshape(len(isotimes), width)
+
+    lengths = numpy.count_nonzero(chars, axis=1)
+    if lengths.min() == width:
+        return _decode_uniform(chars, calculate_layout(isotimes[0].decode('ascii')))
+
+    result = numpy.zeros(len(isotimes), dtype=numpy.int64)
+    for length in numpy.unique(lengths):
+        rows = numpy.flatnonzero(lengths == length)
+        layout = calculate_layout(isotimes[rows[0]].decode('ascii'))
+        result[rows] = _decode_uniform(chars[rows], layout)
+    return result
+
+
+def nanoseconds_to_tt2000(ns):
+    """
+    Convert nanoseconds since 1970-01-01T00:00Z, as from isotime_to_nanoseconds, to CDF
+    TT2000, nanoseconds since J2000 including leap seconds.  The leap second table
+    is searched for the whole array at once.  A time within a leap second (23:59:60)
+    is not representable in the input, and so becomes the first second of the next day.
+
+    Parameters
+    ----------
+    ns : numpy.ndarray
+        int64 nanoseconds since 1970-01-01T00:00Z
+
+    Return
+    ------
+    numpy.ndarray
+        int64 TT2000 for each element
+    """
+    ns = numpy.asarray(ns, dtype=numpy.int64)
+    i = numpy.searchsorted(_leap_second_ns, ns, side='right')
+    tt2000 = ns + _tt2000_offset_ns[i]
+    early = i == 0
+    if early.any():
+        tt2000[early] += _drifting_tai_utc_ns(ns[early])
+    return tt2000
+
+
+def _drifting_tai_utc_ns(ns):
+    """return TAI-UTC in nanoseconds for times before 1972, truncated like the CDF library."""
+    j = numpy.searchsorted(_drifting_ns, ns, side='right')
+    mjd = numpy.floor_divide(ns, _NS_PER_DAY) + _MJD_1970 + 0.5
+    seconds = _drifting_offset[j] + (mjd - _drifting_mjd[j]) * _drifting_rate[j]
+    return numpy.where(j > 0, seconds * 1e9, 0).astype(numpy.int64)
+
+
+def isotime_to_tt2000(isotime_array):
+    """
+    Convert the HAPI isotimes to CDF TT2000 without creating datetime objects.
+
+    Parameters
+    ----------
+    isotime_array : array of bytes
+        each element a HAPI isotime
+
+    Return
+    ------
+    numpy.ndarray
+        int64 TT2000 for each element
+    """
+    return nanoseconds_to_tt2000(isotime_to_nanoseconds(isotime_array))
+
+
+def isotime_to_datetime64(isotime_array):
+    """
+    Convert the HAPI isotimes to numpy datetime64[ns].
+
+    Parameters
+    ----------
+    isotime_array : array of bytes
+        each element a HAPI isotime
+
+    Return
+    ------
+    numpy.ndarray
+        datetime64[ns] for each element
+    """
+    return isotime_to_nanoseconds(isotime_array).view('M8[ns]')
+
+
+def isotime_to_datetime(isotime_array):
+    """
+    Convert the HAPI isotimes to datetime.datetime objects, for libraries which need them.
+    Note the datetimes are naive, implicitly UTC, and have microsecond resolution.
+
+    Parameters
+    ----------
+    isotime_array : array of bytes
+        each element a HAPI isotime
+
+    Return
+    ------
+    numpy.ndarray
+        object array with a datetime.datetime for each element
+    """
+    return nanoseconds_to_datetime(isotime_to_nanoseconds(isotime_array))
+
+
+def nanoseconds_to_datetime(ns):
+    """
+    Convert nanoseconds since 1970-01-01T00:00Z to naive datetime.datetime objects, to the microsecond.
+
+    Parameters
+    ----------
+    ns : numpy.ndarray
+        int64 nanoseconds since 1970-01-01T00:00Z
+
+    Return
+    ------
+    numpy.ndarray
+        object array with a datetime.datetime for each element
+    """
+    return numpy.asarray(ns, dtype=numpy.int64).view('M8[ns]').astype('M8[us]').astype(object)
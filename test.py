@@ -5,7 +5,9 @@ import spacepy.datamodel as dm
 from fromHapiToSunPy import hapi_to_time_series
 import fromHapiToCDF
 import fromHapiToSpaceData
+import hapiTimes
 import hapiclient
+import numpy
 
 
 def prepare_output_file(name):
@@ -22,6 +24,27 @@ def prepare_output_file(name):
     return filename
 
 
+def make_hapidata(n):
+    """make a small HAPI response with a scalar and a spectrogram, without a server."""
+    meta = {'parameters': [{'name': 'Time', 'type': 'isotime', 'length': 24, 'units': 'UTC'},
+                           {'name': 'mag', 'type': 'double', 'units': 'nT'},
+                           {'name': 'spec', 'type': 'double', 'units': 'counts', 'size': [4],
+                            'bins': [{'name': 'energy', 'units': 'eV', 'ranges': [[1, 2], [2, 4], [4, 8], [8, 16]]}]}]}
+    data = numpy.zeros(n, dtype=[('Time', 'S24'), ('mag', '<f8'), ('spec', '<f8', 4)])
+    times = numpy.datetime64('2016-01-01T00:00:00.000') + numpy.arange(n) * numpy.timedelta64(1, 's')
+    data['Time'] = numpy.char.add(numpy.datetime_as_string(times), 'Z')
+    data['mag'] = numpy.arange(n)
+    data['spec'] = numpy.arange(n * 4).reshape(n, 4)
+    return data, meta
+
+
+def slow_convert(hapidata):
+    """stand in for an adapter which takes a while, returning when it finished."""
+    import time
+    time.sleep(0.05)
+    return time.monotonic()
+
+
 class Test(unittest.TestCase):
 
     def test_from_hapi_to_cdf(self):
@@ -66,6 +89,691 @@ class Test(unittest.TestCase):
         with self.assertRaises(ValueError):
             fmt = fromHapiToSpaceData.calculate_format_str('2012-01-01T123')
 
+    def test_isotime_to_datetime64(self):
+        """Decodes each isotime layout without a server"""
+        tests = {b'2016-001T00:00:00.000Z': '2016-01-01T00:00:00.000',
+                 b'2016-366T23:59:59.123Z': '2016-12-31T23:59:59.123',
+                 b'2016-02-29T01:02:03Z': '2016-02-29T01:02:03',
+                 b'2016-02-29T01:02Z': '2016-02-29T01:02',
+                 b'2016-060Z': '2016-02-29',
+                 b'2016-02-29T01:02:03.123456789Z': '2016-02-29T01:02:03.123456789'}
+        for k in tests:
+            t = hapiTimes.isotime_to_datetime64(numpy.array([k]))
+            self.assertEqual(t[0], numpy.datetime64(tests[k], 'ns'))
+
+        # mixed lengths are decoded in groups
+        t = hapiTimes.isotime_to_datetime64(numpy.array([b'2016-02-29T01:02:03.5Z', b'2016-02-29T01:02:04Z']))
+        self.assertEqual(t[1] - t[0], numpy.timedelta64(500, 'ms'))
+
+        self.assertEqual(len(hapiTimes.isotime_to_datetime64([])), 0)
+        self.assertEqual(len(fromHapiToSpaceData.convert_times(numpy.array([], dtype='S24'))), 0)
+
+        # fields out of range are refused rather than carried into the next month or year
+        for k in [b'2016-02-30Z', b'2015-02-29Z', b'2016-13-01Z', b'2016-00-01Z', b'2016-04-31T00:00Z',
+                  b'2015-366Z', b'2016-000Z', b'2016-367Z', b'2016-01-01T24:00Z', b'2016-01-01T23:60Z',
+                  b'2016-01-01T23:59:61Z']:
+            with self.assertRaises(ValueError):
+                hapiTimes.isotime_to_datetime64(numpy.array([b'2016-01-01T00:00:00Z', k]))
+        t = hapiTimes.isotime_to_datetime64([b'2016-12-31T23:59:60Z'])
+        self.assertEqual(t[0], numpy.datetime64('2017-01-01T00:00:00', 'ns'))
+
+    def test_isotime_to_tt2000(self):
+        """TT2000 from the leap second table agrees with the CDF library"""
+        import spacepy.pycdf
+        isotimes = numpy.array([b'1998-12-31T23:59:59.999Z', b'1999-01-01T00:00:00.000Z',
+                                b'2000-01-01T12:00:00.000Z', b'2016-12-31T23:59:59.000Z',
+                                b'2017-01-01T00:00:00.000Z', b'2022-09-03T12:34:56.789Z'])
+        tt2000 = hapiTimes.isotime_to_tt2000(isotimes)
+        for t, dt in zip(tt2000, hapiTimes.isotime_to_datetime(isotimes)):
+            self.assertEqual(t, spacepy.pycdf.lib.datetime_to_tt2000(dt))
+
+    def test_tt2000_before_1972(self):
+        """Times before 1972, when TAI-UTC drifted, round-trip through a CDF like the CDF library"""
+        import spacepy.pycdf
+        data, meta = make_hapidata(4)
+        data['Time'] = [b'1959-12-31T12:00:00.000Z', b'1963-06-01T00:00:00.000Z',
+                        b'1968-01-01T00:00:00.000Z', b'1971-12-31T23:00:00.000Z']
+        times = hapiTimes.isotime_to_datetime(data['Time'])
+        for t, dt in zip(hapiTimes.isotime_to_tt2000(data['Time']), times):
+            self.assertEqual(t, spacepy.pycdf.lib.datetime_to_tt2000(dt))
+
+        filename = prepare_output_file('tt2000Before1972.cdf')
+        fromHapiToCDF.to_CDF((data, meta), filename)
+        with spacepy.pycdf.CDF(filename) as cdf:
+            self.assertEqual(list(cdf['Time'][...]), list(times))
+
+    def test_cdf_writer_binary_chunks(self):
+        """Streaming binary chunks which split records gives the same CDF as to_CDF"""
+        import spacepy.pycdf
+        import hapiRecords
+        data, meta = make_hapidata(100)
+        whole = prepare_output_file('cdfWriterWhole.cdf')
+        fromHapiToCDF.to_CDF((data, meta), whole)
+
+        streamed = prepare_output_file('cdfWriterStreamed.cdf')
+        buf = data.astype(hapiRecords.record_dtype(meta, binary=True)).tobytes()
+        with fromHapiToCDF.CDFWriter(meta, streamed) as writer:
+            for i in range(0, len(buf), 1000):
+                writer.write_binary(buf[i:i + 1000])
+
+        with spacepy.pycdf.CDF(whole) as a, spacepy.pycdf.CDF(streamed) as b:
+            self.assertEqual(sorted(a.keys()), sorted(b.keys()))
+            for name in a:
+                numpy.testing.assert_array_equal(a.raw_var(name)[...], b.raw_var(name)[...])
+
+    def test_to_cdf_append(self):
+        """Appending overlapping responses adds only the newer records, and other metadata is refused"""
+        import copy
+        import spacepy.pycdf
+        data, meta = make_hapidata(100)
+        whole = prepare_output_file('appendWhole.cdf')
+        fromHapiToCDF.to_CDF((data, meta), whole)
+
+        appended = prepare_output_file('appended.cdf')
+        fromHapiToCDF.to_CDF((data[:60], meta), appended, append=True)
+        fromHapiToCDF.to_CDF((data[40:], meta), appended, append=True)
+        fromHapiToCDF.to_CDF((data[:10], meta), appended, append=True)
+        with spacepy.pycdf.CDF(whole) as a, spacepy.pycdf.CDF(appended) as b:
+            for name in a:
+                numpy.testing.assert_array_equal(a.raw_var(name)[...], b.raw_var(name)[...])
+
+        meta2 = copy.deepcopy(meta)
+        meta2['parameters'][1]['units'] = 'pT'
+        with self.assertRaises(ValueError):
+            fromHapiToCDF.to_CDF((data, meta2), appended, append=True)
+
+        # bins with the same centers but other ranges or units are refused too
+        for field, value in [('ranges', [[1, 2], [2.5, 3.5], [4, 8], [8, 16]]), ('units', 'keV'),
+                             ('centers', [1.5, 3, 6, 12])]:
+            meta2 = copy.deepcopy(meta)
+            bins = meta2['parameters'][2]['bins'][0]
+            if field == 'centers':
+                del bins['ranges']
+            bins[field] = value
+            with self.assertRaises(ValueError):
+                fromHapiToCDF.to_CDF((data, meta2), appended, append=True)
+
+    def test_to_cdf_layout(self):
+        """Compressed CDFs with a blocking factor and explicit types hold the same data"""
+        import spacepy.pycdf
+        data, meta = make_hapidata(100)
+        plain = prepare_output_file('layoutPlain.cdf')
+        fromHapiToCDF.to_CDF((data, meta), plain)
+
+        for compression in fromHapiToCDF.COMPRESSIONS:
+            compressed = prepare_output_file('layout_%s.cdf' % compression)
+            fromHapiToCDF.to_CDF((data, meta), compressed, compression=compression, blocking_factor=64)
+            with spacepy.pycdf.CDF(plain) as a, spacepy.pycdf.CDF(compressed) as b:
+                for name in a:
+                    numpy.testing.assert_array_equal(a.raw_var(name)[...], b.raw_var(name)[...])
+                    self.assertEqual(a[name].type(), b[name].type())
+                name = meta['parameters'][1]['name']
+                self.assertEqual(b[name].compress()[0],
+                                 getattr(spacepy.pycdf.const, fromHapiToCDF.COMPRESSIONS[compression]))
+
+        name = meta['parameters'][1]['name']
+        single = prepare_output_file('layoutFloat.cdf')
+        fromHapiToCDF.to_CDF((data, meta), single, types={name: spacepy.pycdf.const.CDF_FLOAT})
+        with spacepy.pycdf.CDF(single) as cdf:
+            self.assertEqual(cdf[name].type(), spacepy.pycdf.const.CDF_FLOAT.value)
+            numpy.testing.assert_allclose(cdf[name][...], data[name], rtol=1e-6)
+
+        with self.assertRaises(ValueError):
+            fromHapiToCDF.to_CDF((data, meta), prepare_output_file('layoutBad.cdf'), compression='zip')
+
+        # a response with no records, like a day without data, gives a CDF with no records
+        empty = prepare_output_file('layoutEmpty.cdf')
+        fromHapiToCDF.to_CDF((data[:0], meta), empty)
+        with spacepy.pycdf.CDF(empty) as cdf:
+            self.assertEqual(len(cdf[name]), 0)
+
+    def test_stream_to_cdf(self):
+        """A binary file and a CSV stream with a header give the same CDF as to_CDF"""
+        import io
+        import json
+        import spacepy.pycdf
+        import hapiServer
+        data, meta = make_hapidata(100)
+        whole = prepare_output_file('streamWhole.cdf')
+        fromHapiToCDF.to_CDF((data, meta), whole)
+
+        binfile = prepare_output_file('stream.bin')
+        with open(binfile, 'wb') as f:
+            f.write(hapiServer.to_binary(data, meta))
+        frombinary = prepare_output_file('streamBinary.cdf')
+        fromHapiToCDF.stream_to_CDF(binfile, meta, frombinary, blocksize=1000)
+
+        header = ('#' + json.dumps(meta) + '\n').encode('utf-8')
+        fromcsv = prepare_output_file('streamCsv.cdf')
+        fromHapiToCDF.stream_to_CDF(io.BytesIO(header + hapiServer.to_csv(data, meta)), None, fromcsv, format='csv')
+
+        with spacepy.pycdf.CDF(whole) as a:
+            for name in (frombinary, fromcsv):
+                with spacepy.pycdf.CDF(name) as b:
+                    self.assertEqual(sorted(a.keys()), sorted(b.keys()))
+                    for v in a:
+                        numpy.testing.assert_array_equal(a.raw_var(v)[...], b.raw_var(v)[...])
+
+    def test_partition(self):
+        """Splits a time range into chunks for parallel requests"""
+        import hapiParallel
+        chunks = hapiParallel.partition('2016-01-01Z', '2016-01-03T12:00Z')
+        self.assertEqual(chunks, [('2016-01-01T00:00:00.000Z', '2016-01-02T00:00:00.000Z'),
+                                  ('2016-01-02T00:00:00.000Z', '2016-01-03T00:00:00.000Z'),
+                                  ('2016-01-03T00:00:00.000Z', '2016-01-03T12:00:00.000Z')])
+
+    def test_parallel_window(self):
+        """Only max_workers chunks are requested ahead of the one taken, and empty intervals are refused"""
+        import time
+        import hapiParallel
+        started = []
+
+        def fetch_chunk(server, dataset, parameters, start, stop, retries, opts):
+            started.append(start)
+            data, meta = make_hapidata(2)
+            data['Time'] = [start.encode(), stop.encode()]
+            return data, meta
+
+        original = hapiParallel._fetch_chunk
+        hapiParallel._fetch_chunk = fetch_chunk
+        try:
+            futures = hapiParallel.fetch('server', 'dataset', '', '2016-01-01Z', '2016-01-11Z', max_workers=3)
+            for i, future in enumerate(futures):
+                future.result()
+                self.assertLessEqual(len(started), i + 1 + 3)
+            self.assertEqual(len(started), 10)
+
+            spacedata = hapiParallel.to_SpaceData_parallel('server', 'dataset', '', '2016-01-01Z', '2016-01-04Z',
+                                                           max_workers=2, processes=0)
+            # the record at each boundary is in both chunks, and kept once
+            self.assertEqual(len(spacedata['Time']), 4)
+            converted = hapiParallel.to_SpaceData_parallel('server', 'dataset', '', '2016-01-01Z', '2016-01-04Z',
+                                                           max_workers=2, processes=2)
+            for name in spacedata:
+                numpy.testing.assert_array_equal(converted[name], spacedata[name])
+
+            # the chunks are read no more than twice the processes ahead of the conversions
+            taken = []
+
+            def taking(futures):
+                try:
+                    for future in futures:
+                        taken.append(time.monotonic())
+                        yield future
+                finally:
+                    futures.close()
+            futures = hapiParallel.fetch('server', 'dataset', '', '2016-01-01Z', '2016-01-11Z', max_workers=3)
+            finished = sorted(hapiParallel._convert(taking(futures), slow_convert, 1)[0])
+            for i, t in enumerate(taken):
+                self.assertGreaterEqual(sum(f < t for f in finished), i - 2)
+            with self.assertRaises(ValueError):
+                hapiParallel.fetch('server', 'dataset', '', '2016-01-01Z', '2016-01-01Z')
+        finally:
+            hapiParallel._fetch_chunk = original
+
+    def test_compile_plan(self):
+        """Plans resolve $ref bins and are reused for the same info response"""
+        import copy
+        import hapiPlan
+        data, meta = make_hapidata(1)
+        meta['definitions'] = {'energyBins': meta['parameters'][2]['bins']}
+        meta['parameters'][2]['bins'] = {'$ref': '#/definitions/energyBins'}
+        plan = hapiPlan.compile_plan(meta)
+        self.assertEqual(plan.time_name, 'Time')
+        self.assertEqual([p.name for p in plan.parameters], ['mag', 'spec'])
+        self.assertEqual(plan.parameters[1].depends, ['energy'])
+        self.assertEqual(plan.parameters[0].units, 'nT')
+        self.assertEqual(plan.binary_dtype, hapiPlan.record_dtype(meta, binary=True))
+
+        # hapiclient adds x_ keys which differ for each request
+        meta2 = copy.deepcopy(meta)
+        meta2['x_requestDate'] = '2022-09-03T00:00:00Z'
+        self.assertIs(hapiPlan.compile_plan(meta2), plan)
+
+        meta2['parameters'][1]['units'] = 'pT'
+        self.assertIsNot(hapiPlan.compile_plan(meta2), plan)
+
+    def test_bins_plan(self):
+        """Centers and deltas are computed from the ranges"""
+        import hapiPlan
+        bins = hapiPlan.BinsPlan({'name': 'energy', 'units': 'eV', 'ranges': [[1, 2], [2, 4], [4, 8]]})
+        numpy.testing.assert_array_equal(bins.centers, [1.5, 3, 6])
+        numpy.testing.assert_array_equal(bins.delta_minus, [0.5, 1, 2])
+        numpy.testing.assert_array_equal(bins.delta_plus, [0.5, 1, 2])
+
+        bins = hapiPlan.BinsPlan({'name': 'energy', 'units': 'eV', 'centers': [1, 2, 3]})
+        numpy.testing.assert_array_equal(bins.centers, [1, 2, 3])
+        self.assertIsNone(bins.delta_minus)
+
+        bins = hapiPlan.BinsPlan({'name': 'frequency', 'units': 'Hz', 'centers': 'frequencies'})
+        self.assertIsNone(bins.centers)
+
+    def test_bins_same_name(self):
+        """Bins with the same name but other units get their own variable"""
+        import copy
+        import spacepy.pycdf
+        data, meta = make_hapidata(10)
+        spec2 = copy.deepcopy(meta['parameters'][2])
+        spec2['name'] = 'spec2'
+        spec2['bins'][0]['units'] = 'keV'
+        spec3 = copy.deepcopy(meta['parameters'][2])
+        spec3['name'] = 'spec3'
+        meta['parameters'] += [spec2, spec3]
+        both = numpy.zeros(len(data), dtype=data.dtype.descr + [('spec2', '<f8', 4), ('spec3', '<f8', 4)])
+        for name in data.dtype.names:
+            both[name] = data[name]
+
+        spacedata = fromHapiToSpaceData.to_SpaceData((both, meta))
+        self.assertEqual([spacedata[p].attrs['DEPEND_1'] for p in ('spec', 'spec2', 'spec3')],
+                         ['energy', 'energy_spec2', 'energy'])
+        self.assertEqual(spacedata['energy_spec2'].attrs['UNITS'], 'keV')
+
+        filename = prepare_output_file('binsSameName.cdf')
+        fromHapiToCDF.to_CDF((both, meta), filename)
+        with spacepy.pycdf.CDF(filename) as cdf:
+            self.assertEqual(cdf['spec2'].attrs['DEPEND_1'], 'energy_spec2')
+            self.assertEqual(cdf['energy'].attrs['UNITS'], 'eV')
+            self.assertEqual(cdf['energy_spec2'].attrs['UNITS'], 'keV')
+
+    def test_hapi_to_time_series_columns(self):
+        """Spectrogram columns are split and named, and ndim=3 data can be flattened"""
+        data, meta = make_hapidata(10)
+        ts = hapi_to_time_series((data, meta))
+        self.assertEqual(list(ts.columns), ['mag', 'spec_0', 'spec_1', 'spec_2', 'spec_3'])
+        numpy.testing.assert_array_equal(ts.to_dataframe()['spec_2'], data['spec'][:, 2])
+
+        data = data.astype([('Time', 'S24'), ('mag', '<f8'), ('spec', '<f8', (2, 2))])
+        meta['parameters'][2]['size'] = [2, 2]
+        meta['parameters'][2].pop('bins')
+        ts = hapi_to_time_series((data, meta), flatten=True)
+        self.assertEqual(list(ts.columns), ['mag', 'spec_0_0', 'spec_0_1', 'spec_1_0', 'spec_1_1'])
+
+    def test_resolve_unit(self):
+        """Known CDF unit strings are used first, and unknown units warn once"""
+        import warnings
+        import astropy.units as u
+        from sunpy.util.exceptions import SunpyUserWarning
+        import hapiUnits
+        self.assertEqual(hapiUnits.resolve_unit('nT GSE'), u.nT)
+        self.assertEqual(hapiUnits.resolve_unit(' none'), u.dimensionless_unscaled)
+        self.assertEqual(hapiUnits.resolve_unit('km/s'), u.km / u.s)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            for i in range(3):
+                self.assertEqual(hapiUnits.resolve_unit('furlongs per glarg'), u.dimensionless_unscaled)
+        self.assertEqual(len(w), 1)
+        self.assertTrue(issubclass(w[0].category, SunpyUserWarning))
+
+    def test_to_space_data_zero_copy(self):
+        """SpaceData parameters share memory with the hapiclient array unless copy=True"""
+        data, meta = make_hapidata(10)
+        spacedata = fromHapiToSpaceData.to_SpaceData((data, meta))
+        for name in ['mag', 'spec']:
+            self.assertTrue(numpy.shares_memory(spacedata[name], data))
+            self.assertIsInstance(spacedata[name], dm.dmarray)
+        self.assertEqual(spacedata['spec'].attrs['DEPEND_1'], 'energy')
+
+        spacedata = fromHapiToSpaceData.to_SpaceData((data, meta), copy=True)
+        for name in ['mag', 'spec']:
+            self.assertFalse(numpy.shares_memory(spacedata[name], data))
+            numpy.testing.assert_array_equal(spacedata[name], data[name])
+
+    def test_lazy_space_data(self):
+        """Variables of a LazySpaceData are converted when first read"""
+        data, meta = make_hapidata(10)
+        spacedata = fromHapiToSpaceData.to_SpaceData((data, meta))
+        lazy = fromHapiToSpaceData.LazySpaceData((data, meta))
+        self.assertEqual(list(lazy.keys()), list(spacedata.keys()))
+        self.assertEqual(lazy.variable_attrs('spec')['DEPEND_1'], 'energy')
+        self.assertFalse(lazy.is_materialized('spec'))
+        numpy.testing.assert_array_equal(lazy['spec'], spacedata['spec'])
+        self.assertTrue(lazy.is_materialized('spec'))
+        self.assertFalse(lazy.is_materialized('Time'))
+        for name in spacedata:
+            self.assertEqual(lazy[name].attrs, spacedata[name].attrs)
+
+        # copying as a dict gives the converted variables, never a placeholder
+        lazy = fromHapiToSpaceData.LazySpaceData((data, meta))
+        self.assertEqual(len(lazy), len(spacedata))
+        self.assertIn('spec', lazy)
+        for copied in (dict(lazy), {**lazy}):
+            self.assertEqual(list(copied), list(spacedata.keys()))
+            for name in copied:
+                self.assertIsInstance(copied[name], dm.dmarray)
+        del lazy['mag']
+        self.assertNotIn('mag', lazy)
+        self.assertEqual(len(lazy), len(spacedata) - 1)
+
+    def test_synthetic_kinds(self):
+        """Every kind of synthetic response converts with each adapter"""
+        import warnings
+        import hapiSynthetic
+        for kind in hapiSynthetic.KINDS:
+            hapidata = hapiSynthetic.synthetic_hapidata(kind, 50, nchan=8)
+            fromHapiToCDF.to_CDF(hapidata, prepare_output_file('synthetic_%s.cdf' % kind))
+            spacedata = fromHapiToSpaceData.to_SpaceData(hapidata)
+            self.assertEqual(len(spacedata['Time']), 50)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                ts = hapi_to_time_series(hapidata)
+            self.assertEqual(len(ts.to_dataframe()), 50)
+
+            # the CSV and binary the local server sends read back as the same records
+            import hapiRecords
+            import hapiServer
+            data, meta = hapidata
+            for parsed in (hapiRecords.parse_csv(hapiServer.to_csv(data, meta), meta),
+                           hapiRecords.parse_binary(hapiServer.to_binary(data, meta), meta)):
+                for name in data.dtype.names:
+                    numpy.testing.assert_array_equal(parsed[name], data[name], '%s %s' % (kind, name))
+
+    def test_local_hapi_server(self):
+        """hapiclient reads the same records from the local server in CSV and binary"""
+        import tempfile
+        from hapiServer import HapiServer
+        with HapiServer() as server:
+            opts = {'logging': False, 'usecache': False, 'cachedir': tempfile.mkdtemp()}
+            csv, meta = hapiclient.hapi(server.url, 'specBins.ref', 'flux', '2016-01-01T00:00:00Z',
+                                        '2016-01-01T00:00:10Z', format='csv', **opts)
+            binary, meta = hapiclient.hapi(server.url, 'specBins.ref', 'flux', '2016-01-01T00:00:05Z',
+                                           '2016-01-01T00:00:10Z', format='binary', **opts)
+        self.assertEqual(len(csv), 10)
+        # hapiclient reads CSV through pandas, whose float parser is not exact in the last bit
+        self.assertTrue(numpy.allclose(csv['flux'][5:], binary['flux'], rtol=1e-15))
+        spacedata = fromHapiToSpaceData.to_SpaceData((binary, meta))
+        self.assertEqual(spacedata['flux'].attrs['DEPEND_1'], 'energy')
+
+    def test_async_adapters(self):
+        """Concurrent async requests give the same records as hapiclient, and errors carry the HAPI status"""
+        import asyncio
+        import tempfile
+        import hapiAsync
+        from hapiErrors import HapiError
+        from hapiServer import HapiServer
+        start, stop = '2016-01-01T00:00:00Z', '2016-01-01T00:10:00Z'
+
+        async def requests(url):
+            async with hapiAsync.HapiSession() as session:
+                results = await asyncio.gather(session.hapi(url, 'specBins.ref', '', start, stop),
+                                               session.to_SpaceData(url, 'specBins.ref', 'flux', start, stop),
+                                               session.hapi_to_time_series(url, 'AC_H0_MFI', '', start, stop))
+                with self.assertRaises(HapiError) as context:
+                    await session.hapi(url, 'unknown', '', start, stop)
+                self.assertEqual(context.exception.hapi_code, 1406)
+            return results
+
+        with HapiServer() as server:
+            opts = {'logging': False, 'usecache': False, 'cachedir': tempfile.mkdtemp()}
+            data, meta = hapiclient.hapi(server.url, 'specBins.ref', '', start, stop, **opts)
+            (adata, ameta), spacedata, ts = asyncio.run(requests(server.url))
+        self.assertEqual(adata.dtype, data.dtype)
+        for name in data.dtype.names:
+            numpy.testing.assert_array_equal(adata[name], data[name])
+        self.assertEqual(spacedata['flux'].attrs['DEPEND_1'], 'energy')
+        self.assertEqual(len(ts.to_dataframe()), 600)
+
+    def test_merge(self):
+        """Inputs at other cadences are aligned by nearest, previous and linear within the tolerance"""
+        import hapiMerge
+        data, meta = make_hapidata(100)
+        base = (data[::10], meta)
+        slow = (data[::4], meta)
+        spacedata = fromHapiToSpaceData.to_SpaceData(slow)
+        merged = hapiMerge.merge([base, slow, spacedata, hapi_to_time_series(slow)],
+                                 method=['nearest', 'previous', 'linear', 'nearest'],
+                                 tolerance=[None, None, numpy.timedelta64(4, 's'), numpy.timedelta64(1, 's')])
+        self.assertEqual(len(merged['Time']), 10)
+        numpy.testing.assert_array_equal(merged['mag'], numpy.arange(0, 100, 10))
+        numpy.testing.assert_array_equal(merged['mag_1'], numpy.arange(0, 100, 10) // 4 * 4)
+        numpy.testing.assert_array_equal(merged['mag_2'], [0, 10, 20, 30, 40, 50, 60, 70, 80, 90])
+        numpy.testing.assert_array_equal(merged['spec_2'][:, 1], merged['mag_2'] * 4 + 1)
+        numpy.testing.assert_array_equal(merged['mag_3'][::2], numpy.arange(0, 100, 20))
+        numpy.testing.assert_array_equal(merged['mag_3'][1::2], numpy.nan)
+        self.assertEqual(merged['spec_2'].attrs['DEPEND_1'], 'energy_2')
+        self.assertEqual(merged['energy_2'].attrs['DELTA_PLUS_VAR'], 'energyDeltaPlus_2')
+
+        ts = hapiMerge.merge([base, slow], times=numpy.timedelta64(5, 's'), method='linear', output='TimeSeries')
+        df = ts.to_dataframe()
+        self.assertEqual(len(df), 19)
+        numpy.testing.assert_array_equal(df['mag_1'], numpy.arange(0, 91, 5))
+        self.assertEqual(str(ts.units['mag_1']), 'nT')
+
+        # fill values are missing whether the input is a HAPI response, SpaceData or TimeSeries
+        meta['parameters'][1]['fill'] = '-1e31'
+        filled = data.copy()
+        filled['mag'][8] = -1e31
+        spacedata = fromHapiToSpaceData.to_SpaceData((filled, meta))
+        self.assertEqual(spacedata['mag'].attrs['FILLVAL'], -1e31)
+        merged = hapiMerge.merge([base, (filled, meta), spacedata, hapi_to_time_series((filled, meta))],
+                                 times=['2016-01-01T00:00:07.500Z'], method='linear')
+        for name in ('mag_1', 'mag_2', 'mag_3'):
+            self.assertTrue(numpy.isnan(merged[name][0]), name)
+
+    def test_reduce(self):
+        """Reduced records hold the mean, min, max and count of each bucket, leaving out fill"""
+        import hapiReduce
+        data, meta = make_hapidata(100)
+        meta['parameters'][1]['fill'] = '-1e31'
+        data['mag'][5] = -1e31
+        reduction = hapiReduce.Reduction(bucket=numpy.timedelta64(10, 's'))
+        spacedata = fromHapiToSpaceData.to_SpaceData((data, meta), reduce=reduction)
+        self.assertEqual(len(spacedata['Time']), 10)
+        self.assertEqual(spacedata['Time'][0], hapiTimes.isotime_to_datetime([b'2016-01-01T00:00:05Z'])[0])
+        numpy.testing.assert_array_equal(spacedata['mag_count'], [9] + [10] * 9)
+        self.assertEqual(spacedata['mag'][0], 40 / 9.)
+        numpy.testing.assert_array_equal(spacedata['mag'][1:], numpy.arange(14.5, 100, 10))
+        numpy.testing.assert_array_equal(spacedata['spec_min'][:, 2], numpy.arange(0, 400, 40) + 2)
+        numpy.testing.assert_array_equal(spacedata['spec_max'][:, 2], numpy.arange(36, 400, 40) + 2)
+        self.assertEqual(spacedata['spec_max'].attrs['DEPEND_1'], 'energy')
+
+        ts = hapi_to_time_series((data, meta), reduce=hapiReduce.Reduction(points=4, statistics=('max',)))
+        self.assertEqual(list(ts.to_dataframe().columns[:3]), ['mag', 'mag_max', 'spec_0'])
+        self.assertLessEqual(len(ts.to_dataframe()), 5)
+        self.assertEqual(ts.to_dataframe()['mag_max'].max(), 99)
+
+        cdfname = prepare_output_file('reduced.cdf')
+        fromHapiToCDF.to_CDF((data, meta), cdfname, reduce=reduction)
+        import spacepy.pycdf
+        with spacepy.pycdf.CDF(cdfname) as cdf:
+            numpy.testing.assert_array_equal(cdf['spec_count'][...], 10)
+
+    def test_select(self):
+        """Windows of the outputs are views found from the time index, with their bins unchanged"""
+        import datetime
+        import hapiIndex
+        import hapiMerge
+        hapidata = make_hapidata(100)
+        spacedata = fromHapiToSpaceData.to_SpaceData(hapidata)
+        window = hapiIndex.select(spacedata, '2016-01-01T00:00:10Z', datetime.datetime(2016, 1, 1, 0, 0, 20))
+        numpy.testing.assert_array_equal(window['mag'], numpy.arange(10, 20))
+        self.assertTrue(numpy.shares_memory(window['spec'], spacedata['spec']))
+        self.assertIs(window['energy'], spacedata['energy'])
+        self.assertEqual(window['spec'].attrs['DEPEND_0'], 'Time')
+        self.assertEqual(len(window['Time']), 10)
+        inner = hapiIndex.select(window, numpy.datetime64('2016-01-01T00:00:15'), '2016-01-01T00:01Z')
+        numpy.testing.assert_array_equal(inner['mag'], numpy.arange(15, 20))
+        self.assertEqual(len(hapiIndex.select(spacedata, '2016-01-02Z', '2016-01-03Z')['mag']), 0)
+
+        ts = hapi_to_time_series(hapidata)
+        df = hapiIndex.select(ts, '2016-01-01T00:00:10Z', '2016-01-01T00:00:20Z').to_dataframe()
+        numpy.testing.assert_array_equal(df['mag'], numpy.arange(10, 20))
+
+        # results made without an index, with records out of order, are selected in time order
+        merged = hapiMerge.merge([(hapidata[0][::-1], hapidata[1])])
+        window = hapiIndex.select(merged, '2016-01-01T00:00:10Z', '2016-01-01T00:00:20Z')
+        numpy.testing.assert_array_equal(window['mag'], numpy.arange(10, 20))
+
+    def test_import_budget(self):
+        """The adapter modules leave pandas, sunpy, spacepy.pycdf and hapiclient until used"""
+        import benchmark
+        import fromHapiToSunPy
+        import hapiAdapters
+        import hapiUnits
+        # the time against IMPORT_BUDGET is checked by benchmark.py --imports, not here
+        for result in benchmark.import_times(repeat=1):
+            self.assertEqual(result['heavy'], [], result['module'])
+        self.assertIs(fromHapiToSunPy._known_units, hapiUnits.known_units())
+        self.assertIs(hapiAdapters.to_CDF, fromHapiToCDF.to_CDF)
+        self.assertIs(hapiAdapters.fromHapiToSpaceData, fromHapiToSpaceData)
+        with self.assertRaises(AttributeError):
+            hapiAdapters.to_pdf
+
+    def test_stage_timings(self):
+        """Each adapter reports its stages to the registered hooks, and nothing when none are"""
+        import hapiInstrument
+        hapidata = make_hapidata(100)
+        with hapiInstrument.Timings() as timings:
+            fromHapiToCDF.to_CDF(hapidata, prepare_output_file('timings.cdf'))
+            fromHapiToSpaceData.to_SpaceData(hapidata)
+            hapi_to_time_series(hapidata)
+        totals = timings.totals()
+        for key in [('to_CDF', 'times'), ('to_CDF', 'write'), ('to_CDF', 'close'), ('to_SpaceData', 'bins'),
+                    ('hapi_to_time_series', 'units'), ('hapi_to_time_series', 'dataframe')]:
+            self.assertIn(key, totals)
+        self.assertEqual(totals[('to_CDF', 'times')].records, 100)
+        n = len(timings.timings)
+        fromHapiToSpaceData.to_SpaceData(hapidata)
+        self.assertEqual(len(timings.timings), n)
+
+    def test_batch_manifest(self):
+        """Finished outputs are recorded in the manifest and skipped when the batch is run again"""
+        import shutil
+        import hapiBatch
+        from hapiServer import HapiServer
+        outdir = '/tmp/python_dataset_adapters/batch/'
+        shutil.rmtree(outdir, ignore_errors=True)
+        manifest = outdir + 'manifest.jsonl'
+        with HapiServer() as server:
+            requests = [{'server': server.url, 'dataset': 'poolTemperature', 'start': '2016-01-01Z', 'stop': '2016-01-03Z'}]
+            jobs = hapiBatch.expand_jobs(requests, outdir)
+            self.assertEqual([os.path.basename(job['output']) for job in jobs],
+                             ['poolTemperature_20160101.cdf', 'poolTemperature_20160102.cdf'])
+            counts = hapiBatch.run(jobs, manifest, workers=0, log=None)
+            self.assertEqual(counts['converted'], 2)
+            self.assertEqual(len(hapiBatch.read_manifest(manifest)), 2)
+
+            # outputs with the size and time in the manifest are not read again
+            entry = list(hapiBatch.read_manifest(manifest).values())[0]
+            hashed = []
+            file_sha256 = hapiBatch.file_sha256
+            hapiBatch.file_sha256 = lambda filename: hashed.append(filename) or file_sha256(filename)
+            try:
+                self.assertTrue(hapiBatch.is_done(entry))
+                self.assertEqual(hashed, [])
+                self.assertTrue(hapiBatch.is_done(entry, recheck=True))
+                self.assertEqual(len(hashed), 1)
+                os.utime(entry['job']['output'], ns=(0, 0))
+                self.assertTrue(hapiBatch.is_done(entry))
+                self.assertEqual(len(hashed), 2)
+            finally:
+                hapiBatch.file_sha256 = file_sha256
+
+            os.remove(jobs[1]['output'])
+            counts = hapiBatch.run(jobs, manifest, workers=0, log=None)
+            self.assertEqual((counts['skipped'], counts['converted']), (1, 1))
+
+            counts = hapiBatch.run(jobs, manifest, workers=0, recheck=True, log=None)
+            self.assertEqual(counts['unchanged'], 2)
+
+        # an unknown format is refused before anything is converted
+        with self.assertRaises(ValueError):
+            hapiBatch.write_output(None, outdir + 'unknown.pdf', 'pdf')
+
+    def test_converted_cache(self):
+        """Overlapping requests read only the gaps, and give what converting the whole request gives"""
+        import shutil
+        import tempfile
+        from hapiCache import ConvertedCache, gaps
+        from hapiServer import HapiServer
+        self.assertEqual(gaps([(10, 20), (30, 40)], 0, 35), [(0, 10), (20, 30)])
+
+        directory = '/tmp/python_dataset_adapters/cache/'
+        shutil.rmtree(directory, ignore_errors=True)
+        requests = []
+
+        def fetch(*args, **opts):
+            requests.append(args[3:5])
+            return hapiclient.hapi(*args, **opts)
+
+        with HapiServer() as server:
+            opts = {'logging': False, 'usecache': False, 'cachedir': tempfile.mkdtemp()}
+            cache = ConvertedCache(directory, fetch=fetch, opts=opts)
+            cache.to_SpaceData(server.url, 'specBins.ref', '', '2016-01-01T00:00Z', '2016-01-01T01:00Z')
+            spacedata = cache.to_SpaceData(server.url, 'specBins.ref', '', '2016-01-01T00:30Z', '2016-01-01T02:00Z')
+            self.assertEqual(requests[1], ('2016-01-01T01:00:00.000Z', '2016-01-01T02:00:00.000Z'))
+            self.assertEqual(cache.coverage(server.url, 'specBins.ref', ''),
+                             [('2016-01-01T00:00:00.000Z', '2016-01-01T02:00:00.000Z')])
+            whole = fromHapiToSpaceData.to_SpaceData(
+                hapiclient.hapi(server.url, 'specBins.ref', '', '2016-01-01T00:30Z', '2016-01-01T02:00Z', **opts))
+
+            with self.assertRaises(ValueError):
+                cache.to_SpaceData(server.url, 'specBins.ref', '', '2016-01-01T02:00Z', '2016-01-01T02:00Z')
+
+            # a failed read keeps the pieces already written in the index
+            def failing(*args, **opts):
+                if args[3] >= '2016-01-01T02':
+                    raise IOError('server went away')
+                return fetch(*args, **opts)
+            cache.fetch = failing
+            with self.assertRaises(IOError):
+                cache.to_SpaceData(server.url, 'specBins.ref', '', '2015-12-31T23:00Z', '2016-01-01T03:00Z')
+            self.assertEqual(cache.coverage(server.url, 'specBins.ref', ''),
+                             [('2015-12-31T23:00:00.000Z', '2016-01-01T02:00:00.000Z')])
+            self.assertEqual(sorted(os.listdir(directory)), sorted([e['file'] for e in cache._entries] + ['index.json']))
+        self.assertEqual(sorted(spacedata.keys()), sorted(whole.keys()))
+        for name in whole:
+            numpy.testing.assert_array_equal(spacedata[name], whole[name])
+
+    def test_arrow_parquet(self):
+        """Spectrograms become fixed-size lists, and a Parquet dataset reads back the same table"""
+        import shutil
+        import fromHapiToArrow
+        data, meta = make_hapidata(100)
+        table = fromHapiToArrow.to_Table((data, meta))
+        self.assertEqual(str(table.schema.field('spec').type), 'fixed_size_list<item: double>[4]')
+        self.assertEqual(table.schema.field('mag').metadata[b'units'], b'nT')
+        numpy.testing.assert_array_equal(table.column('spec').combine_chunks().flatten().to_numpy(),
+                                         data['spec'].reshape(-1))
+        self.assertEqual(fromHapiToArrow.hapi_meta(table)['parameters'][2]['name'], 'spec')
+
+        root = '/tmp/python_dataset_adapters/parquet/'
+        shutil.rmtree(root, ignore_errors=True)
+        fromHapiToArrow.write_parquet((data, meta), root, partition='day')
+        self.assertTrue(fromHapiToArrow.read_parquet(root).equals(table))
+
+    def test_xarray_netcdf(self):
+        """Bins become coordinates, and the NetCDF file reads back lazily as the same Dataset"""
+        import fromHapiToXarray
+        data, meta = make_hapidata(100)
+        ds = fromHapiToXarray.to_xarray((data, meta))
+        self.assertEqual(ds['spec'].dims, ('Time', 'energy'))
+        numpy.testing.assert_array_equal(ds['energy'], [1.5, 3, 6, 12])
+        self.assertEqual(ds['spec'].attrs['units'], 'counts')
+
+        filename = prepare_output_file('xarray.nc')
+        fromHapiToXarray.to_netcdf((data, meta), filename, chunk_bytes=320)
+        with fromHapiToXarray.open_netcdf(filename) as nc:
+            self.assertEqual(nc['spec'].data.chunksize, (10, 4))
+            self.assertTrue(nc.identical(ds))
+            window = nc['spec'].sel(Time=slice('2016-01-01T00:00:10', '2016-01-01T00:00:19'))
+            numpy.testing.assert_array_equal(window, data['spec'][10:20])
+
+        # chunks smaller than a record still hold one record
+        fromHapiToXarray.to_netcdf((data, meta), filename, chunk_bytes=4)
+        with fromHapiToXarray.open_netcdf(filename) as nc:
+            self.assertEqual(nc['Time'].encoding['chunksizes'], (1,))
+            self.assertTrue(nc.identical(ds))
+
+        # the HAPI fill is the _FillValue which xarray masks when reading
+        meta['parameters'][1]['fill'] = '-1e31'
+        data['mag'][3] = -1e31
+        ds = fromHapiToXarray.to_xarray((data, meta))
+        self.assertEqual(ds['mag'].encoding['_FillValue'], -1e31)
+        fromHapiToXarray.to_netcdf((data, meta), filename)
+        with fromHapiToXarray.open_netcdf(filename) as nc:
+            self.assertTrue(numpy.isnan(nc['mag'][3]))
+            self.assertEqual(nc['mag'][4], 4)
+
     def test_convert_times(self):
         server = 'https://jfaden.net/HapiServerDemo/hapi'
         dataset = 'poolTemperature'